@@ -10,10 +10,15 @@ sys.path.insert(0, project_root)
 try:
     from utils.config_manager import ConfigManager
     from utils.llm_client import LLMClient
+    from utils.schema_prompt import load_schema_block, build_schema_messages
+    from utils.sql_cache import lookup_cached_sql
 except ImportError:
     # 如果导入失败，尝试相对导入
     ConfigManager = None
     LLMClient = None
+    load_schema_block = None
+    build_schema_messages = None
+    lookup_cached_sql = None
 
 router = APIRouter()
 
@@ -37,6 +42,7 @@ class GenerateSQLResponse(BaseModel):
     sql: Optional[str] = Field(None, description="生成的SQL语句", example="SELECT * FROM table_name LIMIT 10")
     success: bool = Field(..., description="是否成功生成SQL", example=True)
     error: Optional[str] = Field(None, description="错误信息（如果有）", example=None)
+    cached: bool = Field(False, description="SQL是否来自语义缓存（未调用LLM）", example=False)
 
 @router.post("/query")
 async def query_data(request: QueryRequest):
@@ -87,7 +93,7 @@ async def generate_sql(request: GenerateSQLRequest):
     返回生成的SQL语句，方便系统集成使用。
     """
     try:
-        if ConfigManager is None or LLMClient is None:
+        if ConfigManager is None or LLMClient is None or load_schema_block is None:
             raise HTTPException(status_code=500, detail="系统配置错误，无法加载必要模块")
             
         config_manager = ConfigManager()
@@ -97,43 +103,26 @@ async def generate_sql(request: GenerateSQLRequest):
         if not llm_config:
             raise HTTPException(status_code=400, detail="LLM配置未找到")
         
-        # 加载Schema配置
-        schema_config = config_manager.load_schema_config().get(request.database, {})
-        if not schema_config:
+        # 加载Schema配置（预先渲染并缓存，schema_config.json修改后自动重新加载）
+        schema_block = load_schema_block(config_manager, request.database)
+        if not schema_block.tables:
             raise HTTPException(status_code=400, detail=f"{request.database.upper()}的Schema配置未找到")
         
-        schema_info = schema_config.get("tables", {})
-        table_descriptions = schema_config.get("descriptions", {})
+        # 相同或相近的问题在聊天页面成功查询过时直接返回缓存的SQL
+        db_config = config_manager.load_database_config().get(request.database, {})
+        cached = lookup_cached_sql(request.question, request.database, db_config,
+                                   schema_block.tables, schema_block.descriptions, llm_config)
+        if cached:
+            return GenerateSQLResponse(sql=cached["sql"], success=True, cached=True)
         
-        # 构建提示
-        prompt = f"""数据库查询
-
-用户问题: {request.question}
-
-数据库Schema:
-"""
-        
-        for table, columns in schema_info.items():
-            table_desc = table_descriptions.get(table, "")
-            prompt += f"\n\n表: {table}"
-            if table_desc:
-                prompt += f" - {table_desc}"
-            prompt += "\n"
-            
-            if columns:
-                prompt += "| 列名 | 类型 | 描述 |\n"
-                prompt += "| --- | --- | --- |\n"
-                for col in columns:
-                    name = col.get("name", "")
-                    col_type = col.get("type", "")
-                    comment = col.get("comment", "")
-                    prompt += f"| {name} | {col_type} | {comment} |\n"
-        
-        prompt += "\n\n请根据用户问题和数据库schema生成SQL查询。只返回SQL语句，不要其他内容。"
+        # 构建提示：说明和schema作为稳定前缀，用户问题在后；表较多时只保留与问题相关的表
+        system_prompt, question_prompt = build_schema_messages(
+            request.question, schema_block.tables, schema_block.descriptions, llm_config
+        )
         
         # 调用LLM
         llm_client = LLMClient(llm_config)
-        sql_response = llm_client.generate_sql(prompt)
+        sql_response = llm_client.generate_sql(question_prompt, system_prompt=system_prompt)
         
         if not sql_response:
             return GenerateSQLResponse(sql=None, success=False, error="LLM生成SQL失败")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+本地意图分类器的留出集基准
+只用意图识别提示中的示例（INTENT_EXAMPLES）训练，在训练集之外的问题上统计：
+置信度达到阈值（本地直接回答、不调用LLM）的问题数，以及其中意图判断正确的比例。
+留出问题为测试问题集中带意图标注的问题，加上下面几条不在任何训练数据中的常见问法。
+--loo 改为在 提示示例 + 测试问题集 上做留一验证（与线上训练数据一致）。
+
+用法: python benchmarks/intent_classifier.py [--threshold 0.8] [--verbose]
+      python benchmarks/intent_classifier.py --loo
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+from utils.intent_classifier import (
+    INTENT_EXAMPLES, DEFAULT_CONFIDENCE_THRESHOLD, NgramIntentClassifier, classify_intent, _test_question_examples
+)
+
+# 不在提示示例和测试问题集中的常见问法
+EXTRA_QUESTIONS = [
+    ("查询订单总数", "query"),
+    ("平均订单金额是多少", "query"),
+    ("深圳的订单有哪些", "query"),
+    ("帮我看看上个月的销售额", "query"),
+    ("每个员工负责的订单数", "query"),
+    ("库存低于10的产品", "query"),
+    ("show me top 10 products by revenue", "query"),
+    ("为什么上季度利润下降了", "analysis"),
+    ("分析客户流失的原因并给出改进建议", "analysis"),
+    ("drop table orders", "reject"),
+]
+
+def evaluate(cases, classifier_for, threshold, verbose):
+    """cases为 (问题, 标注) 列表；classifier_for(index)返回评估第index个问题使用的模型"""
+    local, correct, local_correct = 0, 0, 0
+    by_label = Counter()
+    started = time.perf_counter()
+    for index, (question, label) in enumerate(cases):
+        intent, confidence = classify_intent(question, classifier_for(index))
+        confident = confidence >= threshold
+        local += confident
+        correct += intent == label
+        local_correct += confident and intent == label
+        if confident:
+            by_label[label] += 1
+        if verbose or (confident and intent != label):
+            mark = "本地" if confident else "LLM "
+            flag = "" if intent == label else f"  ✗ 标注{label}"
+            print(f"  [{mark}] {question[:30]:<30} -> {intent} {confidence:.2f}{flag}")
+    elapsed = (time.perf_counter() - started) / max(len(cases), 1) * 1000
+    total = len(cases)
+    print(f"\n问题数: {total}，意图判断正确: {correct}（{correct / total * 100:.0f}%）")
+    print(f"置信度≥{threshold}（不调用LLM）: {local}（{local / total * 100:.0f}%），其中正确: {local_correct}"
+          f"（{local_correct / max(local, 1) * 100:.0f}%）")
+    print("按标注: " + "，".join(f"{label} {by_label[label]}/{count}"
+                                 for label, count in sorted(Counter(label for _, label in cases).items())))
+    print(f"平均每次分类 {elapsed:.3f} ms（留一验证时含训练）")
+
+def main():
+    parser = argparse.ArgumentParser(description="本地意图分类器留出集基准")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--loo", action="store_true", help="在提示示例+测试问题集上做留一验证")
+    parser.add_argument("--verbose", action="store_true", help="列出每个问题的结果")
+    args = parser.parse_args()
+
+    labelled = _test_question_examples()
+    if not labelled:
+        print("无法加载测试问题集（需要streamlit），只使用内置的留出问题")
+    if args.loo:
+        cases = INTENT_EXAMPLES + labelled
+        print(f"留一验证: {len(cases)}个问题")
+        evaluate(cases, lambda index: NgramIntentClassifier(cases[:index] + cases[index + 1:]), args.threshold, args.verbose)
+    else:
+        cases = labelled + EXTRA_QUESTIONS
+        classifier = NgramIntentClassifier(INTENT_EXAMPLES)
+        print(f"训练: 提示示例{len(INTENT_EXAMPLES)}条；留出: {len(cases)}个问题")
+        evaluate(cases, lambda index: classifier, args.threshold, args.verbose)
+
+if __name__ == "__main__":
+    main()
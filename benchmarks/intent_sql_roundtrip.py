@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+意图识别 + SQL生成的往返基准
+对比三种LLM路径在内置测试问题上的耗时：
+- 两次调用：意图识别提示 -> （意图为query时）build_schema_prompt生成SQL
+- 一次调用：合并提示同时返回 {intent, sql, confidence}
+- 并发推测：意图识别与SQL生成同时发出，意图不是query时丢弃SQL
+各路径都绕过本地意图分类器，只比较LLM往返本身。
+
+默认使用模拟LLM（固定往返延迟 + 按输入/输出token计的耗时），不需要API密钥；
+--live 使用config/llm_config.json中配置的LLM和schema_config.json中保存的schema。
+
+用法: python benchmarks/intent_sql_roundtrip.py [--latency 0.8] [--limit 20]
+      python benchmarks/intent_sql_roundtrip.py --live --database-type mysql --limit 10
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+from utils.data_profiler import estimate_tokens
+from utils.intent_classifier import classify_intent
+from utils.intent_sql import (
+    build_intent_prompt, parse_intent_response, build_combined_prompt, parse_combined_response,
+    start_speculative_sql, finish_speculative_sql, speculation_stats
+)
+from utils.schema_prompt import build_schema_prompt
+from utils.test_question_helper import TestQuestionHelper
+
+# 模拟模式使用的schema（与测试问题涉及的业务表一致）
+SAMPLE_SCHEMA = {
+    "customers": {"columns": [{"name": "customer_id", "type": "varchar(5)", "comment": "客户ID"},
+                              {"name": "company_name", "type": "varchar(40)", "comment": "公司名称"},
+                              {"name": "city", "type": "varchar(15)", "comment": "城市"},
+                              {"name": "region", "type": "varchar(15)", "comment": "地区"}]},
+    "products": {"columns": [{"name": "product_id", "type": "int", "comment": "产品ID"},
+                             {"name": "product_name", "type": "varchar(40)", "comment": "产品名称"},
+                             {"name": "supplier_id", "type": "int", "comment": "供应商ID"},
+                             {"name": "category_id", "type": "int", "comment": "类别ID"},
+                             {"name": "unit_price", "type": "decimal(10,2)", "comment": "单价"},
+                             {"name": "units_in_stock", "type": "smallint", "comment": "库存数量"},
+                             {"name": "discontinued", "type": "bit", "comment": "是否停产"}]},
+    "orders": {"columns": [{"name": "order_id", "type": "int", "comment": "订单ID"},
+                           {"name": "customer_id", "type": "varchar(5)", "comment": "客户ID"},
+                           {"name": "employee_id", "type": "int", "comment": "员工ID"},
+                           {"name": "order_date", "type": "datetime", "comment": "下单日期"},
+                           {"name": "freight", "type": "decimal(10,2)", "comment": "运费"},
+                           {"name": "ship_city", "type": "varchar(15)", "comment": "收货城市"}]},
+    "order_details": {"columns": [{"name": "order_id", "type": "int", "comment": "订单ID"},
+                                  {"name": "product_id", "type": "int", "comment": "产品ID"},
+                                  {"name": "unit_price", "type": "decimal(10,2)", "comment": "成交单价"},
+                                  {"name": "quantity", "type": "smallint", "comment": "数量"}]},
+    "suppliers": {"columns": [{"name": "supplier_id", "type": "int", "comment": "供应商ID"},
+                              {"name": "company_name", "type": "varchar(40)", "comment": "供应商名称"},
+                              {"name": "country", "type": "varchar(15)", "comment": "国家"}]},
+    "employees": {"columns": [{"name": "employee_id", "type": "int", "comment": "员工ID"},
+                              {"name": "last_name", "type": "varchar(20)", "comment": "姓"},
+                              {"name": "first_name", "type": "varchar(10)", "comment": "名"},
+                              {"name": "home_phone", "type": "varchar(24)", "comment": "电话"}]},
+    "categories": {"columns": [{"name": "category_id", "type": "int", "comment": "类别ID"},
+                               {"name": "category_name", "type": "varchar(15)", "comment": "类别名称"}]}
+}
+
+SAMPLE_SQL = "SELECT p.product_name, SUM(d.quantity) AS total_quantity FROM order_details d JOIN products p ON p.product_id = d.product_id GROUP BY p.product_name ORDER BY total_quantity DESC LIMIT 10"
+
+def labelled_questions():
+    """内置测试问题及其意图标注；边界案例没有标注，使用本地分类器的判断作为模拟LLM的回答"""
+    prefixes = {"Query意图": "query", "Analysis意图": "analysis", "Reject意图": "reject"}
+    questions = []
+    for category, items in TestQuestionHelper().questions.items():
+        label = next((value for prefix, value in prefixes.items() if category.startswith(prefix)), None)
+        for _, question in items:
+            questions.append((question, label or classify_intent(question)[0]))
+    return questions
+
+class SimulatedLLM:
+    """模拟LLM：每次调用耗时 = 往返延迟 + 输入token * 预填充耗时 + 输出token * 生成耗时"""
+
+    def __init__(self, labels, latency, prefill_ms_per_1k, decode_ms_per_token):
+        self.labels = labels
+        self.latency = latency
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.decode_ms_per_token = decode_ms_per_token
+        self.calls = 0
+        self.input_tokens = 0
+
+    def generate_sql(self, prompt, request_type=None, tools=None):
+        question = re.search(r'用户问题: (.*)', prompt).group(1).strip()
+        intent = self.labels.get(question, "query")
+        if prompt.startswith("### 意图识别与数据库查询"):
+            response = json.dumps({"intent": intent, "sql": SAMPLE_SQL if intent == "query" else "", "confidence": 0.9},
+                                  ensure_ascii=False)
+        elif prompt.startswith("### 数据库查询"):
+            response = SAMPLE_SQL
+        else:
+            response = intent
+        self.calls += 1
+        self.input_tokens += estimate_tokens(prompt)
+        time.sleep(self.latency + estimate_tokens(prompt) / 1000 * self.prefill_ms_per_1k / 1000
+                   + estimate_tokens(response) * self.decode_ms_per_token / 1000)
+        return response
+
+def two_call_path(question, schema_info, descriptions, llm_client):
+    intent = parse_intent_response(llm_client.generate_sql(build_intent_prompt(question)))
+    sql = None
+    if intent == "query":
+        sql = llm_client.generate_sql(build_schema_prompt(question, schema_info, descriptions))
+    return intent, sql
+
+def one_call_path(question, schema_info, descriptions, llm_client):
+    combined = parse_combined_response(llm_client.generate_sql(build_combined_prompt(question, schema_info, descriptions)))
+    if combined is None:
+        return None, None
+    return combined["intent"], combined["sql"] or None
+
+def speculative_path(question, schema_info, descriptions, llm_client):
+    schema_prompt = build_schema_prompt(question, schema_info, descriptions)
+    speculation = start_speculative_sql(lambda: (llm_client.generate_sql(schema_prompt), schema_prompt), llm_client)
+    started = time.perf_counter()
+    intent = parse_intent_response(llm_client.generate_sql(build_intent_prompt(question)))
+    speculative = finish_speculative_sql(speculation, intent, time.perf_counter() - started)
+    return intent, speculative[0] if speculative else None
+
+def run_path(label, path, questions, schema_info, descriptions, llm_client):
+    calls_before = getattr(llm_client, "calls", 0)
+    tokens_before = getattr(llm_client, "input_tokens", 0)
+    timings, intents = [], {}
+    for question, _ in questions:
+        started = time.perf_counter()
+        intent, sql = path(question, schema_info, descriptions, llm_client)
+        elapsed = time.perf_counter() - started
+        intents[question] = intent
+        if intent == "query" and sql:
+            timings.append(elapsed)
+    line = f"{label:<10} 查询问题{len(timings):>3}个  平均到SQL {statistics.mean(timings) if timings else 0:6.2f}s" \
+           f"  中位 {statistics.median(timings) if timings else 0:6.2f}s"
+    if hasattr(llm_client, "calls"):
+        line += f"  LLM调用{llm_client.calls - calls_before:>4}次  输入约{llm_client.input_tokens - tokens_before:>7,}tokens"
+    print(line)
+    return timings, intents
+
+def main():
+    parser = argparse.ArgumentParser(description="意图识别 + SQL生成往返基准")
+    parser.add_argument("--live", action="store_true", help="使用配置的LLM和保存的schema")
+    parser.add_argument("--database-type", default="mysql")
+    parser.add_argument("--limit", type=int, default=0, help="只使用前N个测试问题")
+    parser.add_argument("--latency", type=float, default=0.8, help="模拟模式每次调用的往返延迟(秒)")
+    parser.add_argument("--prefill-ms", type=float, default=100.0, help="模拟模式每1k输入token的耗时(毫秒)")
+    parser.add_argument("--decode-ms", type=float, default=20.0, help="模拟模式每个输出token的耗时(毫秒)")
+    args = parser.parse_args()
+
+    questions = labelled_questions()
+    if args.limit:
+        questions = questions[:args.limit]
+
+    if args.live:
+        os.chdir(PROJECT_ROOT)
+        from utils.config_manager import ConfigManager
+        from utils.llm_client import LLMClient
+        config_manager = ConfigManager()
+        schema_config = config_manager.load_schema_config().get(args.database_type, {})
+        schema_info, descriptions = schema_config.get("tables", {}), schema_config.get("descriptions", {})
+        if not schema_info:
+            sys.exit(f"没有保存{args.database_type}的schema，请先在Schema配置页面保存")
+        llm_client = LLMClient(config_manager.load_llm_config())
+        print(f"真实LLM（{llm_client.provider}），{len(questions)}个问题\n")
+    else:
+        schema_info, descriptions = SAMPLE_SCHEMA, {}
+        llm_client = SimulatedLLM(dict(questions), args.latency, args.prefill_ms, args.decode_ms)
+        print(f"模拟LLM（往返{args.latency}s，预填充{args.prefill_ms}ms/1k tokens，生成{args.decode_ms}ms/token），"
+              f"{len(questions)}个问题\n")
+
+    two_timings, two_intents = run_path("两次调用", two_call_path, questions, schema_info, descriptions, llm_client)
+    one_timings, one_intents = run_path("一次调用", one_call_path, questions, schema_info, descriptions, llm_client)
+    run_path("并发推测", speculative_path, questions, schema_info, descriptions, llm_client)
+
+    agreement = sum(two_intents[q] == one_intents[q] for q, _ in questions) / len(questions)
+    accuracy = sum(one_intents[q] == label for q, label in questions) / len(questions)
+    print(f"\n两种路径意图一致率: {agreement * 100:.1f}%   一次调用意图与标注一致率: {accuracy * 100:.1f}%")
+    if two_timings and one_timings:
+        print(f"查询问题到SQL的平均耗时: {statistics.mean(one_timings) / statistics.mean(two_timings) * 100:.0f}%（一次调用 / 两次调用）")
+    # 等待被丢弃的推测请求完成后再统计
+    time.sleep(0.5 if not args.live else 5)
+    stats = speculation_stats()
+    print(f"并发推测: 采用{stats['used']}次，取消{stats['cancelled']}次，丢弃{stats['discarded']}次，"
+          f"浪费约{stats['wasted_prompt_tokens'] + stats['wasted_output_tokens']:,} tokens，节省约{stats['saved_seconds']:.1f}秒")
+
+if __name__ == "__main__":
+    main()
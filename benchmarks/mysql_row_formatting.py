@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+MySQL结果格式化微基准
+对比原先逐值探测类型的行转换与按列转换计划（build_converter_plan + apply_converter_plan）的吞吐量。
+不需要数据库连接，使用与pymysql返回值类型一致的合成数据。
+
+用法: python benchmarks/mysql_row_formatting.py [--rows 1000] [--cols 30] [--repeat 20]
+"""
+
+import argparse
+import datetime
+import decimal
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pymysql.constants import FIELD_TYPE
+from mcp_servers.mysql_server import build_converter_plan, apply_converter_plan
+
+class _Field:
+    """模拟pymysql结果字段元数据"""
+    def __init__(self, charsetnr):
+        self.charsetnr = charsetnr
+
+def legacy_format_row(row):
+    """原execute_query中的逐值转换逻辑"""
+    formatted_row = []
+    for value in row:
+        if hasattr(value, '__class__') and 'Decimal' in str(type(value)):
+            formatted_row.append(float(value))
+        elif hasattr(value, 'strftime'):
+            formatted_row.append(value.isoformat())
+        elif isinstance(value, bytes):
+            try:
+                formatted_row.append(value.decode('utf-8'))
+            except:
+                formatted_row.append(str(value))
+        else:
+            formatted_row.append(value)
+    return formatted_row
+
+# 典型业务表的列类型分布：整数、文本、金额、时间
+_COLUMN_KINDS = [
+    (FIELD_TYPE.LONGLONG, 63, lambda i: i),
+    (FIELD_TYPE.VAR_STRING, 45, lambda i: f"product-{i % 97}"),
+    (FIELD_TYPE.NEWDECIMAL, 63, lambda i: decimal.Decimal(i) / 100),
+    (FIELD_TYPE.DATETIME, 63, lambda i: datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i)),
+    (FIELD_TYPE.LONG, 63, lambda i: i % 1000),
+    (FIELD_TYPE.DATE, 63, lambda i: datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365)),
+]
+
+def make_dataset(rows: int, cols: int):
+    kinds = [_COLUMN_KINDS[c % len(_COLUMN_KINDS)] for c in range(cols)]
+    description = [(f"col_{c}", kind[0]) for c, kind in enumerate(kinds)]
+    fields = [_Field(kind[1]) for kind in kinds]
+    data = [tuple(kind[2](r + c) for c, kind in enumerate(kinds)) for r in range(rows)]
+    return description, fields, data
+
+def bench(label: str, func, rows: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    rate = rows / best
+    print(f"{label:<28} {best * 1000:8.2f} ms   {rate:12,.0f} rows/s")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="MySQL结果格式化微基准")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--cols", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    description, fields, data = make_dataset(args.rows, args.cols)
+    print(f"{args.rows} 行 x {args.cols} 列，取 {args.repeat} 次中最快的一次\n")
+
+    legacy = bench("逐值探测(原实现)", lambda: [legacy_format_row(row) for row in data], args.rows, args.repeat)
+    planned = bench("按列转换计划(含建计划)", lambda: apply_converter_plan(data, build_converter_plan(description, fields)), args.rows, args.repeat)
+
+    # 两种实现的输出必须一致
+    assert [legacy_format_row(row) for row in data] == apply_converter_plan(data, build_converter_plan(description, fields))
+    print(f"\n加速比: {planned / legacy:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Schema裁剪基准
+在180张表的模拟数仓上（Northwind业务表 + 其他业务域的表），对比内置Query测试问题的
+完整schema提示和BM25裁剪后提示的token数，并检查每个问题所需的表是否都保留在裁剪后的提示中。
+--live 使用配置的LLM分别基于完整提示和裁剪后提示生成SQL，统计SQL一致的比例。
+
+用法: python benchmarks/schema_pruning.py [--top-k 6] [--verbose]
+      python benchmarks/schema_pruning.py --live --limit 10
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+from utils.data_profiler import estimate_tokens
+from utils.schema_index import SchemaIndex, prune_schema
+from utils.schema_prompt import build_schema_prompt
+from utils.test_question_helper import TestQuestionHelper
+
+def _columns(*specs):
+    return {"columns": [{"name": name, "type": col_type, "comment": comment} for name, col_type, comment in specs]}
+
+NORTHWIND_TABLES = {
+    "categories": _columns(("category_id", "int", "类别ID"), ("category_name", "varchar(15)", "类别名称"),
+                           ("description", "text", "类别说明")),
+    "customers": _columns(("customer_id", "varchar(5)", "客户ID"), ("company_name", "varchar(40)", "公司名称"),
+                          ("contact_name", "varchar(30)", "联系人"), ("city", "varchar(15)", "城市"),
+                          ("region", "varchar(15)", "地区"), ("country", "varchar(15)", "国家"),
+                          ("phone", "varchar(24)", "电话")),
+    "employees": _columns(("employee_id", "int", "员工ID"), ("last_name", "varchar(20)", "姓"),
+                          ("first_name", "varchar(10)", "名"), ("title", "varchar(30)", "职位"),
+                          ("home_phone", "varchar(24)", "家庭电话"), ("extension", "varchar(4)", "分机号"),
+                          ("reports_to", "int", "上级员工ID")),
+    "order_details": _columns(("order_id", "int", "订单ID"), ("product_id", "int", "产品ID"),
+                              ("unit_price", "decimal(10,2)", "成交单价"), ("quantity", "smallint", "销售数量"),
+                              ("discount", "real", "折扣")),
+    "orders": _columns(("order_id", "int", "订单ID"), ("customer_id", "varchar(5)", "客户ID"),
+                       ("employee_id", "int", "负责员工ID"), ("order_date", "date", "订单日期"),
+                       ("shipped_date", "date", "发货日期"), ("ship_via", "int", "承运商ID"),
+                       ("freight", "decimal(10,2)", "运费"), ("ship_city", "varchar(15)", "收货城市"),
+                       ("ship_region", "varchar(15)", "收货地区"), ("ship_country", "varchar(15)", "收货国家")),
+    "products": _columns(("product_id", "int", "产品ID"), ("product_name", "varchar(40)", "产品名称"),
+                         ("supplier_id", "int", "供应商ID"), ("category_id", "int", "类别ID"),
+                         ("quantity_per_unit", "varchar(20)", "包装规格"), ("unit_price", "decimal(10,2)", "单价"),
+                         ("units_in_stock", "smallint", "库存数量"), ("units_on_order", "smallint", "在途数量"),
+                         ("discontinued", "tinyint", "是否停产")),
+    "shippers": _columns(("shipper_id", "int", "承运商ID"), ("company_name", "varchar(40)", "承运商名称"),
+                         ("phone", "varchar(24)", "电话")),
+    "suppliers": _columns(("supplier_id", "int", "供应商ID"), ("company_name", "varchar(40)", "供应商名称"),
+                          ("contact_name", "varchar(30)", "联系人"), ("city", "varchar(15)", "城市"),
+                          ("country", "varchar(15)", "国家"), ("phone", "varchar(24)", "电话")),
+    "region": _columns(("region_id", "int", "区域ID"), ("region_description", "varchar(50)", "区域名称")),
+    "territories": _columns(("territory_id", "varchar(20)", "辖区ID"), ("territory_description", "varchar(50)", "辖区名称"),
+                            ("region_id", "int", "区域ID")),
+    "employee_territories": _columns(("employee_id", "int", "员工ID"), ("territory_id", "varchar(20)", "辖区ID")),
+}
+# Schema配置页面中维护的表描述
+NORTHWIND_DESCRIPTIONS = {
+    "categories": "产品类别",
+    "customers": "客户信息，含客户所在城市、地区和国家",
+    "employees": "员工信息，含职位和联系方式",
+    "order_details": "订单明细：每个订单中各产品的成交单价、销售数量和折扣，订单金额、销售额、客户购买或消费金额由单价x数量x(1-折扣)计算",
+    "orders": "销售订单：客户的每次购买记录，含下单日期、负责员工、运费和收货地区",
+    "products": "产品信息，含单价、库存和是否停产",
+    "shippers": "承运商",
+    "suppliers": "供应商信息",
+    "region": "销售区域",
+    "territories": "销售辖区",
+    "employee_territories": "员工负责辖区"
+}
+
+# 其他业务域的表：(表名前缀, 中文业务域, 实体列表)，部分实体带有与业务表相同的连接键
+OTHER_DOMAINS = [
+    ("hr", "人力资源", [("attendance", "考勤记录", ["employee_id"]), ("payroll", "工资发放", ["employee_id"]),
+                        ("leave_request", "请假申请", ["employee_id"]), ("training", "培训记录", ["employee_id"]),
+                        ("recruitment", "招聘需求", []), ("performance_review", "绩效考核", ["employee_id"]),
+                        ("department", "部门", []), ("position", "岗位", [])]),
+    ("fin", "财务", [("ledger_entry", "总账分录", []), ("invoice", "发票", ["customer_id", "order_id"]),
+                     ("payment", "收款记录", ["customer_id"]), ("budget", "预算", []), ("expense", "费用报销", ["employee_id"]),
+                     ("tax_rate", "税率", []), ("currency_rate", "汇率", []), ("cost_center", "成本中心", [])]),
+    ("wms", "仓储", [("warehouse", "仓库", []), ("inventory_snapshot", "库存快照", ["product_id"]),
+                     ("inbound", "入库单", ["supplier_id", "product_id"]), ("outbound", "出库单", ["order_id"]),
+                     ("stock_transfer", "调拨单", ["product_id"]), ("bin_location", "库位", []),
+                     ("cycle_count", "盘点记录", ["product_id"])]),
+    ("tms", "运输", [("shipment", "运单", ["order_id", "shipper_id"]), ("route", "运输线路", []),
+                     ("vehicle", "车辆", []), ("driver", "司机", []), ("freight_rate", "运价表", ["shipper_id"]),
+                     ("delivery_exception", "配送异常", [])]),
+    ("mkt", "营销", [("campaign", "营销活动", []), ("coupon", "优惠券", ["customer_id"]),
+                     ("campaign_response", "活动响应", ["customer_id"]), ("channel", "渠道", []),
+                     ("ad_spend", "广告投放", []), ("lead", "销售线索", []), ("promotion_product", "促销商品", ["product_id"])]),
+    ("crm", "客户关系", [("customer_contact", "客户联系记录", ["customer_id"]), ("complaint", "客户投诉", ["customer_id"]),
+                         ("satisfaction_survey", "满意度调查", ["customer_id"]), ("membership", "会员等级", ["customer_id"]),
+                         ("opportunity", "商机", ["customer_id"])]),
+    ("pur", "采购", [("purchase_order", "采购订单", ["supplier_id"]), ("purchase_order_line", "采购订单明细", ["product_id"]),
+                     ("supplier_rating", "供应商评级", ["supplier_id"]), ("contract", "采购合同", ["supplier_id"]),
+                     ("quotation", "报价单", ["supplier_id", "product_id"])]),
+    ("mfg", "生产", [("work_order", "生产工单", ["product_id"]), ("bom", "物料清单", ["product_id"]),
+                     ("machine", "设备", []), ("downtime", "停机记录", []), ("quality_check", "质检记录", ["product_id"]),
+                     ("shift", "班次", [])]),
+    ("it", "信息系统", [("user_account", "系统账号", ["employee_id"]), ("login_log", "登录日志", []),
+                        ("ticket", "IT工单", []), ("asset", "IT资产", []), ("api_call_log", "接口调用日志", [])]),
+    ("web", "电商网站", [("page_view", "页面浏览", ["customer_id"]), ("cart", "购物车", ["customer_id", "product_id"]),
+                         ("search_log", "站内搜索", []), ("product_review", "商品评价", ["customer_id", "product_id"]),
+                         ("session", "访问会话", ["customer_id"])]),
+    ("iot", "物联网", [("sensor", "传感器", []), ("sensor_reading", "传感器读数", []), ("cold_chain_temp", "冷链温度", ["shipment_id"])]),
+    ("ops", "运营", [("store", "门店", []), ("store_sales_daily", "门店日销售", []), ("store_traffic", "门店客流", []),
+                     ("kpi_target", "KPI目标", []), ("holiday", "节假日", [])]),
+]
+GENERIC_COLUMNS = [("name", "varchar(64)", "名称"), ("status", "varchar(16)", "状态"), ("amount", "decimal(12,2)", "金额"),
+                   ("created_at", "datetime", "创建时间"), ("updated_at", "datetime", "更新时间"), ("remark", "varchar(255)", "备注"),
+                   ("owner", "varchar(32)", "负责人"), ("region", "varchar(32)", "地区"), ("city", "varchar(32)", "城市"),
+                   ("quantity", "int", "数量"), ("type", "varchar(16)", "类型"), ("score", "decimal(5,2)", "评分")]
+KEY_COMMENTS = {"employee_id": "员工ID", "customer_id": "客户ID", "order_id": "订单ID", "product_id": "产品ID",
+                "supplier_id": "供应商ID", "shipper_id": "承运商ID", "shipment_id": "运单ID"}
+
+# 每个Query测试问题生成正确SQL所需的表
+EXPECTED_TABLES = {
+    "显示所有客户信息": {"customers"},
+    "查询产品基本信息": {"products"},
+    "列出所有供应商": {"suppliers"},
+    "显示员工联系方式": {"employees"},
+    "查看所有产品类别": {"categories"},
+    "销量最高的前10个产品": {"products", "order_details"},
+    "订单金额最大的前5个订单": {"orders", "order_details"},
+    "按购买总额排序的客户": {"customers", "orders", "order_details"},
+    "库存最少的产品": {"products"},
+    "运费最高的订单": {"orders"},
+    "统计每个产品类别的订单数量": {"categories", "products", "order_details"},
+    "计算各地区的平均运费": {"orders"},
+    "统计每个供应商的产品数量": {"suppliers", "products"},
+    "计算客户的平均订单金额": {"orders", "order_details"},
+    "统计各城市的客户数量": {"customers"},
+    "按月份统计订单数量趋势": {"orders"},
+    "各产品类别的销售趋势": {"categories", "products", "order_details", "orders"},
+    "不同地区的订单量趋势": {"orders"},
+    "运费成本的月度变化趋势": {"orders"},
+    "客户订单频次的时间趋势": {"orders"},
+    "对比不同地区的订单金额": {"orders", "order_details"},
+    "比较各产品类别的销售数量": {"categories", "products", "order_details"},
+    "对比不同供应商的产品价格": {"suppliers", "products"},
+    "比较各城市的客户消费水平": {"customers", "orders", "order_details"},
+    "对比不同员工负责的客户数量": {"employees", "orders"},
+    "筛选库存数量少于50的产品": {"products"},
+    "查找单价超过1000的产品": {"products"},
+    "筛选运费超过100的订单": {"orders"},
+    "查找特定城市的客户": {"customers"},
+    "筛选已停产的产品": {"products"},
+}
+
+def build_warehouse(total_tables: int, seed: int = 7):
+    """Northwind业务表加其他业务域的表，凑足total_tables张"""
+    rng = random.Random(seed)
+    tables, descriptions = dict(NORTHWIND_TABLES), dict(NORTHWIND_DESCRIPTIONS)
+    entities = [(prefix, domain, entity, label, keys) for prefix, domain, items in OTHER_DOMAINS
+                for entity, label, keys in items]
+    suffixes = [("", ""), ("_hist", "历史"), ("_daily", "日汇总"), ("_monthly", "月汇总"), ("_stage", "临时"), ("_archive", "归档")]
+    round_index = 0
+    while len(tables) < total_tables:
+        suffix, suffix_label = suffixes[round_index % len(suffixes)]
+        for prefix, domain, entity, label, keys in entities:
+            if len(tables) >= total_tables:
+                break
+            name = f"{prefix}_{entity}{suffix}"
+            specs = [(f"{entity}_id", "bigint", f"{label}ID")]
+            specs += [(key, "int", KEY_COMMENTS[key]) for key in keys]
+            specs += [(column, col_type, f"{label}{comment}") for column, col_type, comment in rng.sample(GENERIC_COLUMNS, 6)]
+            tables[name] = _columns(*specs)
+            descriptions[name] = f"{domain} - {label}{suffix_label}"
+        round_index += 1
+    return tables, descriptions
+
+def normalize_sql(sql):
+    return re.sub(r'\s+', ' ', (sql or "").strip().rstrip(';')).lower()
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema裁剪基准")
+    parser.add_argument("--tables", type=int, default=180, help="模拟数仓的表数量")
+    parser.add_argument("--top-k", type=int, default=6)
+    parser.add_argument("--limit", type=int, default=0, help="只使用前N个测试问题")
+    parser.add_argument("--live", action="store_true", help="使用配置的LLM比较完整提示和裁剪后提示生成的SQL")
+    parser.add_argument("--verbose", action="store_true", help="打印每个问题保留的表")
+    args = parser.parse_args()
+
+    schema_info, descriptions = build_warehouse(args.tables)
+    questions = [question for items in TestQuestionHelper().questions.values() for _, question in items
+                 if question in EXPECTED_TABLES]
+    if args.limit:
+        questions = questions[:args.limit]
+    llm_config = {"schema_index": {"top_k": args.top_k}}
+
+    started = time.perf_counter()
+    SchemaIndex(schema_info, descriptions)
+    print(f"模拟数仓: {len(schema_info)}张表，建立索引 {(time.perf_counter() - started) * 1000:.1f}ms\n")
+
+    full_tokens, pruned_tokens, kept, select_ms = [], [], [], []
+    missing = []
+    for question in questions:
+        full_tokens.append(estimate_tokens(build_schema_prompt(question, schema_info, descriptions, {"schema_index": {"enabled": False}})))
+        started = time.perf_counter()
+        pruned_info, _ = prune_schema(question, schema_info, descriptions, llm_config)
+        select_ms.append((time.perf_counter() - started) * 1000)
+        pruned_tokens.append(estimate_tokens(build_schema_prompt(question, schema_info, descriptions, llm_config)))
+        kept.append(len(pruned_info))
+        lost = EXPECTED_TABLES[question] - set(pruned_info)
+        if lost:
+            missing.append((question, lost))
+        if args.verbose:
+            print(f"{question}: {', '.join(pruned_info)}" + (f"  缺少 {', '.join(sorted(lost))}" if lost else ""))
+
+    print(f"{'':<8}{'平均tokens':>12}{'中位tokens':>12}")
+    print(f"{'完整schema':<8}{statistics.mean(full_tokens):>12,.0f}{statistics.median(full_tokens):>12,.0f}")
+    print(f"{'裁剪后':<8}{statistics.mean(pruned_tokens):>12,.0f}{statistics.median(pruned_tokens):>12,.0f}")
+    print(f"\n提示缩小 {statistics.mean(full_tokens) / statistics.mean(pruned_tokens):.1f} 倍，平均保留 {statistics.mean(kept):.1f} 张表，"
+          f"选表平均耗时 {statistics.mean(select_ms):.2f}ms")
+    print(f"所需表全部保留: {len(questions) - len(missing)}/{len(questions)}")
+    for question, lost in missing:
+        print(f"  {question}: 缺少 {', '.join(sorted(lost))}")
+
+    if args.live:
+        os.chdir(PROJECT_ROOT)
+        from utils.config_manager import ConfigManager
+        from utils.llm_client import LLMClient
+        llm_client = LLMClient(ConfigManager().load_llm_config())
+        same = 0
+        for question in questions:
+            full_sql = llm_client.generate_sql(build_schema_prompt(question, schema_info, descriptions, {"schema_index": {"enabled": False}}))
+            pruned_sql = llm_client.generate_sql(build_schema_prompt(question, schema_info, descriptions, llm_config))
+            if normalize_sql(full_sql) == normalize_sql(pruned_sql):
+                same += 1
+            elif args.verbose:
+                print(f"\n{question}\n  完整: {normalize_sql(full_sql)}\n  裁剪: {normalize_sql(pruned_sql)}")
+        print(f"\nSQL一致: {same}/{len(questions)}（{llm_client.provider}）")
+
+if __name__ == "__main__":
+    main()
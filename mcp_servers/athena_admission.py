@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Athena查询提交的准入控制
+按工作组限制同时运行的查询数，超出时排队；交互式查询（query）优先于分析计划步骤（analysis）。
+名额从start_query_execution开始占用，直到查询结束。
+进程池中有多个Athena服务器进程时，限额默认在本机所有进程间共享（admission_scope为host）：
+每个名额对应cache/athena_admission下的一个锁文件，进程内按优先级放行后再占用一个空闲的锁文件；
+跨进程之间不保证优先级顺序。不支持fcntl的平台（Windows）或admission_scope为process时按进程计算限额。
+"""
+
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 数值越小越优先
+PRIORITIES = {
+    "query": 0,
+    "analysis": 1
+}
+DEFAULT_PRIORITY = "query"
+DEFAULT_MAX_CONCURRENT = 10
+DEFAULT_ADMISSION_TIMEOUT = 300
+ADMISSION_SCOPES = ("host", "process")
+DEFAULT_ADMISSION_SCOPE = "host"
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SLOT_DIR = os.path.join(PROJECT_ROOT, "cache", "athena_admission")
+# 名额全部被其他进程占用时的轮询间隔(秒)
+SLOT_POLL_INTERVAL = 0.2
+
+# 提交被限流时的重试次数和初始退避(秒)
+THROTTLE_RETRIES = 5
+THROTTLE_BASE_DELAY = 0.5
+THROTTLE_CODES = ('TooManyRequestsException', 'ThrottlingException')
+
+class AdmissionTimeout(Exception):
+    """排队等待并发名额超时"""
+
+def is_throttled(error: Exception) -> bool:
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+    return code in THROTTLE_CODES or 'TooManyRequestsException' in str(error)
+
+class AdmissionController:
+    """带优先级的计数信号量：有空闲名额且无人排队时直接放行，否则按(优先级, 到达顺序)出队"""
+
+    def __init__(self, limit: int = DEFAULT_MAX_CONCURRENT):
+        self.limit = max(1, limit)
+        self.running = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"admitted": 0, "queued": 0, "timeouts": 0, "max_wait": 0.0}
+
+    def set_limit(self, limit: int):
+        with self._cond:
+            self.limit = max(1, limit)
+            self._admit_waiting()
+
+    def acquire(self, priority: str = DEFAULT_PRIORITY, timeout: float = DEFAULT_ADMISSION_TIMEOUT) -> float:
+        """获取一个名额，返回排队等待的秒数；超时抛出AdmissionTimeout"""
+        started = time.time()
+        with self._cond:
+            if self.running < self.limit and not self._queue:
+                self.running += 1
+                self.stats["admitted"] += 1
+                return 0.0
+            # [优先级, 到达顺序, 是否已放行]
+            entry = [PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY]), next(self._seq), False]
+            heapq.heappush(self._queue, entry)
+            self.stats["queued"] += 1
+            deadline = started + timeout
+            while not entry[2]:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self.stats["timeouts"] += 1
+                    raise AdmissionTimeout(f"等待Athena并发名额超过{timeout}秒（当前运行 {self.running}/{self.limit}）")
+                self._cond.wait(remaining)
+            waited = time.time() - started
+            self.stats["max_wait"] = max(self.stats["max_wait"], round(waited, 3))
+            return waited
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._admit_waiting()
+
+    def _admit_waiting(self):
+        admitted = False
+        while self.running < self.limit and self._queue:
+            entry = heapq.heappop(self._queue)
+            entry[2] = True
+            self.running += 1
+            self.stats["admitted"] += 1
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"running": self.running, "waiting": len(self._queue), "limit": self.limit, **self.stats}
+
+# 进程级准入控制器注册表：键为 客户端指纹:工作组
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+def get_admission_controller(key: str, limit: int = DEFAULT_MAX_CONCURRENT) -> AdmissionController:
+    """获取工作组的准入控制器，配置的限额变化时同步更新"""
+    with _controllers_lock:
+        controller = _controllers.get(key)
+        if controller is None:
+            controller = AdmissionController(limit)
+            _controllers[key] = controller
+    if controller.limit != max(1, limit):
+        controller.set_limit(limit)
+    return controller
+
+class ProcessSlots:
+    """本机多个进程共享的并发名额：每个名额一个锁文件，以fcntl.flock非阻塞加锁占用。
+    进程退出时操作系统自动释放文件锁，崩溃的进程不会泄漏名额"""
+
+    def __init__(self, directory: str, limit: int):
+        self.directory = directory
+        self.limit = max(1, limit)
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, timeout: float) -> Any:
+        """占用一个空闲名额，返回需交给release的文件对象；超时抛出AdmissionTimeout"""
+        deadline = time.time() + timeout
+        while True:
+            for index in range(self.limit):
+                handle = open(os.path.join(self.directory, f"slot-{index}.lock"), "a")
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return handle
+                except OSError:
+                    handle.close()
+            if time.time() >= deadline:
+                raise AdmissionTimeout(f"等待Athena并发名额超过{timeout}秒（本机各进程共 {self.limit} 个名额均已占用）")
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    @staticmethod
+    def release(handle: Any):
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+def get_process_slots(key: str, limit: int, scope: str = DEFAULT_ADMISSION_SCOPE,
+                      directory: str = DEFAULT_SLOT_DIR) -> Optional[ProcessSlots]:
+    """跨进程共享名额；scope为process、平台不支持文件锁或锁目录无法创建时返回None（只按进程限额）"""
+    if scope != "host" or fcntl is None:
+        return None
+    try:
+        return ProcessSlots(os.path.join(directory, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]), limit)
+    except OSError:
+        return None
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Athena查询状态轮询引擎
+所有在途查询由一个后台线程统一轮询：按到期时间分批调用batch_get_query_execution，
+轮询间隔根据同类查询的历史耗时自适应（预计快结束时密集轮询，长查询逐步退避），
+超过客户端截止时间的查询调用stop_query_execution取消。
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from mcp_servers.result_cache import normalize_sql
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+# batch_get_query_execution单次最多50个查询ID
+BATCH_SIZE = 50
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 5.0
+BACKOFF = 1.5
+DEFAULT_QUERY_TIMEOUT = 600
+
+_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+(?:\.\d+)?\b")
+
+def query_shape(sql: str) -> str:
+    """同类查询的键：规范化SQL并把字符串和数字常量替换为占位符"""
+    shape = _LITERAL_PATTERN.sub("?", normalize_sql(sql)).upper()
+    return hashlib.sha256(shape.encode("utf-8")).hexdigest()[:16]
+
+class RuntimeHistory:
+    """按查询形状记录数值（耗时、结果行数）的指数滑动平均，容量有限时淘汰最久未用的记录"""
+
+    def __init__(self, capacity: int = 1000, alpha: float = 0.3):
+        self.capacity = capacity
+        self.alpha = alpha
+        self._runtimes: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimate(self, shape: Optional[str]) -> Optional[float]:
+        if not shape:
+            return None
+        with self._lock:
+            runtime = self._runtimes.get(shape)
+            if runtime is not None:
+                self._runtimes.move_to_end(shape)
+            return runtime
+
+    def record(self, shape: Optional[str], seconds: float):
+        if not shape or seconds is None or seconds < 0:
+            return
+        with self._lock:
+            previous = self._runtimes.get(shape)
+            self._runtimes[shape] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+            self._runtimes.move_to_end(shape)
+            while len(self._runtimes) > self.capacity:
+                self._runtimes.popitem(last=False)
+
+class _Waiter:
+    __slots__ = ("query_id", "shape", "started_at", "deadline", "next_poll", "interval", "event", "execution")
+
+    def __init__(self, query_id: str, shape: Optional[str], deadline: float, first_delay: float, interval: float):
+        self.query_id = query_id
+        self.shape = shape
+        self.started_at = time.time()
+        self.deadline = deadline
+        self.next_poll = self.started_at + first_delay
+        self.interval = interval
+        self.event = threading.Event()
+        self.execution = None
+
+class AthenaQueryPoller:
+    """共享的查询状态轮询器，每个Athena客户端（账号+区域）一个"""
+
+    def __init__(self, client, history: RuntimeHistory = None):
+        self.client = client
+        self.history = history or RuntimeHistory()
+        self._waiters: Dict[str, _Waiter] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"polls": 0, "batches": 0, "cancelled": 0}
+
+    def _schedule(self, shape: Optional[str]):
+        """根据历史耗时确定首次轮询延迟和初始间隔"""
+        expected = self.history.estimate(shape)
+        if expected is None:
+            return MIN_INTERVAL * 2, MIN_INTERVAL * 2
+        # 在预计完成前稍早开始轮询，之后以预计耗时的十分之一为初始间隔
+        first_delay = min(max(expected * 0.8, MIN_INTERVAL), MAX_INTERVAL * 6)
+        interval = min(max(expected * 0.1, MIN_INTERVAL), MAX_INTERVAL)
+        return first_delay, interval
+
+    def wait(self, query_id: str, sql: str = None, timeout: float = DEFAULT_QUERY_TIMEOUT) -> Dict[str, Any]:
+        """阻塞等待查询结束，返回与get_query_execution相同结构的响应；
+        超过timeout时取消查询，返回的状态为CANCELLED"""
+        shape = query_shape(sql) if sql else None
+        first_delay, interval = self._schedule(shape)
+        waiter = _Waiter(query_id, shape, time.time() + timeout, first_delay, interval)
+        with self._cond:
+            self._waiters[query_id] = waiter
+            self._ensure_thread()
+            self._cond.notify()
+        waiter.event.wait()
+        return {'QueryExecution': waiter.execution}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="athena-poller", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._waiters:
+                    # 没有在途查询时线程退出，下次wait时重新启动
+                    self._thread = None
+                    return
+                now = time.time()
+                due = [w for w in self._waiters.values() if w.next_poll <= now or w.deadline <= now]
+                if not due:
+                    next_due = min(min(w.next_poll, w.deadline) for w in self._waiters.values())
+                    self._cond.wait(max(next_due - now, 0.01))
+                    continue
+
+            expired = [w for w in due if w.deadline <= time.time()]
+            for waiter in expired:
+                self._cancel(waiter)
+            pending = [w for w in due if w not in expired]
+            for start in range(0, len(pending), BATCH_SIZE):
+                self._poll_batch(pending[start:start + BATCH_SIZE])
+
+    def _poll_batch(self, waiters):
+        by_id = {w.query_id: w for w in waiters}
+        try:
+            response = self.client.batch_get_query_execution(QueryExecutionIds=list(by_id))
+            executions = response.get('QueryExecutions', [])
+        except Exception:
+            # 批量接口失败（如没有batch权限）时逐个查询；仍失败的查询下一轮重试，直到截止时间
+            executions = []
+            for query_id in by_id:
+                try:
+                    executions.append(self.client.get_query_execution(QueryExecutionId=query_id)['QueryExecution'])
+                except Exception:
+                    continue
+        with self._cond:
+            self.stats["batches"] += 1
+            self.stats["polls"] += len(by_id)
+
+        now = time.time()
+        for execution in executions:
+            waiter = by_id.pop(execution.get('QueryExecutionId'), None)
+            if waiter is None:
+                continue
+            if execution.get('Status', {}).get('State') in TERMINAL_STATES:
+                self._complete(waiter, execution)
+            else:
+                waiter.next_poll = now + waiter.interval
+                waiter.interval = min(waiter.interval * BACKOFF, MAX_INTERVAL)
+        # 未返回的ID（UnprocessedQueryExecutionIds）下一轮重试
+        for waiter in by_id.values():
+            waiter.next_poll = now + waiter.interval
+
+    def _complete(self, waiter: _Waiter, execution: Dict[str, Any]):
+        if execution.get('Status', {}).get('State') == 'SUCCEEDED':
+            engine_ms = execution.get('Statistics', {}).get('TotalExecutionTimeInMillis')
+            runtime = engine_ms / 1000 if engine_ms is not None else time.time() - waiter.started_at
+            self.history.record(waiter.shape, runtime)
+        with self._cond:
+            self._waiters.pop(waiter.query_id, None)
+        waiter.execution = execution
+        waiter.event.set()
+
+    def _cancel(self, waiter: _Waiter):
+        """超过截止时间：取消查询并以CANCELLED状态返回"""
+        try:
+            self.client.stop_query_execution(QueryExecutionId=waiter.query_id)
+        except Exception:
+            pass
+        with self._cond:
+            self.stats["cancelled"] += 1
+        timeout = round(waiter.deadline - waiter.started_at)
+        self._complete(waiter, {
+            'QueryExecutionId': waiter.query_id,
+            'Status': {'State': 'CANCELLED', 'StateChangeReason': f'查询超过{timeout}秒未完成，已取消'}
+        })
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return len(self._waiters)
+
+# 进程级轮询器注册表：相同客户端配置（账号+区域）的查询共用一个轮询线程和历史耗时
+_pollers: Dict[str, AthenaQueryPoller] = {}
+_history = RuntimeHistory()
+_pollers_lock = threading.Lock()
+
+def get_poller(fingerprint: str, client) -> AthenaQueryPoller:
+    """获取指定客户端配置的轮询器，首次使用时以传入的客户端创建"""
+    with _pollers_lock:
+        poller = _pollers.get(fingerprint)
+        if poller is None:
+            poller = AthenaQueryPoller(client, _history)
+            _pollers[fingerprint] = poller
+        return poller
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Athena查询结果复用
+本地持久化 规范化SQL指纹 + 数据库 -> 最近一次成功的QueryExecutionId，
+相同查询在有效期内直接读取已有的结果文件，不再启动新的执行（跨会话、跨进程有效）。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from mcp_servers.result_cache import make_cache_key, normalize_sql
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REUSE_MAP_PATH = os.path.join(PROJECT_ROOT, "cache", "athena_result_reuse.json")
+MAX_ENTRIES = 5000
+
+def is_reusable_sql(sql: str) -> bool:
+    """只有只读查询可以复用结果"""
+    return normalize_sql(sql).upper().startswith(("SELECT", "WITH"))
+
+def reuse_key(sql: str, database: str, fingerprint: str) -> str:
+    return make_cache_key(sql, database, fingerprint)
+
+class QueryReuseMap:
+    """查询指纹到QueryExecutionId的持久化映射。
+    多个常驻进程共用同一文件：写入前重新读取合并，并通过临时文件原子替换"""
+
+    def __init__(self, path: str = DEFAULT_REUSE_MAP_PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._mtime = None
+
+    def _load(self):
+        """文件被其他进程更新过时重新读取"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+        except (OSError, ValueError):
+            # 文件损坏时忽略，下次写入会覆盖
+            self._entries = {}
+
+    def get(self, key: str, max_age: float) -> Optional[Dict[str, Any]]:
+        """返回有效期（秒）内的记录"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+        if entry is None or time.time() - entry.get("completed_at", 0) > max_age:
+            return None
+        return entry
+
+    def put(self, key: str, query_id: str, bytes_scanned: int, output_location: str = ""):
+        with self._lock:
+            self._load()
+            self._entries[key] = {
+                "query_id": query_id,
+                "completed_at": time.time(),
+                "bytes_scanned": bytes_scanned,
+                "output_location": output_location
+            }
+            if len(self._entries) > self.max_entries:
+                # 只保留最近完成的记录
+                latest = sorted(self._entries.items(), key=lambda item: item[1].get("completed_at", 0))
+                self._entries = dict(latest[-self.max_entries:])
+            self._save()
+
+    def discard(self, key: str):
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        except OSError:
+            pass
+
+# 进程级映射注册表（按文件路径）
+_maps: Dict[str, QueryReuseMap] = {}
+_maps_lock = threading.Lock()
+
+def get_reuse_map(path: str = None) -> QueryReuseMap:
+    path = path or DEFAULT_REUSE_MAP_PATH
+    with _maps_lock:
+        if path not in _maps:
+            _maps[path] = QueryReuseMap(path)
+        return _maps[path]
@@ -4,117 +4,615 @@ AWS Athena MCP Server
 提供Athena查询功能的MCP工具服务器
 """
 
-import json
+import csv
+import os
 import sys
 import boto3
 import pandas as pd
-from typing import Dict, Any, List
+import random
+import re
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Callable, Tuple
+
+# 以脚本方式启动时把项目根目录加入路径，以便导入公共协议模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_servers.stdio_protocol import (
+    serve_stdio, DEFAULT_SERVER_THREADS, DEFAULT_CHUNK_SIZE,
+    header_frame, rows_frame, trailer_frame, result_frames
+)
+from mcp_servers.result_cache import cached_execute, cache_stream, lookup_cached, result_cache, config_fingerprint, normalize_sql
+from mcp_servers.athena_poller import get_poller, query_shape, RuntimeHistory, DEFAULT_QUERY_TIMEOUT
+from mcp_servers.glue_catalog import GlueCatalog, GlueAccessDenied
+from mcp_servers.athena_reuse import get_reuse_map, is_reusable_sql, reuse_key
+from mcp_servers.parquet_results import iter_parquet_rows, parquet_available, delete_result_files
+from mcp_servers.athena_admission import (
+    get_admission_controller, get_process_slots, is_throttled, DEFAULT_PRIORITY, DEFAULT_MAX_CONCURRENT,
+    DEFAULT_ADMISSION_TIMEOUT, DEFAULT_ADMISSION_SCOPE, SLOT_POLL_INTERVAL, THROTTLE_RETRIES, THROTTLE_BASE_DELAY
+)
+
+# get_query_results单页最多返回1000行
+RESULT_PAGE_SIZE = 1000
+
+# 参与结果缓存指纹计算的配置项：这些项决定查询访问的账号、区域和结果位置
+CACHE_FINGERPRINT_KEYS = [
+    'region', 'aws_access_key_id', 'access_key', 'workgroup', 's3_output_location'
+]
+
+# 大结果模式下预计读取行数达到该值时改用UNLOAD到Parquet
+DEFAULT_UNLOAD_ROW_THRESHOLD = 5000
+_ORDER_BY_PATTERN = re.compile(r"\bORDER\s+BY\b", re.I)
+
+def _to_bool(value: str) -> bool:
+    return value.lower() == 'true'
+
+# 按ColumnInfo类型把VarCharValue字符串转换为JSON原生类型；日期时间、字符串等保持字符串，由客户端按column_types解析
+_CELL_CONVERTERS = {
+    'tinyint': int,
+    'smallint': int,
+    'integer': int,
+    'int': int,
+    'bigint': int,
+    'real': float,
+    'float': float,
+    'double': float,
+    'decimal': float,
+    'boolean': _to_bool
+}
+
+def _null_safe(converter: Callable[[str], Any], empty_is_null: bool) -> Callable[[Optional[str]], Any]:
+    def convert(value):
+        if value is None or (empty_is_null and value == ''):
+            return None
+        try:
+            return converter(value)
+        except ValueError:
+            return value
+    return convert
+
+def build_cell_converters(column_types: List[str], empty_is_null: bool = False) -> List[Optional[Callable[[Any], Any]]]:
+    """为每列确定一次转换函数，None表示保持字符串。
+    empty_is_null用于CSV结果：CSV中NULL写为空值，数值和布尔列的空值视为NULL"""
+    plan = []
+    for column_type in column_types or []:
+        converter = _CELL_CONVERTERS.get((column_type or '').lower().split('(')[0])
+        plan.append(_null_safe(converter, empty_is_null) if converter else None)
+    return plan
+
+def apply_cell_converters(rows: List[List[Any]], plan: List[Optional[Callable[[Any], Any]]]) -> List[List[Any]]:
+    """按列应用转换：先转置为列，只对需要转换的列做map，再转回行"""
+    if not rows or not any(plan):
+        return rows
+    columns = list(zip(*rows))
+    for index, converter in enumerate(plan):
+        if converter is not None and index < len(columns):
+            columns[index] = map(converter, columns[index])
+    return [list(row) for row in zip(*columns)]
+
+def unload_sql(sql: str, location: str, limit: int = None) -> str:
+    """把只读查询包装为UNLOAD，结果以Parquet写入location；指定limit时只写出前limit行
+    （读取端最多读取max_rows+1行，其余输出只会增加写入量和S3占用）"""
+    query = normalize_sql(sql)
+    if limit:
+        query = f"SELECT * FROM ({query}) LIMIT {int(limit)}"
+    return f"UNLOAD ({query}) TO '{location}' WITH (format = 'PARQUET', compression = 'SNAPPY')"
+
+def project_rows(rows: Iterator[Tuple[str, Any]], columns: Optional[List[str]]) -> Iterator[Tuple[str, Any]]:
+    """对结果读取协议的输出按列名（不区分大小写）只保留指定列，不存在的列忽略；columns为空时原样返回"""
+    if not columns:
+        yield from rows
+        return
+    indexes = []
+    for kind, payload in rows:
+        if kind == "header":
+            names, types = payload
+            positions = {name.lower(): index for index, name in enumerate(names)}
+            indexes = [positions[name.lower()] for name in columns if name.lower() in positions]
+            yield kind, ([names[i] for i in indexes], [types[i] for i in indexes] if types is not None else None)
+        elif kind == "rows":
+            yield kind, [[row[i] for i in indexes] for row in payload]
+        else:
+            yield kind, payload
+
+# Athena结果复用的最长有效期（7天）
+MAX_REUSE_AGE_MINUTES = 10080
+NO_REUSE = {"result_reused": False, "reuse_source": None, "bytes_saved": 0}
+
+# 参与客户端共享的配置项：相同账号和区域的请求复用同一组boto3客户端
+CLIENT_FINGERPRINT_KEYS = ['region', 'aws_access_key_id', 'aws_secret_access_key']
+
+_clients: Dict[str, Dict[str, Any]] = {}
+_clients_lock = threading.Lock()
+
+def get_shared_client(config: Dict[str, Any], service: str = 'athena'):
+    """获取按账号+区域共享的boto3客户端（客户端线程安全，Session不是，因此只在锁内使用Session）"""
+    fingerprint = config_fingerprint(config, CLIENT_FINGERPRINT_KEYS)
+    with _clients_lock:
+        entry = _clients.setdefault(fingerprint, {})
+        if service not in entry:
+            if 'session' not in entry:
+                entry['session'] = boto3.session.Session()
+            entry[service] = entry['session'].client(
+                service,
+                region_name=config.get('region', 'us-east-1'),
+                aws_access_key_id=config.get('aws_access_key_id'),
+                aws_secret_access_key=config.get('aws_secret_access_key')
+            )
+        return entry[service], fingerprint
+
+# 已确认没有Glue数据目录权限的客户端配置，之后直接使用SQL方式获取元数据
+_glue_denied = set()
+# 引擎不支持ResultReuseConfiguration的客户端配置
+_reuse_unsupported = set()
+# 同类查询结果行数的滑动平均，用于自动切换大结果模式
+_row_history = RuntimeHistory()
 
 class AthenaServer:
     def __init__(self):
         self.client = None
+        self.poller = None
+        self.client_fingerprint = None
         self.config = {}
     
     def initialize(self, config: Dict[str, Any]):
         """初始化Athena客户端"""
         self.config = config
-        self.client = boto3.client(
-            'athena',
-            region_name=config.get('region', 'us-east-1'),
-            aws_access_key_id=config.get('aws_access_key_id'),
-            aws_secret_access_key=config.get('aws_secret_access_key')
-        )
+        # 常驻进程中相同账号和区域的请求复用客户端和轮询器
+        self.client, self.client_fingerprint = get_shared_client(config)
+        self.poller = get_poller(self.client_fingerprint, self.client)
+    
+    def _wait_for_query(self, query_id: str, sql: str = None) -> Dict[str, Any]:
+        """等待查询结束，返回与get_query_execution相同结构的响应；超过query_timeout秒时取消查询"""
+        result = self.poller.wait(query_id, sql, timeout=self.config.get('query_timeout', DEFAULT_QUERY_TIMEOUT))
+        print(f"查询状态: {result['QueryExecution']['Status']['State']}", file=sys.stderr)
+        return result
     
-    def execute_query(self, sql: str, database: str = None) -> Dict[str, Any]:
-        """执行Athena查询"""
+    def execute_query(self, sql: str, database: str = None, priority: str = DEFAULT_PRIORITY,
+                      result_format: str = "rows", columns: List[str] = None) -> Dict[str, Any]:
+        """执行Athena查询，分页读取结果直到max_rows。
+        result_format为columnar时按列返回（data.columnar为 列名 -> 值列表），不返回rows；
+        指定columns时只返回这些列（大结果模式下只读取Parquet中的这些列）"""
         if not self.client:
             return {"error": "Athena客户端未初始化"}
         
         try:
-            # 打印调试信息
-            print(f"执行查询: {sql} (数据库: {database})", file=sys.stderr)
+            query_id, execution, error, meta = self._run_query(sql, database, priority)
+            if error:
+                return {"error": error}
             
-            # 构建查询参数
-            query_params = {
-                'QueryString': sql,
-                'QueryExecutionContext': {
-                    'Database': database or 'default'
-                }
-            }
+            max_rows = self.config.get('max_rows', 100)
+            result_columns, column_types, rows, truncated = [], None, [], False
+            for kind, payload in self._iter_result_rows(query_id, execution, max_rows, meta.get('unload_location'), columns):
+                if kind == "header":
+                    result_columns, column_types = payload
+                    print(f"列名: {result_columns}", file=sys.stderr)
+                elif kind == "rows":
+                    rows.extend(payload)
+                else:
+                    truncated = payload
             
-            # 只有当s3_output_location被明确设置时才添加ResultConfiguration
-            s3_output = self.config.get('s3_output_location')
-            if s3_output:
-                query_params['ResultConfiguration'] = {
-                    'OutputLocation': s3_output
-                }
+            print(f"查询结果行数: {len(rows)}", file=sys.stderr)
+            self._record_row_count(sql, len(rows), truncated)
             
-            # 打印查询参数
-            print(f"查询参数: {query_params}", file=sys.stderr)
+            result = {
+                "success": True,
+                "data": {
+                    "columns": result_columns,
+                    "rows": rows,
+                    "row_count": len(rows),
+                    "total_rows": None if truncated else len(rows),
+                    "truncated": truncated,
+                    "query_id": query_id,
+                    **meta
+                }
+            }
+            if column_types is not None:
+                result["data"]["column_types"] = column_types
+            if result_format == "columnar":
+                data = result["data"]
+                rows = data.pop("rows")
+                data["columnar"] = {name: [row[index] for row in rows] for index, name in enumerate(result_columns)}
+            if truncated:
+                result["warning"] = f"结果已截断，仅显示前{max_rows}行"
+            return result
+                
+        except Exception as e:
+            print(f"查询异常: {str(e)}", file=sys.stderr)
+            return {"error": f"执行查询时出错: {str(e)}"}
+    
+    def execute_query_stream(self, sql: str, database: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             priority: str = DEFAULT_PRIORITY, columns: List[str] = None):
+        """流式执行查询：每读到一页结果就按块产出rows帧，依次产出header/rows/trailer帧"""
+        if not self.client:
+            yield {"error": "Athena客户端未初始化"}
+            return
+        
+        try:
+            query_id, execution, error, meta = self._run_query(sql, database, priority)
+            if error:
+                yield {"error": error}
+                return
             
-            # 启动查询
-            response = self.client.start_query_execution(**query_params)
+            max_rows = self.config.get('max_rows', 100)
+            chunk_size = max(1, int(chunk_size))
+            result_columns, column_types, row_count, truncated = [], None, 0, False
+            for kind, payload in self._iter_result_rows(query_id, execution, max_rows, meta.get('unload_location'), columns):
+                if kind == "header":
+                    result_columns, column_types = payload
+                    yield header_frame(result_columns, column_types)
+                elif kind == "rows":
+                    row_count += len(payload)
+                    for start in range(0, len(payload), chunk_size):
+                        yield rows_frame(payload[start:start + chunk_size])
+                else:
+                    truncated = payload
+            self._record_row_count(sql, row_count, truncated)
             
+            result = {
+                "success": True,
+                "data": {
+                    "columns": result_columns,
+                    "row_count": row_count,
+                    "total_rows": None if truncated else row_count,
+                    "truncated": truncated,
+                    "query_id": query_id,
+                    **meta,
+                    "cache_hit": False,
+                    "age": 0
+                }
+            }
+            if column_types is not None:
+                result["data"]["column_types"] = column_types
+            if truncated:
+                result["warning"] = f"结果已截断，仅显示前{max_rows}行"
+            yield trailer_frame(result)
+        except Exception as e:
+            print(f"查询异常: {str(e)}", file=sys.stderr)
+            yield {"error": f"执行查询时出错: {str(e)}"}
+    
+    def _run_query(self, sql: str, database: str = None, priority: str = DEFAULT_PRIORITY):
+        """提交查询并等待完成，返回 (查询ID, 执行信息, 错误信息, 执行元信息)。
+        执行元信息包含结果复用情况和排队等待时间(queue_wait_time)。
+        配置了result_reuse_max_age（分钟）时，有效期内的相同只读查询优先复用本地记录的上次执行结果，
+        否则向Athena传入ResultReuseConfiguration，由引擎决定是否复用"""
+        # 打印调试信息
+        print(f"执行查询: {sql} (数据库: {database})", file=sys.stderr)
+        
+        # 大结果模式：用UNLOAD把结果写成Parquet，读取时保留列类型（UNLOAD的执行不参与结果复用）
+        unload_location = self._unload_location(sql)
+        
+        max_age = float(self.config.get('result_reuse_max_age', 0) or 0)
+        key = None
+        if not unload_location and max_age > 0 and is_reusable_sql(sql):
+            key = reuse_key(sql, database or 'default', config_fingerprint(self.config, CACHE_FINGERPRINT_KEYS))
+            reused = self._reuse_previous(key, max_age)
+            if reused is not None:
+                reused[3]["queue_wait_time"] = 0.0
+                return reused
+        
+        # 构建查询参数
+        query_params = {
+            'QueryString': unload_sql(sql, unload_location, self.config.get('max_rows', 100) + 1) if unload_location else sql,
+            'QueryExecutionContext': {
+                'Database': database or 'default'
+            }
+        }
+        
+        # 只有当s3_output_location被明确设置时才添加ResultConfiguration
+        s3_output = self.config.get('s3_output_location')
+        if s3_output:
+            query_params['ResultConfiguration'] = {
+                'OutputLocation': s3_output
+            }
+        
+        if key and self.client_fingerprint not in _reuse_unsupported:
+            query_params['ResultReuseConfiguration'] = {
+                'ResultReuseByAgeConfiguration': {
+                    'Enabled': True,
+                    'MaxAgeInMinutes': int(min(max_age, MAX_REUSE_AGE_MINUTES))
+                }
+            }
+        
+        # 打印查询参数
+        print(f"查询参数: {query_params}", file=sys.stderr)
+        
+        # 启动查询并等待完成（经过工作组准入控制）
+        query_id, result, queue_wait = self._submit_and_wait(query_params, priority)
+        status = result['QueryExecution']['Status']['State']
+        
+        if status != 'SUCCEEDED':
+            error_reason = result['QueryExecution']['Status'].get('StateChangeReason', '未知错误')
+            print(f"查询失败原因: {error_reason}", file=sys.stderr)
+            return query_id, result['QueryExecution'], f"查询失败: {error_reason}", dict(NO_REUSE, queue_wait_time=round(queue_wait, 3))
+        meta = self._record_execution(key, result['QueryExecution'])
+        meta["queue_wait_time"] = round(queue_wait, 3)
+        if unload_location:
+            meta["fetch_mode"] = "unload"
+            meta["unload_location"] = unload_location
+        return query_id, result['QueryExecution'], None, meta
+    
+    def _unload_location(self, sql: str):
+        """判断是否使用大结果模式，是则返回本次UNLOAD的输出目录，否则返回None。
+        large_result_mode为always时只读查询都使用；为auto时按同类查询此前的结果行数估计，
+        预计读取行数（不超过max_rows）达到unload_row_threshold时使用"""
+        mode = self.config.get('large_result_mode', 'off')
+        if mode not in ('auto', 'always') or not is_reusable_sql(sql):
+            return None
+        # 多个Parquet文件之间不保证顺序，带ORDER BY的查询仍使用普通方式
+        if _ORDER_BY_PATTERN.search(normalize_sql(sql)):
+            return None
+        base = self.config.get('unload_location')
+        if not base and self.config.get('s3_output_location'):
+            base = f"{self.config['s3_output_location'].rstrip('/')}/unload"
+        if not base:
+            return None
+        if not parquet_available():
+            print("未安装pyarrow，无法使用大结果模式", file=sys.stderr)
+            return None
+        if mode == 'auto':
+            estimate = _row_history.estimate(query_shape(sql))
+            expected = min(estimate, self.config.get('max_rows', 100)) if estimate is not None else 0
+            if expected < int(self.config.get('unload_row_threshold', DEFAULT_UNLOAD_ROW_THRESHOLD)):
+                return None
+        # UNLOAD要求输出目录为空，每次执行使用独立的子目录
+        return f"{base.rstrip('/')}/{uuid.uuid4().hex}/"
+    
+    def _record_row_count(self, sql: str, row_count: int, truncated: bool):
+        """记录同类查询的结果行数，截断时记为max_rows+1（实际不少于此）"""
+        _row_history.record(query_shape(sql), row_count + (1 if truncated else 0))
+    
+    def _submit_and_wait(self, query_params: Dict[str, Any], priority: str = DEFAULT_PRIORITY):
+        """在工作组并发限额内提交查询并等待结束，返回 (查询ID, 查询执行信息, 排队秒数)。
+        名额不足时按优先级排队，交互式查询先于分析步骤；限额默认由本机所有服务器进程共享"""
+        workgroup = self.config.get('workgroup')
+        if workgroup:
+            query_params.setdefault('WorkGroup', workgroup)
+        key = f"{self.client_fingerprint}:{workgroup or 'primary'}"
+        limit = int(self.config.get('max_concurrent_queries', DEFAULT_MAX_CONCURRENT))
+        timeout = float(self.config.get('admission_timeout', DEFAULT_ADMISSION_TIMEOUT))
+        controller = get_admission_controller(key, limit)
+        queue_wait = controller.acquire(priority, timeout=timeout)
+        # 进程内放行后再占用本机共享的名额，使进程池中多个进程合计不超过限额
+        slots = get_process_slots(key, limit, self.config.get('admission_scope', DEFAULT_ADMISSION_SCOPE))
+        slot = None
+        try:
+            if slots is not None:
+                slot_started = time.time()
+                slot = slots.acquire(max(0.0, timeout - queue_wait))
+                if time.time() - slot_started >= SLOT_POLL_INTERVAL:
+                    queue_wait += time.time() - slot_started
+        except Exception:
+            controller.release()
+            raise
+        if queue_wait > 0:
+            print(f"排队等待并发名额 {queue_wait:.2f}秒 (优先级: {priority})", file=sys.stderr)
+        try:
+            response = self._start_query(query_params)
             query_id = response['QueryExecutionId']
             print(f"查询ID: {query_id}", file=sys.stderr)
+            # 等待查询完成（共享轮询器，按历史耗时自适应间隔）
+            result = self._wait_for_query(query_id, query_params['QueryString'])
+        finally:
+            if slot is not None:
+                slots.release(slot)
+            controller.release()
+        return query_id, result, queue_wait
+    
+    def _start_query(self, query_params: Dict[str, Any]) -> Dict[str, Any]:
+        """调用start_query_execution；被限流时指数退避重试"""
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                return self.client.start_query_execution(**query_params)
+            except Exception as e:
+                if 'ResultReuseConfiguration' in query_params and 'reuse' in str(e).lower():
+                    # 引擎版本2或工作组不支持结果复用时去掉该参数重试，并记住不再传入
+                    print(f"当前引擎不支持结果复用: {str(e)}", file=sys.stderr)
+                    _reuse_unsupported.add(self.client_fingerprint)
+                    del query_params['ResultReuseConfiguration']
+                    return self.client.start_query_execution(**query_params)
+                if not is_throttled(e) or attempt == THROTTLE_RETRIES:
+                    raise
+                delay = THROTTLE_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"提交查询被限流，{delay:.2f}秒后重试: {str(e)}", file=sys.stderr)
+                time.sleep(delay)
+    
+    def _reuse_map(self):
+        return get_reuse_map(self.config.get('reuse_map_path'))
+    
+    def _reuse_previous(self, key: str, max_age: float):
+        """本地记录的上次执行仍在有效期内且结果文件可读时直接复用，不启动新的执行"""
+        entry = self._reuse_map().get(key, max_age * 60)
+        if entry is None:
+            return None
+        query_id = entry['query_id']
+        try:
+            execution = self.client.get_query_execution(QueryExecutionId=query_id)['QueryExecution']
+            if execution['Status']['State'] != 'SUCCEEDED':
+                raise ValueError(f"上次执行状态为{execution['Status']['State']}")
+            # 结果文件可能已被S3生命周期规则删除，先确认仍可读取
+            self.client.get_query_results(QueryExecutionId=query_id, MaxResults=1)
+        except Exception as e:
+            print(f"无法复用查询{query_id}的结果: {str(e)}", file=sys.stderr)
+            self._reuse_map().discard(key)
+            return None
+        print(f"复用查询{query_id}的结果", file=sys.stderr)
+        bytes_saved = execution.get('Statistics', {}).get('DataScannedInBytes') or entry.get('bytes_scanned', 0)
+        return query_id, execution, None, {"result_reused": True, "reuse_source": "local", "bytes_saved": bytes_saved}
+    
+    def _record_execution(self, key: str, execution: Dict[str, Any]) -> Dict[str, Any]:
+        """记录成功的执行供之后复用，返回结果复用信息"""
+        if not key:
+            return dict(NO_REUSE)
+        statistics = execution.get('Statistics', {})
+        reused = statistics.get('ResultReuseInformation', {}).get('ReusedPreviousResult', False)
+        bytes_scanned = statistics.get('DataScannedInBytes', 0)
+        if reused:
+            # Athena复用了之前的结果，本次扫描量为0，节省量取上次实际执行的扫描量
+            previous = self._reuse_map().get(key, float('inf'))
+            bytes_scanned = previous.get('bytes_scanned', 0) if previous else 0
+        self._reuse_map().put(
+            key, execution['QueryExecutionId'], bytes_scanned,
+            execution.get('ResultConfiguration', {}).get('OutputLocation', '')
+        )
+        if reused:
+            return {"result_reused": True, "reuse_source": "athena", "bytes_saved": bytes_scanned}
+        return dict(NO_REUSE)
+    
+    def _iter_result_rows(self, query_id: str, execution: Dict[str, Any], max_rows: int, unload_location: str = None,
+                          columns: List[str] = None):
+        """读取查询结果，最多max_rows行，指定columns时只返回这些列。
+        依次产出 ("header", (列名, 列类型))、若干 ("rows", 行列表)、("end", 是否截断)。
+        UNLOAD执行只读取输出目录下Parquet文件的指定列；result_fetch_mode为s3_csv时直接流式读取S3上的CSV结果文件，
+        否则使用分页的get_query_results"""
+        if unload_location:
+            return self._iter_unload_rows(unload_location, max_rows, columns)
+        output_location = execution.get('ResultConfiguration', {}).get('OutputLocation', '')
+        if self.config.get('result_fetch_mode') == 's3_csv' and output_location.endswith('.csv'):
+            return project_rows(self._iter_s3_csv_rows(query_id, output_location, max_rows), columns)
+        return project_rows(self._iter_api_rows(query_id, max_rows), columns)
+    
+    def _iter_unload_rows(self, unload_location: str, max_rows: int, columns: List[str] = None):
+        """读取UNLOAD输出的Parquet文件；读取结束（含提前停止）后删除本次的输出目录，
+        unload_cleanup为false时保留（需另行配置S3生命周期规则清理unload_location）"""
+        s3 = get_shared_client(self.config, 's3')[0] if unload_location.startswith('s3://') else None
+        try:
+            yield from iter_parquet_rows(unload_location, max_rows, columns, s3_client=s3)
+        finally:
+            if self.config.get('unload_cleanup', True):
+                try:
+                    delete_result_files(unload_location, s3)
+                except Exception as e:
+                    print(f"删除UNLOAD输出失败 {unload_location}: {str(e)}", file=sys.stderr)
+    
+    def _iter_result_pages(self, query_id: str, max_rows: int):
+        """逐页产出 (get_query_results响应, 是否还有下一页)；处理当前页时后台线程已在请求下一页，
+        已取到的行数满足max_rows后不再预取"""
+        def fetch(token=None):
+            params = {'QueryExecutionId': query_id, 'MaxResults': RESULT_PAGE_SIZE}
+            if token:
+                params['NextToken'] = token
+            return self.client.get_query_results(**params)
+        
+        fetched = -1  # 第一页包含标题行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch)
+            while future is not None:
+                page = future.result()
+                fetched += len(page['ResultSet']['Rows'])
+                token = page.get('NextToken')
+                future = executor.submit(fetch, token) if token and fetched < max_rows else None
+                yield page, token is not None
+    
+    def _iter_api_rows(self, query_id: str, max_rows: int):
+        columns, plan = None, []
+        remaining = max_rows
+        first_page = True
+        for page, has_more in self._iter_result_pages(query_id, max_rows):
+            result_set = page['ResultSet']
+            if columns is None:
+                column_info = result_set['ResultSetMetadata']['ColumnInfo']
+                columns = [col['Label'] for col in column_info]
+                column_types = [col.get('Type') for col in column_info]
+                plan = build_cell_converters(column_types)
+                yield "header", (columns, column_types)
             
-            # 等待查询完成
-            while True:
-                result = self.client.get_query_execution(QueryExecutionId=query_id)
-                status = result['QueryExecution']['Status']['State']
-                print(f"查询状态: {status}", file=sys.stderr)
-                
-                if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                    break
-                time.sleep(1)
+            page_rows = result_set['Rows']
+            if first_page:
+                # 第一页的第一行是标题行
+                page_rows = page_rows[1:]
+                first_page = False
             
-            if status == 'SUCCEEDED':
-                # 获取查询结果
-                results = self.client.get_query_results(QueryExecutionId=query_id)
-                
-                # 转换为DataFrame格式
-                columns = [col['Label'] for col in results['ResultSet']['ResultSetMetadata']['ColumnInfo']]
-                print(f"列名: {columns}", file=sys.stderr)
-                
-                rows = []
-                all_rows = results['ResultSet']['Rows']
-                
-                # 如果有数据行
-                if len(all_rows) > 0:
-                    # 如果第一行是标题行，则从第二行开始
-                    data_rows = all_rows[1:] if len(all_rows) > 1 else []
-                    for row in data_rows:
-                        row_data = [cell.get('VarCharValue', '') for cell in row['Data']]
-                        rows.append(row_data)
-                
-                # 应用行数限制
-                max_rows = self.config.get('max_rows', 100)
-                if len(rows) > max_rows:
-                    rows = rows[:max_rows]
-                
-                print(f"查询结果行数: {len(rows)}", file=sys.stderr)
-                
-                return {
-                    "success": True,
-                    "data": {
-                        "columns": columns,
-                        "rows": rows,
-                        "row_count": len(rows),
-                        "query_id": query_id
-                    }
-                }
-            else:
-                error_reason = result['QueryExecution']['Status'].get('StateChangeReason', '未知错误')
-                print(f"查询失败原因: {error_reason}", file=sys.stderr)
-                return {"error": f"查询失败: {error_reason}"}
-                
-        except Exception as e:
-            print(f"查询异常: {str(e)}", file=sys.stderr)
-            return {"error": f"执行查询时出错: {str(e)}"}
+            # NULL单元格没有VarCharValue，保持为None
+            rows = apply_cell_converters(
+                [[cell.get('VarCharValue') for cell in row['Data']] for row in page_rows[:remaining]], plan
+            )
+            remaining -= len(rows)
+            if rows:
+                yield "rows", rows
+            if remaining <= 0:
+                # 已达max_rows，不再请求后续页
+                yield "end", len(page_rows) > len(rows) or has_more
+                return
+        
+        if columns is None:
+            yield "header", ([], None)
+        yield "end", False
+    
+    def _iter_s3_csv_rows(self, query_id: str, output_location: str, max_rows: int):
+        """从S3流式读取CSV结果文件，读满max_rows行后关闭连接，不下载剩余部分"""
+        # CSV文件不含列类型，从结果元数据获取（只请求一行）
+        column_info = self.client.get_query_results(
+            QueryExecutionId=query_id, MaxResults=1
+        )['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        column_types = [col.get('Type') for col in column_info]
+        plan = build_cell_converters(column_types, empty_is_null=True)
+        
+        bucket, _, key = output_location[len('s3://'):].partition('/')
+        s3, _ = get_shared_client(self.config, 's3')
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            reader = csv.reader(line.decode('utf-8') for line in body.iter_lines(keepends=True))
+            yield "header", (next(reader, []), column_types)
+            
+            batch, row_count, truncated = [], 0, False
+            for row in reader:
+                if row_count >= max_rows:
+                    truncated = True
+                    break
+                batch.append(row)
+                row_count += 1
+                if len(batch) >= RESULT_PAGE_SIZE:
+                    yield "rows", apply_cell_converters(batch, plan)
+                    batch = []
+            if batch:
+                yield "rows", apply_cell_converters(batch, plan)
+            yield "end", truncated
+        finally:
+            body.close()
+    
+    def _glue_catalog(self):
+        """返回(Glue数据目录读取器, 客户端指纹)；配置metadata_source为sql或此前已确认无Glue权限时读取器为None"""
+        if self.config.get('metadata_source', 'glue') != 'glue':
+            return None, None
+        glue, fingerprint = get_shared_client(self.config, 'glue')
+        if fingerprint in _glue_denied:
+            return None, fingerprint
+        return GlueCatalog(glue, self.config.get('catalog_id')), fingerprint
     
     def get_tables(self, database: str = 'default') -> Dict[str, Any]:
-        """获取数据库表列表"""
+        """获取数据库表列表：优先读取Glue数据目录，无Glue权限时回退到SQL"""
+        if not self.client:
+            return {"error": "Athena客户端未初始化"}
+        catalog, fingerprint = self._glue_catalog()
+        if catalog:
+            try:
+                return catalog.get_tables(database)
+            except GlueAccessDenied as e:
+                _glue_denied.add(fingerprint)
+                print(f"无Glue数据目录权限，回退到SQL: {str(e)}", file=sys.stderr)
+            except Exception as e:
+                return {"error": f"获取表列表时出错: {str(e)}"}
+        return self._get_tables_sql(database)
+    
+    def describe_table(self, table_name: str, database: str = 'default') -> Dict[str, Any]:
+        """获取表结构（含分区键、存储格式和统计信息）：优先读取Glue数据目录，无Glue权限时回退到SQL"""
+        if not self.client:
+            return {"error": "Athena客户端未初始化"}
+        catalog, fingerprint = self._glue_catalog()
+        if catalog:
+            try:
+                return catalog.describe_table(table_name, database)
+            except GlueAccessDenied as e:
+                _glue_denied.add(fingerprint)
+                print(f"无Glue数据目录权限，回退到SQL: {str(e)}", file=sys.stderr)
+            except Exception as e:
+                return {"error": f"获取表结构时出错: {str(e)}"}
+        return self._describe_table_sql(table_name, database)
+    
+    def _get_tables_sql(self, database: str = 'default') -> Dict[str, Any]:
+        """通过SHOW TABLES等SQL获取数据库表列表"""
         try:
             # 如果没有客户端，返回错误
             if not self.client:
@@ -141,17 +639,9 @@ class AthenaServer:
                     }
                 
                 # 启动查询
-                response = self.client.start_query_execution(**query_params)
-                query_id = response['QueryExecutionId']
-                
-                # 等待查询完成
-                while True:
-                    result = self.client.get_query_execution(QueryExecutionId=query_id)
-                    status = result['QueryExecution']['Status']['State']
-                    
-                    if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                        break
-                    time.sleep(1)
+                # 启动查询并等待完成（经过工作组准入控制）
+                query_id, result, _ = self._submit_and_wait(query_params)
+                status = result['QueryExecution']['Status']['State']
                 
                 if status == 'SUCCEEDED':
                     # 获取查询结果
@@ -195,16 +685,9 @@ class AthenaServer:
                             'OutputLocation': s3_output
                         }
                     
-                    response = self.client.start_query_execution(**query_params)
-                    query_id = response['QueryExecutionId']
-                    
-                    while True:
-                        result = self.client.get_query_execution(QueryExecutionId=query_id)
-                        status = result['QueryExecution']['Status']['State']
-                        
-                        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                            break
-                        time.sleep(1)
+                    # 启动查询并等待完成（经过工作组准入控制）
+                    query_id, result, _ = self._submit_and_wait(query_params)
+                    status = result['QueryExecution']['Status']['State']
                     
                     if status == 'SUCCEEDED':
                         # 如果查询成功，说明表存在
@@ -229,16 +712,9 @@ class AthenaServer:
                             'OutputLocation': s3_output
                         }
                     
-                    response = self.client.start_query_execution(**query_params)
-                    query_id = response['QueryExecutionId']
-                    
-                    while True:
-                        result = self.client.get_query_execution(QueryExecutionId=query_id)
-                        status = result['QueryExecution']['Status']['State']
-                        
-                        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                            break
-                        time.sleep(1)
+                    # 启动查询并等待完成（经过工作组准入控制）
+                    query_id, result, _ = self._submit_and_wait(query_params)
+                    status = result['QueryExecution']['Status']['State']
                     
                     if status == 'SUCCEEDED':
                         # 如果查询成功，说明表存在
@@ -252,8 +728,8 @@ class AthenaServer:
         except Exception as e:
             return {"error": f"获取表列表时出错: {str(e)}"}
     
-    def describe_table(self, table_name: str, database: str = 'default') -> Dict[str, Any]:
-        """获取表结构"""
+    def _describe_table_sql(self, table_name: str, database: str = 'default') -> Dict[str, Any]:
+        """通过DESCRIBE等SQL获取表结构"""
         try:
             # 如果没有客户端，返回错误
             if not self.client:
@@ -282,18 +758,9 @@ class AthenaServer:
                 print(f"查询参数: {query_params}", file=sys.stderr)
                 
                 # 启动查询
-                response = self.client.start_query_execution(**query_params)
-                query_id = response['QueryExecutionId']
-                
-                # 等待查询完成
-                while True:
-                    result = self.client.get_query_execution(QueryExecutionId=query_id)
-                    status = result['QueryExecution']['Status']['State']
-                    print(f"查询状态: {status}", file=sys.stderr)
-                    
-                    if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                        break
-                    time.sleep(1)
+                # 启动查询并等待完成（经过工作组准入控制）
+                query_id, result, _ = self._submit_and_wait(query_params)
+                status = result['QueryExecution']['Status']['State']
                 
                 if status == 'SUCCEEDED':
                     # 获取查询结果
@@ -345,17 +812,9 @@ class AthenaServer:
                         }
                     
                     # 启动查询
-                    response = self.client.start_query_execution(**query_params)
-                    query_id = response['QueryExecutionId']
-                    
-                    # 等待查询完成
-                    while True:
-                        result = self.client.get_query_execution(QueryExecutionId=query_id)
-                        status = result['QueryExecution']['Status']['State']
-                        
-                        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                            break
-                        time.sleep(1)
+                    # 启动查询并等待完成（经过工作组准入控制）
+                    query_id, result, _ = self._submit_and_wait(query_params)
+                    status = result['QueryExecution']['Status']['State']
                     
                     if status == 'SUCCEEDED':
                         # 获取查询结果
@@ -397,7 +856,7 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
                 "capabilities": ["database_query", "sql_execution", "data_analysis"],
                 "type": "stdio",
                 "version": "1.0.0",
-                "methods": ["initialize", "execute_query", "get_tables", "describe_table"],
+                "methods": ["initialize", "execute_query", "get_tables", "describe_table", "invalidate_cache"],
                 "status": "ready"
             }
         }
@@ -414,11 +873,38 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
         config = params.get("config", {})
         server.initialize(config)
         
-        return {"result": server.execute_query(
-            params.get("sql"), 
-            params.get("database", "default")
+        sql = params.get("sql")
+        database = params.get("database", "default")
+        fingerprint = config_fingerprint(config, CACHE_FINGERPRINT_KEYS)
+        result_format = params.get("result_format", "rows")
+        columns = params.get("columns")
+        extra = {"max_rows": config.get("max_rows", 100), "result_format": result_format, "columns": columns}
+        # 交互式查询(query)在并发名额不足时优先于分析计划步骤(analysis)
+        priority = params.get("priority", DEFAULT_PRIORITY)
+        if params.get("stream"):
+            # 流式模式：缓存命中时从缓存拆帧返回，否则每读到一页就发出，完整读完（未截断）的结果写入缓存
+            chunk_size = params.get("chunk_size", DEFAULT_CHUNK_SIZE)
+            cached = lookup_cached("athena", sql, database, fingerprint, config,
+                                   use_cache=params.get("use_cache", True), extra=extra)
+            if cached is not None:
+                return result_frames(cached, chunk_size)
+            return cache_stream("athena", sql, database, fingerprint, config,
+                                server.execute_query_stream(sql, database, chunk_size, priority, columns),
+                                use_cache=params.get("use_cache", True), extra=extra)
+        
+        # Athena查询耗时长且按扫描量计费，相同查询在TTL内直接返回缓存结果
+        return {"result": cached_execute(
+            "athena", sql, database, fingerprint, config,
+            lambda: server.execute_query(sql, database, priority, result_format, columns),
+            use_cache=params.get("use_cache", True),
+            extra=extra
         )}
     
+    elif method == "invalidate_cache":
+        # 数据变更后按表失效结果缓存，不传tables时清空全部
+        invalidated = result_cache.invalidate(params.get("tables"))
+        return {"result": {"success": True, "invalidated": invalidated, "cache": result_cache.stats()}}
+    
     elif method == "get_tables":
         server = AthenaServer()
         config = params.get("config", {})
@@ -440,19 +926,9 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
         return {"error": f"未知方法: {method}"}
 
 def main():
-    """MCP服务器主循环"""
+    """MCP服务器主循环：请求在线程池中并发处理，响应按请求id返回"""
     print("Athena MCP Server 启动中...", file=sys.stderr)
-    
-    for line in sys.stdin:
-        try:
-            request = json.loads(line.strip())
-            response = handle_mcp_request(request)
-            print(json.dumps(response))
-            sys.stdout.flush()
-        except json.JSONDecodeError:
-            print(json.dumps({"error": "无效的JSON请求"}))
-        except Exception as e:
-            print(json.dumps({"error": f"处理请求时出错: {str(e)}"}))
+    serve_stdio(handle_mcp_request, max_workers=int(os.environ.get("MCP_SERVER_THREADS", DEFAULT_SERVER_THREADS)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Glue数据目录元数据读取
+直接通过Glue API获取表列表、列、分区键、存储格式和表统计信息，
+替代在Athena中执行SHOW TABLES / DESCRIBE / SELECT * LIMIT 1（每次数秒且可能扫描数据）。
+"""
+
+from typing import Dict, Any, List, Optional
+
+# 视为“没有Glue权限”的错误码，出现时调用方回退到SQL方式
+ACCESS_DENIED_CODES = ('AccessDeniedException', 'AccessDenied', 'UnauthorizedOperation', 'UnrecognizedClientException')
+
+# 表参数中的统计信息（由Glue爬网程序或ANALYZE写入）
+_STAT_PARAMETERS = {
+    'numRows': 'num_rows',
+    'recordCount': 'num_rows',
+    'totalSize': 'size_bytes',
+    'sizeKey': 'size_bytes',
+    'numFiles': 'num_files',
+    'objectCount': 'num_files',
+    'averageRecordSize': 'average_record_size',
+    'compressionType': 'compression'
+}
+
+class GlueAccessDenied(Exception):
+    """当前凭证无权访问Glue数据目录"""
+
+def is_access_denied(error: Exception) -> bool:
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+    return code in ACCESS_DENIED_CODES
+
+def _error_code(error: Exception) -> str:
+    return getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+
+def storage_format(table: Dict[str, Any]) -> str:
+    """根据表类型、classification参数或InputFormat/SerDe推断存储格式"""
+    parameters = table.get('Parameters', {}) or {}
+    if parameters.get('table_type', '').upper() == 'ICEBERG':
+        return 'iceberg'
+    if parameters.get('classification'):
+        return parameters['classification'].lower()
+    descriptor = table.get('StorageDescriptor', {}) or {}
+    input_format = (descriptor.get('InputFormat') or '').lower()
+    serde = ((descriptor.get('SerdeInfo') or {}).get('SerializationLibrary') or '').lower()
+    for name in ('parquet', 'orc', 'avro'):
+        if name in input_format or name in serde:
+            return name
+    if 'json' in serde:
+        return 'json'
+    if 'opencsv' in serde or 'lazysimple' in serde:
+        return 'csv'
+    return 'unknown'
+
+def table_stats(table: Dict[str, Any]) -> Dict[str, Any]:
+    """从表参数中提取统计信息，数值参数转换为数字"""
+    parameters = table.get('Parameters', {}) or {}
+    stats = {}
+    for key, name in _STAT_PARAMETERS.items():
+        value = parameters.get(key)
+        if value is None or name in stats:
+            continue
+        try:
+            stats[name] = int(float(value)) if name != 'compression' else value
+        except ValueError:
+            stats[name] = value
+    if parameters.get('projection.enabled', '').lower() == 'true':
+        stats['partition_projection'] = True
+    return stats
+
+def _columns(table: Dict[str, Any]) -> List[Dict[str, Any]]:
+    columns = []
+    for column in (table.get('StorageDescriptor', {}) or {}).get('Columns', []):
+        columns.append({
+            "name": column['Name'],
+            "type": column.get('Type', ''),
+            "comment": column.get('Comment', '')
+        })
+    for column in table.get('PartitionKeys', []) or []:
+        columns.append({
+            "name": column['Name'],
+            "type": column.get('Type', ''),
+            "comment": column.get('Comment', ''),
+            "partition_key": True
+        })
+    return columns
+
+def table_summary(table: Dict[str, Any]) -> Dict[str, Any]:
+    """表列表中的单项，字段与MySQL服务器的get_tables保持一致并补充Glue特有信息"""
+    stats = table_stats(table)
+    return {
+        "name": table['Name'],
+        "type": table.get('TableType', ''),
+        "comment": table.get('Description', ''),
+        "estimated_rows": stats.get('num_rows', 0),
+        "format": storage_format(table),
+        "partition_keys": [column['Name'] for column in table.get('PartitionKeys', []) or []],
+        "location": (table.get('StorageDescriptor', {}) or {}).get('Location', '')
+    }
+
+class GlueCatalog:
+    """Glue数据目录读取器；无权限时抛出GlueAccessDenied"""
+
+    def __init__(self, client, catalog_id: Optional[str] = None):
+        self.client = client
+        self.catalog_id = catalog_id
+
+    def _params(self, **params) -> Dict[str, Any]:
+        if self.catalog_id:
+            params['CatalogId'] = self.catalog_id
+        return params
+
+    def get_tables(self, database: str) -> Dict[str, Any]:
+        """分页列出数据库中的所有表（每页最多100个表，包含完整的列定义）"""
+        tables = []
+        try:
+            paginator = self.client.get_paginator('get_tables')
+            for page in paginator.paginate(**self._params(DatabaseName=database)):
+                tables.extend(table_summary(table) for table in page.get('TableList', []))
+        except Exception as e:
+            if is_access_denied(e):
+                raise GlueAccessDenied(str(e))
+            if _error_code(e) == 'EntityNotFoundException':
+                return {"error": f"数据库不存在: {database}"}
+            raise
+        return {"success": True, "tables": tables, "source": "glue"}
+
+    def describe_table(self, table_name: str, database: str) -> Dict[str, Any]:
+        """获取表的列（含分区键）、存储格式和统计信息"""
+        try:
+            table = self.client.get_table(**self._params(DatabaseName=database, Name=table_name))['Table']
+        except Exception as e:
+            if is_access_denied(e):
+                raise GlueAccessDenied(str(e))
+            if _error_code(e) == 'EntityNotFoundException':
+                return {"error": f"表不存在: {database}.{table_name}"}
+            raise
+        summary = table_summary(table)
+        return {
+            "success": True,
+            "table_name": table['Name'],
+            "columns": _columns(table),
+            "partition_keys": summary["partition_keys"],
+            "format": summary["format"],
+            "location": summary["location"],
+            "stats": table_stats(table),
+            "source": "glue"
+        }
@@ -4,108 +4,368 @@
 添加连接池、事务管理、错误重试等功能
 """
 
-import json
+import datetime
+import decimal
+import os
 import sys
+import threading
 import pymysql
+import pymysql.cursors
 import time
 from pymysql.connections import Connection
-from typing import Dict, Any, List, Optional
+from pymysql.constants import FIELD_TYPE
+from typing import Dict, Any, List, Optional, Callable
 import logging
 
+# 以脚本方式启动时把项目根目录加入路径，以便导入公共协议模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_servers.stdio_protocol import (
+    serve_stdio, DEFAULT_SERVER_THREADS,
+    header_frame, rows_frame, trailer_frame, result_frames
+)
+from mcp_servers.result_cache import cached_execute, cache_stream, lookup_cached, result_cache, config_fingerprint as _fingerprint
+
+# 无缓冲游标默认每批读取的行数
+DEFAULT_FETCH_BATCH_SIZE = 500
+
+# MySQL字段类型编号 -> 名称，用于流式响应的header帧
+FIELD_TYPE_NAMES = {value: name for name, value in vars(FIELD_TYPE).items() if name.isupper() and isinstance(value, int)}
+
+# MySQL中表示二进制（非文本）字段的字符集编号
+BINARY_CHARSET = 63
+
+def format_value(value: Any) -> Any:
+    """逐值探测类型的通用转换，仅用于无法按类型编号确定转换方式的列"""
+    # 处理Decimal类型
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    # 处理日期时间类型
+    if hasattr(value, 'strftime'):
+        return value.isoformat()
+    # 处理TIME类型（pymysql返回timedelta）
+    if isinstance(value, datetime.timedelta):
+        return _timedelta_to_str(value)
+    # 处理bytes类型
+    if isinstance(value, bytes):
+        return _bytes_to_str(value)
+    # 处理其他类型
+    return value
+
+def _decimal_to_float(value):
+    return None if value is None else float(value)
+
+def _isoformat(value):
+    return None if value is None else value.isoformat()
+
+def _timedelta_to_str(value):
+    """把TIME列的timedelta格式化为MySQL的[-]HH:MM:SS[.ffffff]形式"""
+    if value is None:
+        return None
+    sign = '-' if value < datetime.timedelta(0) else ''
+    value = abs(value)
+    total = value.days * 86400 + value.seconds
+    microseconds = value.microseconds
+    hours, remainder = divmod(total, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    text = f"{sign}{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{text}.{microseconds:06d}" if microseconds else text
+
+def _bytes_to_str(value):
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return str(value)
+    return value
+
+# 按字段类型编号确定的转换函数；None表示原样返回（整数、浮点、文本等）
+_TYPE_CONVERTERS = {
+    FIELD_TYPE.DECIMAL: _decimal_to_float,
+    FIELD_TYPE.NEWDECIMAL: _decimal_to_float,
+    FIELD_TYPE.DATE: _isoformat,
+    FIELD_TYPE.DATETIME: _isoformat,
+    FIELD_TYPE.TIMESTAMP: _isoformat,
+    FIELD_TYPE.TIME: _timedelta_to_str,
+    FIELD_TYPE.BIT: _bytes_to_str,
+    FIELD_TYPE.TINY: None,
+    FIELD_TYPE.SHORT: None,
+    FIELD_TYPE.LONG: None,
+    FIELD_TYPE.INT24: None,
+    FIELD_TYPE.LONGLONG: None,
+    FIELD_TYPE.YEAR: None,
+    FIELD_TYPE.FLOAT: None,
+    FIELD_TYPE.DOUBLE: None,
+    FIELD_TYPE.NULL: None,
+    FIELD_TYPE.JSON: None
+}
+# 文本/二进制共用的类型：二进制字符集时返回bytes，需要解码
+_STRING_TYPES = {
+    FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING,
+    FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB
+}
+
+def _fallback_converter(value):
+    return None if value is None else format_value(value)
+
+def build_converter_plan(description, fields=None) -> List[Optional[Callable[[Any], Any]]]:
+    """根据cursor.description中的类型编号为每列确定一次转换函数，None表示无需转换。
+    fields为pymysql结果的字段元数据（含字符集），用于区分文本列与二进制列"""
+    plan = []
+    for index, desc in enumerate(description):
+        type_code = desc[1]
+        if type_code in _STRING_TYPES:
+            charset = getattr(fields[index], 'charsetnr', None) if fields and index < len(fields) else None
+            # 文本列pymysql已解码为str，原样返回；二进制或字符集未知时按bytes解码
+            plan.append(None if charset is not None and charset != BINARY_CHARSET else _bytes_to_str)
+        elif type_code in _TYPE_CONVERTERS:
+            plan.append(_TYPE_CONVERTERS[type_code])
+        else:
+            plan.append(_fallback_converter)
+    return plan
+
+def apply_converter_plan(rows, plan: List[Optional[Callable[[Any], Any]]]) -> List[List[Any]]:
+    """按列应用转换计划：先转置为列，只对需要转换的列做map，再转回行"""
+    if not rows:
+        return []
+    if all(converter is None for converter in plan):
+        return [list(row) for row in rows]
+    columns = list(zip(*rows))
+    for index, converter in enumerate(plan):
+        if converter is not None:
+            columns[index] = map(converter, columns[index])
+    return [list(row) for row in zip(*columns)]
+
 # 自定义连接池异常
 class PoolError(Exception):
     """连接池错误"""
     pass
 
+# 参与连接池指纹计算的配置项：这些项相同的请求可以共享同一个连接池
+POOL_FINGERPRINT_KEYS = [
+    'host', 'port', 'username', 'password', 'database',
+    'use_ssl', 'ssl_mode', 'ssl_ca', 'ssl_cert', 'ssl_key',
+    'connection_timeout', 'read_timeout', 'write_timeout'
+]
+
+def config_fingerprint(config: Dict[str, Any], keys: List[str] = None) -> str:
+    """计算连接配置指纹"""
+    return _fingerprint(config, keys or POOL_FINGERPRINT_KEYS)
+
 class MySQLConnectionPool:
-    def __init__(self, config: Dict[str, Any], max_connections: int = 5):
+    def __init__(self, config: Dict[str, Any], max_connections: int = 5, wait_timeout: float = 30):
         self.config = config
         self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
         self.pool = []
         self.in_use = set()
+        # 常驻进程内并发处理多个请求，连接用尽时在条件变量上等待归还
+        self.lock = threading.Condition()
+        self.created_at = time.time()
+        self.last_used = self.created_at
         
     def get_connection(self) -> Connection:
-        """从连接池获取连接"""
-        # 尝试从池中获取可用连接
-        while self.pool:
-            conn = self.pool.pop()
-            try:
-                conn.ping(reconnect=True)
-                self.in_use.add(conn)
-                return conn
-            except:
-                conn.close()
+        """从连接池获取连接，连接数已达上限时等待其他请求归还"""
+        deadline = time.time() + self.wait_timeout
+        with self.lock:
+            while True:
+                self.last_used = time.time()
+                # 尝试从池中获取可用连接
+                while self.pool:
+                    conn = self.pool.pop()
+                    try:
+                        conn.ping(reconnect=True)
+                        self.in_use.add(conn)
+                        return conn
+                    except:
+                        conn.close()
                 
-        # 如果没有可用连接且未达到最大连接数，创建新连接
-        if len(self.in_use) < self.max_connections:
-            # 准备连接参数
-            connection_params = {
-                'host': self.config.get('host', 'localhost'),
-                'port': self.config.get('port', 3306),
-                'user': self.config.get('username'),
-                'password': self.config.get('password'),
-                'database': self.config.get('database'),
-                'charset': 'utf8mb4',
-                'autocommit': True,
-                'connect_timeout': self.config.get('connection_timeout', 10),
-                'read_timeout': self.config.get('read_timeout', 30),
-                'write_timeout': self.config.get('write_timeout', 30)
-            }
+                if len(self.in_use) < self.max_connections:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolError(f"连接池已满，等待{self.wait_timeout}秒后仍无可用连接")
+                self.lock.wait(remaining)
+            # 先占位，建立连接（含TLS握手）放在锁外
+            placeholder = object()
+            self.in_use.add(placeholder)
+        
+        try:
+            conn = self._create_connection()
+        except Exception:
+            with self.lock:
+                self.in_use.discard(placeholder)
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.in_use.discard(placeholder)
+            self.in_use.add(conn)
+        return conn
+    
+    def _create_connection(self) -> Connection:
+        """创建新连接"""
+        # 准备连接参数
+        connection_params = {
+            'host': self.config.get('host', 'localhost'),
+            'port': self.config.get('port', 3306),
+            'user': self.config.get('username'),
+            'password': self.config.get('password'),
+            'database': self.config.get('database'),
+            'charset': 'utf8mb4',
+            'autocommit': True,
+            'connect_timeout': self.config.get('connection_timeout', 10),
+            'read_timeout': self.config.get('read_timeout', 30),
+            'write_timeout': self.config.get('write_timeout', 30)
+        }
+        
+        # SSL配置处理
+        if self.config.get('use_ssl', False):
+            ssl_mode = self.config.get('ssl_mode', '系统CA证书')
             
-            # SSL配置处理
-            if self.config.get('use_ssl', False):
-                ssl_mode = self.config.get('ssl_mode', '系统CA证书')
-                
-                if ssl_mode == '系统CA证书':
-                    # 使用系统默认CA证书验证服务器证书
-                    ssl_config = {
-                        'check_hostname': True,  # 验证主机名
-                        'verify_mode': 2         # ssl.CERT_REQUIRED 等价
-                    }
-                    # 让PyMySQL使用系统默认的CA证书
-                    connection_params['ssl'] = ssl_config
-                    
-                elif ssl_mode == '自定义证书':
-                    # 使用用户提供的证书文件
-                    ssl_config = {}
-                    if self.config.get('ssl_ca'):
-                        ssl_config['ca'] = self.config['ssl_ca']
-                    if self.config.get('ssl_cert'):
-                        ssl_config['cert'] = self.config['ssl_cert']
-                    if self.config.get('ssl_key'):
-                        ssl_config['key'] = self.config['ssl_key']
-                    
-                    if ssl_config:
-                        connection_params['ssl'] = ssl_config
-                    else:
-                        # 如果选择自定义但没有证书，回退到系统CA
-                        connection_params['ssl'] = {'check_hostname': True, 'verify_mode': 2}
+            if ssl_mode == '系统CA证书':
+                # 使用系统默认CA证书验证服务器证书
+                ssl_config = {
+                    'check_hostname': True,  # 验证主机名
+                    'verify_mode': 2         # ssl.CERT_REQUIRED 等价
+                }
+                # 让PyMySQL使用系统默认的CA证书
+                connection_params['ssl'] = ssl_config
                 
-                elif ssl_mode == '强制SSL':
-                    # 强制SSL但不验证证书
-                    connection_params['ssl'] = {'check_hostname': False, 'verify_mode': 0}
+            elif ssl_mode == '自定义证书':
+                # 使用用户提供的证书文件
+                ssl_config = {}
+                if self.config.get('ssl_ca'):
+                    ssl_config['ca'] = self.config['ssl_ca']
+                if self.config.get('ssl_cert'):
+                    ssl_config['cert'] = self.config['ssl_cert']
+                if self.config.get('ssl_key'):
+                    ssl_config['key'] = self.config['ssl_key']
                 
+                if ssl_config:
+                    connection_params['ssl'] = ssl_config
                 else:
-                    # 默认使用系统CA证书
+                    # 如果选择自定义但没有证书，回退到系统CA
                     connection_params['ssl'] = {'check_hostname': True, 'verify_mode': 2}
-            else:
-                # 如果未启用SSL，尝试禁用SSL
-                connection_params['ssl_disabled'] = True
             
-            conn = pymysql.connect(**connection_params)
-            self.in_use.add(conn)
-            return conn
+            elif ssl_mode == '强制SSL':
+                # 强制SSL但不验证证书
+                connection_params['ssl'] = {'check_hostname': False, 'verify_mode': 0}
+            
+            else:
+                # 默认使用系统CA证书
+                connection_params['ssl'] = {'check_hostname': True, 'verify_mode': 2}
+        else:
+            # 如果未启用SSL，尝试禁用SSL
+            connection_params['ssl_disabled'] = True
         
-        raise PoolError("连接池已满，无法获取新连接")
+        return pymysql.connect(**connection_params)
     
     def return_connection(self, conn: Connection):
         """归还连接到池中"""
-        if conn in self.in_use:
-            self.in_use.remove(conn)
-            if len(self.pool) < self.max_connections:
-                self.pool.append(conn)
+        with self.lock:
+            self.last_used = time.time()
+            if conn in self.in_use:
+                self.in_use.remove(conn)
+                self.lock.notify()
+                if len(self.pool) < self.max_connections:
+                    self.pool.append(conn)
+                    return
             else:
+                return
+        conn.close()
+    
+    def abort_connection(self, conn: Connection):
+        """终止连接上仍在返回结果的查询并丢弃该连接。
+        无缓冲查询未读完时协议流中仍有数据，连接不能复用；先通过另一条连接KILL QUERY让服务端停止执行"""
+        try:
+            thread_id = conn.thread_id()
+            killer = self._create_connection()
+            try:
+                with killer.cursor() as cursor:
+                    cursor.execute(f"KILL QUERY {int(thread_id)}")
+            finally:
+                killer.close()
+        except Exception:
+            # 终止失败时关闭连接，服务端在写入已关闭的连接时也会中止查询
+            pass
+        with self.lock:
+            self.in_use.discard(conn)
+            self.lock.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def is_idle(self, idle_timeout: float) -> bool:
+        """没有借出的连接且超过idle_timeout未被使用"""
+        with self.lock:
+            return not self.in_use and time.time() - self.last_used > idle_timeout
+    
+    def close_all(self):
+        """关闭池中所有空闲连接"""
+        with self.lock:
+            connections = list(self.pool)
+            self.pool.clear()
+        for conn in connections:
+            try:
                 conn.close()
+            except Exception:
+                pass
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "idle_connections": len(self.pool),
+                "in_use_connections": len(self.in_use),
+                "max_connections": self.max_connections,
+                "age": round(time.time() - self.created_at, 1),
+                "idle_for": round(time.time() - self.last_used, 1)
+            }
+
+class MySQLPoolRegistry:
+    """按配置指纹缓存连接池，常驻进程中跨请求复用，并淘汰长时间空闲的池"""
+    
+    def __init__(self, default_idle_timeout: float = 300):
+        self.default_idle_timeout = default_idle_timeout
+        self._pools: Dict[str, MySQLConnectionPool] = {}
+        self._lock = threading.Lock()
+    
+    def get_pool(self, config: Dict[str, Any]):
+        """返回 (连接池, 是否新建)"""
+        fingerprint = config_fingerprint(config)
+        self.evict_idle(config.get('pool_idle_timeout', self.default_idle_timeout))
+        with self._lock:
+            pool = self._pools.get(fingerprint)
+            if pool is not None:
+                return pool, False
+            pool = MySQLConnectionPool(
+                config,
+                max_connections=config.get('max_connections', 5),
+                wait_timeout=config.get('pool_wait_timeout', 30)
+            )
+            self._pools[fingerprint] = pool
+            return pool, True
+    
+    def discard(self, config: Dict[str, Any]):
+        """移除（通常是初始化失败的）连接池"""
+        with self._lock:
+            pool = self._pools.pop(config_fingerprint(config), None)
+        if pool:
+            pool.close_all()
+    
+    def evict_idle(self, idle_timeout: float):
+        """淘汰空闲超时的连接池"""
+        with self._lock:
+            expired = [fp for fp, pool in self._pools.items() if pool.is_idle(idle_timeout)]
+            evicted = [self._pools.pop(fp) for fp in expired]
+        for pool in evicted:
+            pool.close_all()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {fp: pool.stats() for fp, pool in self._pools.items()}
+
+# 进程级连接池注册表
+pool_registry = MySQLPoolRegistry()
 
 class MySQLServerOptimized:
     def __init__(self):
@@ -119,92 +379,68 @@ class MySQLServerOptimized:
         return logging.getLogger(__name__)
     
     def initialize(self, config: Dict[str, Any]):
-        """初始化MySQL连接池"""
+        """初始化MySQL连接池（相同配置指纹的请求复用已有连接池）"""
         self.config = config
         try:
-            self.pool = MySQLConnectionPool(config)
-            # 测试连接
-            conn = self.pool.get_connection()
-            self.pool.return_connection(conn)
-            self.logger.info("MySQL连接池初始化成功")
+            self.pool, created = pool_registry.get_pool(config)
+            if created:
+                # 仅在新建连接池时测试连接，建立的连接会留在池中供后续复用
+                conn = self.pool.get_connection()
+                self.pool.return_connection(conn)
+                self.logger.info("MySQL连接池初始化成功")
         except Exception as e:
+            pool_registry.discard(config)
+            self.pool = None
             self.logger.error(f"MySQL连接池初始化失败: {str(e)}")
             raise Exception(f"MySQL连接池初始化失败: {str(e)}")
     
     def execute_query(self, sql: str, max_retries: int = 3) -> Dict[str, Any]:
-        """执行MySQL查询，支持重试机制"""
+        """执行MySQL查询，支持重试机制；最多读取max_rows+1行，超出部分在服务端终止"""
         if not self.pool:
             return {"error": "MySQL连接池未初始化"}
         
         # SQL安全检查
         if self._is_dangerous_sql(sql):
             return {"error": "检测到危险SQL操作，查询被拒绝"}
+        if not sql.strip().upper().startswith('SELECT'):
+            # 非查询操作（虽然应该被安全检查拦截）
+            return {"error": "不支持非查询操作"}
         
+        max_rows = self.config.get('max_rows', 1000)
         last_error = None
         for attempt in range(max_retries):
-            conn = None
             try:
-                conn = self.pool.get_connection()
-                with conn.cursor() as cursor:
-                    start_time = time.time()
-                    cursor.execute(sql)
-                    execution_time = time.time() - start_time
-                    
-                    if sql.strip().upper().startswith('SELECT'):
-                        # 查询操作
-                        columns = [desc[0] for desc in cursor.description]
-                        rows = cursor.fetchall()
-                        
-                        # 应用行数限制
-                        max_rows = self.config.get('max_rows', 1000)
-                        total_rows = len(rows)
-                        if total_rows > max_rows:
-                            rows = rows[:max_rows]
-                            truncated = True
-                        else:
-                            truncated = False
-                        
-                        # 转换为列表格式，处理特殊数据类型
-                        formatted_rows = []
-                        for row in rows:
-                            formatted_row = []
-                            for value in row:
-                                # 处理Decimal类型
-                                if hasattr(value, '__class__') and 'Decimal' in str(type(value)):
-                                    formatted_row.append(float(value))
-                                # 处理日期时间类型
-                                elif hasattr(value, 'strftime'):
-                                    formatted_row.append(value.isoformat())
-                                # 处理bytes类型
-                                elif isinstance(value, bytes):
-                                    try:
-                                        formatted_row.append(value.decode('utf-8'))
-                                    except:
-                                        formatted_row.append(str(value))
-                                # 处理其他类型
-                                else:
-                                    formatted_row.append(value)
-                            formatted_rows.append(formatted_row)
-                        
-                        result = {
-                            "success": True,
-                            "data": {
-                                "columns": columns,
-                                "rows": formatted_rows,
-                                "row_count": len(formatted_rows),
-                                "total_rows": total_rows,
-                                "truncated": truncated,
-                                "execution_time": round(execution_time, 3)
-                            }
-                        }
-                        
-                        if truncated:
-                            result["warning"] = f"结果已截断，仅显示前{max_rows}行，共{total_rows}行"
-                        
-                        return result
+                start_time = time.time()
+                columns, formatted_rows, truncated, plan = [], [], False, []
+                for kind, payload in self._execute_unbuffered(sql, max_rows, self._fetch_batch_size()):
+                    if kind == "header":
+                        description, fields = payload
+                        columns = [desc[0] for desc in description]
+                        plan = build_converter_plan(description, fields)
+                    elif kind == "rows":
+                        # 按列转换计划转换为可JSON序列化的列表
+                        formatted_rows.extend(apply_converter_plan(payload, plan))
                     else:
-                        # 非查询操作（虽然应该被安全检查拦截）
-                        return {"error": "不支持非查询操作"}
+                        truncated = payload
+                execution_time = time.time() - start_time
+                
+                result = {
+                    "success": True,
+                    "data": {
+                        "columns": columns,
+                        "rows": formatted_rows,
+                        "row_count": len(formatted_rows),
+                        # 截断时剩余结果未读取，总行数未知
+                        "total_rows": None if truncated else len(formatted_rows),
+                        "truncated": truncated,
+                        "execution_time": round(execution_time, 3)
+                    }
+                }
+                
+                if truncated:
+                    result["warning"] = f"结果已截断，仅显示前{max_rows}行"
+                
+                return result
                         
             except pymysql.Error as e:
                 last_error = str(e)
@@ -215,12 +451,100 @@ class MySQLServerOptimized:
                 last_error = str(e)
                 self.logger.error(f"执行查询时发生未知错误: {last_error}")
                 break
-            finally:
-                if conn:
-                    self.pool.return_connection(conn)
         
         return {"error": f"查询失败，已重试{max_retries}次: {last_error}"}
     
+    def _fetch_batch_size(self) -> int:
+        """无缓冲游标每次fetchmany读取的行数，可通过fetch_batch_size配置"""
+        return max(1, int(self.config.get('fetch_batch_size', DEFAULT_FETCH_BATCH_SIZE)))
+    
+    def _execute_unbuffered(self, sql: str, max_rows: int, batch_size: int):
+        """使用无缓冲游标(SSCursor)执行查询，分批读取，最多读取max_rows+1行。
+        依次产出 ("header", (cursor.description, 字段元数据))、若干 ("rows", 行列表)、("end", 是否截断)。
+        结果未读完（截断、出错或调用方提前停止）时，终止服务端查询并丢弃该连接，
+        而不是像关闭SSCursor那样把剩余结果全部读过网络"""
+        conn = self.pool.get_connection()
+        executed = False
+        finished = False
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(sql)
+            executed = True
+            yield "header", (cursor.description, getattr(getattr(cursor, '_result', None), 'fields', None))
+            
+            row_count = 0
+            while row_count < max_rows:
+                rows = cursor.fetchmany(min(batch_size, max_rows - row_count))
+                if not rows:
+                    finished = True
+                    break
+                row_count += len(rows)
+                yield "rows", rows
+            
+            if not finished:
+                # 已读满max_rows行，多读一行判断是否还有剩余结果
+                finished = cursor.fetchone() is None
+            if finished:
+                cursor.close()
+            yield "end", not finished
+        finally:
+            if finished or not executed:
+                self.pool.return_connection(conn)
+            else:
+                self.pool.abort_connection(conn)
+    
+    def execute_query_stream(self, sql: str, chunk_size: int = None):
+        """流式执行查询：使用无缓冲游标逐批读取，依次产出header/rows/trailer帧，
+        内存占用只与chunk_size相关而与结果集大小无关"""
+        if not self.pool:
+            yield {"error": "MySQL连接池未初始化"}
+            return
+        if self._is_dangerous_sql(sql):
+            yield {"error": "检测到危险SQL操作，查询被拒绝"}
+            return
+        if not sql.strip().upper().startswith('SELECT'):
+            yield {"error": "不支持非查询操作"}
+            return
+        
+        max_rows = self.config.get('max_rows', 1000)
+        chunk_size = max(1, int(chunk_size)) if chunk_size else self._fetch_batch_size()
+        try:
+            start_time = time.time()
+            columns, column_types, row_count, truncated, plan = [], [], 0, False, []
+            for kind, payload in self._execute_unbuffered(sql, max_rows, chunk_size):
+                if kind == "header":
+                    description, fields = payload
+                    columns = [desc[0] for desc in description]
+                    column_types = [FIELD_TYPE_NAMES.get(desc[1], str(desc[1])) for desc in description]
+                    plan = build_converter_plan(description, fields)
+                    yield header_frame(columns, column_types)
+                elif kind == "rows":
+                    row_count += len(payload)
+                    yield rows_frame(apply_converter_plan(payload, plan))
+                else:
+                    truncated = payload
+            execution_time = time.time() - start_time
+            
+            result = {
+                "success": True,
+                "data": {
+                    "columns": columns,
+                    "column_types": column_types,
+                    "row_count": row_count,
+                    "total_rows": None if truncated else row_count,
+                    "truncated": truncated,
+                    "execution_time": round(execution_time, 3),
+                    "cache_hit": False,
+                    "age": 0
+                }
+            }
+            if truncated:
+                result["warning"] = f"结果已截断，仅显示前{max_rows}行"
+            yield trailer_frame(result)
+        except Exception as e:
+            self.logger.error(f"流式查询失败: {str(e)}")
+            yield {"error": f"查询失败: {str(e)}"}
+    
     def _is_dangerous_sql(self, sql: str) -> bool:
         """检测危险SQL操作"""
         dangerous_keywords = [
@@ -412,11 +736,19 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
                 "capabilities": ["database_query", "sql_execution", "connection_pool", "transaction_management"],
                 "type": "stdio",
                 "version": "1.0.0",
-                "methods": ["initialize", "execute_query", "get_tables", "describe_table", "get_database_stats"],
+                "methods": ["initialize", "execute_query", "get_tables", "describe_table", "get_database_stats", "get_pool_stats", "invalidate_cache"],
                 "status": "ready"
             }
         }
     
+    if method == "get_pool_stats":
+        return {"result": {"success": True, "pools": pool_registry.stats(), "cache": result_cache.stats()}}
+    
+    if method == "invalidate_cache":
+        # 数据变更后按表失效结果缓存，不传tables时清空全部
+        invalidated = result_cache.invalidate(params.get("tables"))
+        return {"result": {"success": True, "invalidated": invalidated, "cache": result_cache.stats()}}
+    
     server = MySQLServerOptimized()
     
     # 如果请求中包含配置信息，先初始化服务器
@@ -430,7 +762,30 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
         return {"result": {"success": True, "message": "MySQL服务器初始化成功"}}
     
     elif method == "execute_query":
-        return {"result": server.execute_query(params.get("sql"))}
+        sql = params.get("sql")
+        config = params.get("config", {})
+        if params.get("stream"):
+            # 流式模式：缓存命中时从缓存拆帧返回，否则边读边发，完整读完（未截断）的结果写入缓存
+            chunk_size = params.get("chunk_size")
+            fingerprint = config_fingerprint(config)
+            extra = {"max_rows": config.get("max_rows", 1000)}
+            cached = lookup_cached(
+                "mysql", sql, config.get("database"), fingerprint, config,
+                use_cache=params.get("use_cache", True), extra=extra
+            )
+            if cached is not None:
+                return result_frames(cached, chunk_size or config.get('fetch_batch_size', DEFAULT_FETCH_BATCH_SIZE))
+            return cache_stream(
+                "mysql", sql, config.get("database"), fingerprint, config,
+                server.execute_query_stream(sql, chunk_size),
+                use_cache=params.get("use_cache", True), extra=extra
+            )
+        return {"result": cached_execute(
+            "mysql", sql, config.get("database"), config_fingerprint(config), config,
+            lambda: server.execute_query(sql),
+            use_cache=params.get("use_cache", True),
+            extra={"max_rows": config.get("max_rows", 1000)}
+        )}
     
     elif method == "get_tables":
         return {"result": server.get_tables()}
@@ -445,19 +800,9 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
         return {"error": f"未知方法: {method}"}
 
 def main():
-    """MCP服务器主循环"""
+    """MCP服务器主循环：请求在线程池中并发处理，响应按请求id返回"""
     print("优化版MySQL MCP Server 启动中...", file=sys.stderr)
-    
-    for line in sys.stdin:
-        try:
-            request = json.loads(line.strip())
-            response = handle_mcp_request(request)
-            print(json.dumps(response))
-            sys.stdout.flush()
-        except json.JSONDecodeError:
-            print(json.dumps({"error": "无效的JSON请求"}))
-        except Exception as e:
-            print(json.dumps({"error": f"处理请求时出错: {str(e)}"}))
+    serve_stdio(handle_mcp_request, max_workers=int(os.environ.get("MCP_SERVER_THREADS", DEFAULT_SERVER_THREADS)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
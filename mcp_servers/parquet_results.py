@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Parquet查询结果读取
+读取Athena UNLOAD写出的Parquet文件（S3前缀，或用于替代S3测试的本地目录），
+按需只读取指定列（列名不区分大小写，不存在的列忽略），值保持原始类型（数值、布尔、NULL），
+日期时间转为ISO字符串以便JSON传输。读取完成后可删除结果目录，避免UNLOAD输出在S3上不断累积。
+依赖可选的pyarrow，未安装时parquet_available()返回False。
+"""
+
+import datetime
+import decimal
+import os
+import shutil
+from typing import Any, List, Optional, Iterator, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DEFAULT_BATCH_ROWS = 5000
+
+def parquet_available() -> bool:
+    return pq is not None
+
+def _split_s3(location: str) -> Tuple[str, str]:
+    bucket, _, prefix = location[len("s3://"):].partition("/")
+    return bucket, prefix
+
+def list_result_files(location: str, s3_client=None) -> List[str]:
+    """列出结果目录下的数据文件（按名称排序）。UNLOAD输出的文件没有扩展名，因此只跳过空文件和隐藏/元数据文件"""
+    if location.startswith("s3://"):
+        bucket, prefix = _split_s3(location)
+        files = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'].rsplit('/', 1)[-1]
+                if item.get('Size', 0) > 0 and name and not name.startswith(('.', '_')):
+                    files.append(f"s3://{bucket}/{item['Key']}")
+        return sorted(files)
+
+    directory = location[len("file://"):] if location.startswith("file://") else location
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if not name.startswith(('.', '_')) and os.path.getsize(os.path.join(directory, name)) > 0
+    )
+
+def delete_result_files(location: str, s3_client=None) -> int:
+    """删除结果目录下的全部对象（含UNLOAD写出的元数据文件），返回删除的对象数"""
+    if location.startswith("s3://"):
+        bucket, prefix = _split_s3(location)
+        keys = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        # delete_objects每次最多1000个键
+        for start in range(0, len(keys), 1000):
+            s3_client.delete_objects(Bucket=bucket, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True
+            })
+        return len(keys)
+
+    directory = location[len("file://"):] if location.startswith("file://") else location
+    if not os.path.isdir(directory):
+        return 0
+    count = len(os.listdir(directory))
+    shutil.rmtree(directory, ignore_errors=True)
+    return count
+
+def _project(schema_names: List[str], columns: Optional[List[str]]) -> List[str]:
+    """按请求的列（不区分大小写）选出文件中存在的列，未指定时读取全部列"""
+    if not columns:
+        return list(schema_names)
+    by_lower = {name.lower(): name for name in schema_names}
+    return [by_lower[name.lower()] for name in columns if name.lower() in by_lower]
+
+def _open_file(path: str, s3_client=None):
+    if path.startswith("s3://"):
+        bucket, key = _split_s3(path)
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            # Parquet需要随机读取（文件尾部元数据），整体读入内存
+            return pq.ParquetFile(pa.BufferReader(body.read()))
+        finally:
+            body.close()
+    return pq.ParquetFile(path)
+
+def athena_type(arrow_type) -> str:
+    """把Arrow类型映射为Athena类型名，与get_query_results返回的列类型一致"""
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_int8(arrow_type):
+        return "tinyint"
+    if pa.types.is_int16(arrow_type):
+        return "smallint"
+    if pa.types.is_int32(arrow_type):
+        return "integer"
+    if pa.types.is_integer(arrow_type):
+        return "bigint"
+    if pa.types.is_float32(arrow_type):
+        return "real"
+    if pa.types.is_floating(arrow_type):
+        return "double"
+    if pa.types.is_decimal(arrow_type):
+        return f"decimal({arrow_type.precision},{arrow_type.scale})"
+    if pa.types.is_date(arrow_type):
+        return "date"
+    if pa.types.is_timestamp(arrow_type):
+        return "timestamp"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "varbinary"
+    if pa.types.is_list(arrow_type):
+        return "array"
+    if pa.types.is_map(arrow_type):
+        return "map"
+    if pa.types.is_struct(arrow_type):
+        return "row"
+    return "varchar"
+
+def _json_safe(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    return value
+
+def _needs_conversion(arrow_type) -> bool:
+    """数值、布尔和字符串列的to_pylist结果可直接JSON序列化，无需逐值转换"""
+    return not (pa.types.is_boolean(arrow_type) or pa.types.is_integer(arrow_type)
+                or pa.types.is_floating(arrow_type) or pa.types.is_string(arrow_type)
+                or pa.types.is_large_string(arrow_type))
+
+def iter_parquet_rows(location: str, max_rows: int, columns: Optional[List[str]] = None,
+                      s3_client=None, batch_rows: int = DEFAULT_BATCH_ROWS) -> Iterator[Tuple[str, Any]]:
+    """读取结果目录下的Parquet文件，最多max_rows行。
+    与Athena服务器的结果读取协议一致：依次产出 ("header", (列名, 列类型))、若干 ("rows", 行列表)、("end", 是否截断)"""
+    files = list_result_files(location, s3_client)
+    header_sent = False
+    fetched = 0
+    truncated = False
+    for path in files:
+        parquet_file = _open_file(path, s3_client)
+        schema = parquet_file.schema_arrow
+        names = _project(schema.names, columns)
+        if not header_sent:
+            yield "header", (list(names), [athena_type(schema.field(name).type) for name in names])
+            header_sent = True
+        convert = [_needs_conversion(schema.field(name).type) for name in names]
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=list(names)):
+            # 多读一行用于判断是否截断
+            remaining = max_rows + 1 - fetched
+            if batch.num_rows > remaining:
+                batch = batch.slice(0, remaining)
+            column_values = []
+            for index, needs in enumerate(convert):
+                values = batch.column(index).to_pylist()
+                column_values.append([_json_safe(value) for value in values] if needs else values)
+            rows = [list(row) for row in zip(*column_values)]
+            fetched += len(rows)
+            if fetched > max_rows:
+                truncated = True
+                rows = rows[:len(rows) - (fetched - max_rows)]
+            if rows:
+                yield "rows", rows
+            if truncated:
+                break
+        if truncated:
+            break
+    if not header_sent:
+        # 结果为空时UNLOAD不写出文件，无法得到列信息
+        yield "header", (list(columns or []), None)
+    yield "end", truncated
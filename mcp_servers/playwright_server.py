@@ -4,11 +4,16 @@ Playwright MCP服务器 - 用于网页搜索和数据抓取
 """
 
 import json
+import os
 import sys
 import asyncio
 from playwright.async_api import async_playwright
 import logging
 
+# 以脚本方式启动时把项目根目录加入路径，以便导入公共协议模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_servers.stdio_protocol import attach_request_id, extract_request_id
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,9 +22,18 @@ class PlaywrightServer:
     def __init__(self):
         self.playwright = None
         self.browser = None
+        self._init_lock = None
         
     async def initialize(self):
-        """初始化Playwright"""
+        """初始化Playwright（并发请求只启动一个浏览器）"""
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.browser:
+                return
+            await self._launch()
+    
+    async def _launch(self):
         try:
             self.playwright = await async_playwright().start()
             self.browser = await self.playwright.chromium.launch(headless=True)
@@ -171,41 +185,52 @@ async def handle_request(method: str, params: dict):
 
 def main():
     """主函数 - 处理标准输入输出"""
-    async def process_single_request():
-        """处理单个请求"""
+    def write_response(response: dict):
+        # 所有响应都在事件循环线程中写出，无需加锁
+        print(json.dumps(response, ensure_ascii=False))
+        sys.stdout.flush()
+    
+    async def process(request: dict):
         try:
-            # 从标准输入读取请求
-            for line in sys.stdin:
-                request = json.loads(line.strip())
-                method = request.get("method", "")
-                params = request.get("params", {})
-                
-                # 处理请求
-                response = await handle_request(method, params)
-                
-                # 输出响应
-                print(json.dumps(response, ensure_ascii=False))
-                sys.stdout.flush()
-                break  # 处理完一个请求就退出
-                
-        except json.JSONDecodeError:
-            print(json.dumps({"error": "无效的JSON请求"}, ensure_ascii=False))
-            sys.stdout.flush()
+            response = await handle_request(request.get("method", ""), request.get("params", {}))
         except Exception as e:
-            print(json.dumps({"error": f"处理请求时发生错误: {str(e)}"}, ensure_ascii=False))
-            sys.stdout.flush()
+            response = {"error": f"处理请求时发生错误: {str(e)}"}
+        write_response(attach_request_id(request, response))
+    
+    async def process_requests():
+        """逐行读取请求，每个请求作为独立任务并发执行，完成即按id返回；stdin关闭后等待在途任务再退出"""
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.strip())
+            except json.JSONDecodeError:
+                response = {"error": "无效的JSON请求"}
+                request_id = extract_request_id(line)
+                if request_id is not None:
+                    response["id"] = request_id
+                write_response(response)
+                continue
+            
+            task = asyncio.create_task(process(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # 在同一事件循环中清理资源
+        await playwright_server.close()
     
     # 运行异步处理
     try:
-        asyncio.run(process_single_request())
+        asyncio.run(process_requests())
     except Exception as e:
         print(json.dumps({"error": f"启动失败: {str(e)}"}, ensure_ascii=False))
-    finally:
-        # 清理资源
-        try:
-            asyncio.run(playwright_server.close())
-        except:
-            pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+MCP服务器查询结果缓存
+常驻进程内按 规范化SQL + 数据库 + 配置指纹 缓存execute_query的成功结果。
+按后端设置不同TTL，按结果总字节数做LRU淘汰，并支持按表名失效。
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, List, Optional, Callable
+
+# 各后端默认TTL(秒)：Athena查询慢且按扫描量计费，缓存更久
+DEFAULT_TTL = {
+    "mysql": 60,
+    "athena": 900
+}
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_TOKEN_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|\s+|[^\s'\"`]+", re.S)
+_TABLE_NAME = r"(?:[`\"]?[\w$]+[`\"]?\.)*[`\"]?[\w$]+[`\"]?"
+# 提取表名时的词法单元：标识符（可带库名和引号）、括号、逗号、分号，其余符号
+_SCAN_PATTERN = re.compile(_TABLE_NAME + r"|[(),;]|[^\s\w(),;`\"$]+")
+# 参数中FROM不表示表的函数，如 EXTRACT(YEAR FROM d)、TRIM(BOTH ' ' FROM s)
+_FROM_ARGUMENT_FUNCTIONS = {"EXTRACT", "TRIM", "SUBSTRING", "SUBSTR", "OVERLAY"}
+# 结束FROM/JOIN表列表的关键字
+_FROM_LIST_END = {"WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "UNION", "INTERSECT", "EXCEPT",
+                  "WINDOW", "QUALIFY", "SELECT", "OFFSET", "FETCH", "FOR"}
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+
+def normalize_sql(sql: str) -> str:
+    """去掉注释、末尾分号并压缩字符串常量以外的空白，使仅格式不同的SQL命中同一缓存"""
+    sql = _COMMENT_PATTERN.sub(" ", sql or "")
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(sql):
+        tokens.append(" " if token.isspace() else token)
+    return "".join(tokens).strip().rstrip(";").strip()
+
+def extract_tables(sql: str) -> List[str]:
+    """提取FROM/JOIN后的表名以及FROM后逗号分隔的各表（小写、去掉库名和引号），用于按表失效。
+    按括号层级扫描：派生表 (SELECT ...) 后面逗号分隔的表同样提取，EXTRACT/TRIM等函数参数中的FROM忽略"""
+    text = _STRING_PATTERN.sub("''", _COMMENT_PATTERN.sub(" ", sql or ""))
+    tables = set()
+    # 每层括号一帧：[所在函数名, 是否在FROM表列表中, 下一个标识符是否为表名]
+    frames = [[None, False, False]]
+    previous = None
+    for token in _SCAN_PATTERN.findall(text):
+        frame = frames[-1]
+        word = token.upper()
+        if token == "(":
+            # 紧跟在标识符后的括号为函数调用；FROM/JOIN后的括号为派生表，占用表名位置
+            function = previous.upper() if previous and not frame[2] else None
+            frame[2] = False
+            frames.append([function, False, False])
+        elif token == ")":
+            if len(frames) > 1:
+                frames.pop()
+        elif token == ",":
+            frame[2] = frame[1]
+        elif token == ";":
+            frames = [[None, False, False]]
+        elif word == "FROM":
+            if frame[0] not in _FROM_ARGUMENT_FUNCTIONS:
+                frame[1] = frame[2] = True
+        elif word == "JOIN":
+            frame[1] = frame[2] = True
+        elif word in _FROM_LIST_END:
+            frame[1] = frame[2] = False
+        elif word in ("ON", "USING"):
+            # 连接条件之后仍可能有逗号分隔的表（a JOIN b ON ..., c）
+            frame[2] = False
+        elif frame[2] and word != "LATERAL":
+            name = token.split(".")[-1].strip('`"').lower()
+            if name and word != "UNNEST":
+                tables.add(name)
+            frame[2] = False
+        previous = token if re.match(r"[\w`\"$]", token) else None
+    return sorted(tables)
+
+def config_fingerprint(config: Dict[str, Any], keys: List[str]) -> str:
+    """计算配置指纹（只保留哈希，不在内存中以明文作为键保存密码）"""
+    relevant = {key: config.get(key) for key in keys}
+    payload = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def make_cache_key(sql: str, database: str, fingerprint: str, extra: Dict[str, Any] = None) -> str:
+    """生成缓存键；extra用于放入影响结果的其他参数（如max_rows）"""
+    payload = json.dumps({
+        "sql": normalize_sql(sql),
+        "database": database or "",
+        "fingerprint": fingerprint,
+        "extra": extra or {}
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CacheEntry:
+    __slots__ = ("result", "size", "created_at", "expires_at", "tables")
+
+    def __init__(self, result: Dict[str, Any], size: int, ttl: float, tables: List[str]):
+        self.result = result
+        self.size = size
+        self.created_at = time.time()
+        self.expires_at = self.created_at + ttl
+        self.tables = tables
+
+class ResultCache:
+    """按总字节数限制容量的LRU结果缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats_counter = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats_counter["misses"] += 1
+                return None
+            if time.time() >= entry.expires_at:
+                self._remove(key)
+                self.stats_counter["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counter["hits"] += 1
+            return entry
+
+    def put(self, key: str, result: Dict[str, Any], ttl: float, tables: List[str] = None) -> bool:
+        """写入缓存；单个结果超过容量上限时不缓存"""
+        if ttl <= 0:
+            return False
+        size = len(json.dumps(result, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(result, size, ttl, tables or [])
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats_counter["evictions"] += 1
+        return True
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def invalidate(self, tables: List[str] = None) -> int:
+        """按表名失效引用这些表的结果；tables为空时清空全部缓存。返回失效条目数"""
+        with self._lock:
+            if not tables:
+                keys = list(self._entries)
+            else:
+                targets = {t.split(".")[-1].strip('`"').lower() for t in tables}
+                keys = [key for key, entry in self._entries.items() if targets.intersection(entry.tables)]
+            for key in keys:
+                self._remove(key)
+            self.stats_counter["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                **self.stats_counter
+            }
+
+# 进程级结果缓存
+result_cache = ResultCache()
+
+def lookup_cached(backend: str, sql: str, database: str, fingerprint: str, config: Dict[str, Any],
+                  use_cache: bool = True, extra: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+    """只查缓存不执行，命中时返回带cache_hit标记的结果，否则返回None"""
+    if not use_cache or not config.get("cache_enabled", True):
+        return None
+    entry = result_cache.get(make_cache_key(sql, database, fingerprint, extra))
+    if entry is None:
+        return None
+    return _mark(entry.result, True, time.time() - entry.created_at)
+
+def cached_execute(backend: str, sql: str, database: str, fingerprint: str, config: Dict[str, Any],
+                   execute: Callable[[], Dict[str, Any]], use_cache: bool = True,
+                   extra: Dict[str, Any] = None) -> Dict[str, Any]:
+    """带缓存执行查询：命中时直接返回缓存结果，否则执行并缓存成功结果。
+    在返回结果的data中标注cache_hit和age(秒)。
+    配置项：cache_enabled（默认开启）、cache_ttl（默认按后端）、cache_max_mb（缓存容量）"""
+    if config.get("cache_max_mb"):
+        result_cache.max_bytes = int(float(config["cache_max_mb"]) * 1024 * 1024)
+
+    ttl = float(config.get("cache_ttl", DEFAULT_TTL.get(backend, 60)))
+    if not use_cache or not config.get("cache_enabled", True) or ttl <= 0:
+        return _mark(execute(), False, 0)
+
+    key = make_cache_key(sql, database, fingerprint, extra)
+    entry = result_cache.get(key)
+    if entry is not None:
+        return _mark(entry.result, True, time.time() - entry.created_at)
+
+    result = execute()
+    if isinstance(result, dict) and result.get("success"):
+        result_cache.put(key, result, ttl, extract_tables(sql))
+    return _mark(result, False, 0)
+
+def cache_stream(backend: str, sql: str, database: str, fingerprint: str, config: Dict[str, Any],
+                 frames: Iterator[Dict[str, Any]], use_cache: bool = True,
+                 extra: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+    """透传流式帧（header/rows/trailer），同时收集各帧的行；trailer表明查询成功且结果未截断时，
+    在发出trailer前把完整结果写入缓存（超过cache_max_mb的结果由put拒绝）。
+    流式结果本身受max_rows限制，收集的行数有上限"""
+    if config.get("cache_max_mb"):
+        result_cache.max_bytes = int(float(config["cache_max_mb"]) * 1024 * 1024)
+
+    ttl = float(config.get("cache_ttl", DEFAULT_TTL.get(backend, 60)))
+    if not use_cache or not config.get("cache_enabled", True) or ttl <= 0:
+        yield from frames
+        return
+
+    columns, column_types, rows = [], None, []
+    for frame in frames:
+        kind = frame.get("stream")
+        if kind == "header":
+            columns, column_types = frame.get("columns", []), frame.get("column_types")
+        elif kind == "rows":
+            rows.extend(frame.get("rows", []))
+        elif kind == "trailer":
+            result = frame.get("result")
+            if isinstance(result, dict) and result.get("success") and isinstance(result.get("data"), dict) \
+                    and not result["data"].get("truncated"):
+                cached = dict(result)
+                cached["data"] = {key: value for key, value in result["data"].items() if key not in ("cache_hit", "age")}
+                cached["data"].update(columns=columns, rows=rows)
+                if column_types is not None:
+                    cached["data"]["column_types"] = column_types
+                result_cache.put(make_cache_key(sql, database, fingerprint, extra), cached, ttl, extract_tables(sql))
+        yield frame
+
+def _mark(result: Dict[str, Any], hit: bool, age: float) -> Dict[str, Any]:
+    """返回带缓存标记的浅拷贝，不修改缓存中的对象"""
+    if not isinstance(result, dict) or not isinstance(result.get("data"), dict):
+        return result
+    marked = dict(result)
+    marked["data"] = dict(result["data"])
+    marked["data"]["cache_hit"] = hit
+    marked["data"]["age"] = round(age, 1)
+    return marked
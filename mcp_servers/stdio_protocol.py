@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+MCP stdio协议公共处理
+每行一个JSON请求/响应；请求可携带"id"，响应原样带回，使客户端可以在同一进程上
+同时发出多个请求并按id匹配乱序返回的响应。未携带id的旧式请求保持原有行为。
+
+流式响应：处理函数返回生成器时，依次输出多帧（均带同一id）：
+    {"stream": "header", "columns": [...], "column_types": [...]}
+    {"stream": "rows", "rows": [...]}            （可有多帧）
+    {"stream": "trailer", "result": {...}}       （结束帧，result中不含rows）
+中途出错时以 {"error": "..."} 作为结束帧。
+"""
+
+import inspect
+import json
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional, Iterator, List
+
+DEFAULT_SERVER_THREADS = 8
+DEFAULT_CHUNK_SIZE = 500
+
+_ID_PATTERN = re.compile(r'"id"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+
+def extract_request_id(line: str) -> Optional[Any]:
+    """从无法完整解析的请求行中尽量提取id，以便错误响应仍能匹配到对应请求"""
+    match = _ID_PATTERN.search(line)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+
+def attach_request_id(request: Any, response: Dict[str, Any]) -> Dict[str, Any]:
+    """把请求id带回响应"""
+    if isinstance(request, dict) and "id" in request and isinstance(response, dict):
+        response = dict(response)
+        response["id"] = request["id"]
+    return response
+
+def header_frame(columns: List[str], column_types: List[str] = None) -> Dict[str, Any]:
+    frame = {"stream": "header", "columns": columns}
+    if column_types is not None:
+        frame["column_types"] = column_types
+    return frame
+
+def rows_frame(rows: List[Any]) -> Dict[str, Any]:
+    return {"stream": "rows", "rows": rows}
+
+def trailer_frame(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {"stream": "trailer", "result": result}
+
+def result_frames(result: Dict[str, Any], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """把一次性得到的查询结果（如缓存命中）拆成流式帧"""
+    if not isinstance(result, dict) or not result.get("success") or not isinstance(result.get("data"), dict):
+        yield result if isinstance(result, dict) and "error" in result else {"error": "查询结果格式不正确"}
+        return
+    data = dict(result["data"])
+    rows = data.pop("rows", [])
+    yield header_frame(data.pop("columns", []), data.pop("column_types", None))
+    chunk_size = max(1, int(chunk_size))
+    for start in range(0, len(rows), chunk_size):
+        yield rows_frame(rows[start:start + chunk_size])
+    trailer = dict(result)
+    trailer["data"] = data
+    yield trailer_frame(trailer)
+
+class ResponseWriter:
+    """线程安全地向stdout写入响应行"""
+
+    def __init__(self, ensure_ascii: bool = True):
+        self.ensure_ascii = ensure_ascii
+        self._lock = threading.Lock()
+
+    def write(self, response: Dict[str, Any]):
+        line = json.dumps(response, ensure_ascii=self.ensure_ascii) + "\n"
+        with self._lock:
+            sys.stdout.write(line)
+            # 常驻模式下每个响应都必须立即刷新，否则客户端会一直等待
+            sys.stdout.flush()
+
+def serve_stdio(handler: Callable[[Dict[str, Any]], Dict[str, Any]], max_workers: int = DEFAULT_SERVER_THREADS, ensure_ascii: bool = True):
+    """读取stdin中的请求并在线程池中并发处理，响应完成即写出（可能乱序）；stdin关闭后等待在途请求完成再退出"""
+    writer = ResponseWriter(ensure_ascii)
+
+    def process(request: Dict[str, Any]):
+        try:
+            response = handler(request)
+            if inspect.isgenerator(response):
+                # 流式响应：逐帧写出，内存占用只与单帧大小相关
+                for frame in response:
+                    writer.write(attach_request_id(request, frame))
+                return
+        except Exception as e:
+            response = {"error": f"处理请求时出错: {str(e)}"}
+        writer.write(attach_request_id(request, response))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="mcp-request") as executor:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.strip())
+            except json.JSONDecodeError:
+                response = {"error": "无效的JSON请求"}
+                request_id = extract_request_id(line)
+                if request_id is not None:
+                    response["id"] = request_id
+                writer.write(response)
+                continue
+            executor.submit(process, request)
@@ -1,12 +1,29 @@
 import streamlit as st
 import pandas as pd
 import re
+import time
 from utils.mcp_client import MCPClient
 from utils.config_manager import ConfigManager
-from utils.llm_client import LLMClient
+from utils.llm_client import LLMClient, llm_usage_stats
 from utils.i18n import t
 from utils.test_question_helper import render_test_question_sidebar, get_test_question_input
 from utils.mcp_tool_handler import get_llm_tools, handle_tool_calls
+from utils.result_frame import result_to_dataframe
+from utils.schema_prompt import build_schema_messages, load_schema_block, format_schema_outline
+from utils.plan_sql import generate_plan_sql, step_requirements_text
+from utils.plan_checkpoint import PlanCheckpointStore, plan_key, step_keys, reusable_checkpoints
+from utils.analysis_primitives import run_primitive, compute_inputs, describe_primitives, COMPUTE_STEP_TYPE
+from utils.data_profiler import profile_result_data, DEFAULT_PROFILE_TOKEN_BUDGET
+from utils.intent_classifier import classify_intent, classify_execute_intent, confidence_threshold
+from utils.intent_sql import (
+    build_intent_messages, parse_intent_response, build_combined_messages, parse_combined_response,
+    effective_intent_mode, start_speculative_sql, finish_speculative_sql, speculation_stats
+)
+from utils.plan_scheduler import (
+    PlanScheduler, DeferredUI, step_order, step_id_of, DEFAULT_MAX_PARALLEL_STEPS,
+    STATUS_RUNNING, STATUS_SUCCESS, STATUS_SKIPPED
+)
+from utils.sql_cache import lookup_cached_sql, store_cached_sql, invalidate_cached_sql, get_sql_cache
 
 def clean_sql_response(sql_text):
     """清理LLM响应中的SQL，去掉多余的解释内容"""
@@ -50,6 +67,16 @@ def clean_sql_response(sql_text):
         
     return cleaned_sql
 
+def display_dataframe(container, df):
+    """优先按原始列类型显示；混合类型的列导致无法渲染时退回到全部转为字符串。返回实际显示的DataFrame"""
+    try:
+        container.dataframe(df)
+        return df
+    except Exception:
+        df_display = df.astype(str)
+        container.dataframe(df_display)
+        return df_display
+
 def execute_analysis_plan_steps(analysis_plan, original_question, database_type, config_manager, llm_client, mcp_client, db_config, check_dangerous_sql):
     """
     按步骤执行分析计划
@@ -87,107 +114,129 @@ def execute_analysis_plan_steps(analysis_plan, original_question, database_type,
     steps = plan_content.get('steps', [])
     st.info(f"📋 执行计划概览: 共{len(steps)}个步骤")
     
-    # 存储每个步骤的结果
-    step_results = {}
     execution_log = []
     
-    # 按step_id排序执行
-    sorted_steps = sorted(steps, key=lambda x: x.get('step_id', 0))
-    
+    # 按串行顺序（step_id）预先为每个步骤创建显示区域，执行时就地更新状态
+    sorted_steps = step_order(steps)
+    panels = {}
     for i, step in enumerate(sorted_steps):
-        step_id = step.get('step_id', i+1)
+        step_id = step_id_of(step, i)
+        with st.expander(f"步骤 {step_id}: {step.get('description', '未知步骤')}", expanded=True):
+            st.write(f"**步骤类型**: {step.get('step_type', 'unknown')}")
+            status_placeholder = st.empty()
+            status_placeholder.info("⏳ 等待依赖步骤完成")
+            panels[step_id] = (step, status_placeholder, st.container())
+    
+    # 检查点：此前执行成功且定义及上游均未变化的步骤直接复用结果
+    checkpoint_store = PlanCheckpointStore(plan_key(original_question, database_type, db_config))
+    checkpoint_keys = step_keys(sorted_steps)
+    checkpoints = reusable_checkpoints(sorted_steps, checkpoint_keys, checkpoint_store)
+    if checkpoints:
+        st.caption(f"♻️ 复用检查点结果: 步骤{list(checkpoints)}")
+    step_keys_by_obj = {id(step): checkpoint_keys[step_id_of(step, i)] for i, step in enumerate(sorted_steps)}
+    checkpoints_by_obj = {id(step): checkpoints.get(step_id_of(step, i)) for i, step in enumerate(sorted_steps)}
+    
+    # 一次LLM请求为需要执行的sql_query步骤生成SQL；结果按步骤定义缓存在计划上，未变化的步骤不再生成
+    plan_sql_cache = analysis_plan.setdefault('generated_sql', {})
+    schema_info, table_descriptions = get_saved_schema(config_manager, database_type)
+    with st.spinner("批量生成SQL查询..."):
+        plan_sql = generate_plan_sql(
+            [(step_id_of(step, i), step) for i, step in enumerate(sorted_steps) if step_id_of(step, i) not in checkpoints],
+            schema_info, table_descriptions, database_type, llm_client, plan_sql_cache
+        )
+    if plan_sql["reused"]:
+        st.caption(f"♻️ 复用已生成的SQL: {plan_sql['reused']}个步骤，新生成: {plan_sql['generated']}个步骤")
+    step_sql = {id(step): plan_sql["sql"].get(step_id_of(step, i)) for i, step in enumerate(sorted_steps)}
+    
+    # 工作线程中的显示调用先记录，步骤完成后在对应区域回放
+    recorders = {}
+    
+    def run_step(step, upstream_results):
         step_type = step.get('step_type', 'unknown')
+        ui = DeferredUI()
+        recorders[id(step)] = ui
+        checkpoint = checkpoints_by_obj.get(id(step))
+        if checkpoint is not None:
+            ui.caption("♻️ 步骤定义及上游未变化，复用上次执行的结果")
+            if checkpoint.get('sql'):
+                ui.code(checkpoint['sql'], language='sql')
+            return checkpoint
+        if step_type == 'sql_query':
+            result = execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_client, db_config, check_dangerous_sql, ui=ui, sql=step_sql.get(id(step)))
+        elif step_type == 'external_data':
+            result = execute_external_data_step(step, mcp_client, ui=ui)
+        elif step_type == COMPUTE_STEP_TYPE:
+            result = execute_compute_step(step, upstream_results, ui=ui)
+        elif step_type == 'llm_analysis':
+            result = execute_llm_analysis_step(step, upstream_results, llm_client, original_question, ui=ui)
+        else:
+            return {'status': 'error', 'message': f'不支持的步骤类型: {step_type}'}
+        checkpoint_store.save(step_keys_by_obj[id(step)], result)
+        return result
+    
+    def on_status(step_id, status, detail):
+        step, status_placeholder, body = panels[step_id]
         description = step.get('description', '未知步骤')
-        dependencies = step.get('dependencies', [])
-        
-        # 检查依赖关系
-        if dependencies:
-            missing_deps = [dep for dep in dependencies if dep not in step_results]
-            if missing_deps:
-                error_msg = f"步骤{step_id}依赖的步骤{missing_deps}尚未完成，跳过执行"
-                st.warning(error_msg)
-                execution_log.append(f"⚠️ {error_msg}")
-                continue
+        if status == STATUS_RUNNING:
+            status_placeholder.info("🔄 执行中...")
+            return
+        if status == STATUS_SKIPPED:
+            status_placeholder.warning(f"⚠️ {detail}")
+            execution_log.append(f"⚠️ {detail}")
+            return
         
-        # 显示当前步骤
-        with st.expander(f"🔄 执行步骤 {step_id}: {description}", expanded=True):
-            st.write(f"**步骤类型**: {step_type}")
-            
-            try:
-                if step_type == 'sql_query':
-                    result = execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_client, db_config, check_dangerous_sql)
-                elif step_type == 'external_data':
-                    result = execute_external_data_step(step, mcp_client)
-                elif step_type == 'llm_analysis':
-                    result = execute_llm_analysis_step(step, step_results, llm_client, original_question)
-                else:
-                    result = {'status': 'error', 'message': f'不支持的步骤类型: {step_type}'}
+        result = detail
+        with body:
+            if id(step) in recorders:
+                recorders[id(step)].replay(st)
+            if status == STATUS_SUCCESS:
+                status_placeholder.success(f"✅ 步骤{step_id}执行成功")
+                execution_log.append(f"✅ 步骤{step_id}: {description} - 执行成功")
                 
-                # 存储结果
-                step_results[step_id] = result
+                # 显示具体结果
+                if 'data' in result and result['data'] is not None:
+                    if isinstance(result['data'], pd.DataFrame):
+                        st.dataframe(result['data'])
+                    else:
+                        st.write("**结果数据**:", result['data'])
                 
-                # 显示执行结果
-                if result.get('status') == 'success':
-                    st.success(f"✅ 步骤{step_id}执行成功")
-                    execution_log.append(f"✅ 步骤{step_id}: {description} - 执行成功")
-                    
-                    # 显示具体结果
-                    if 'data' in result and result['data'] is not None:
-                        if isinstance(result['data'], pd.DataFrame):
-                            st.dataframe(result['data'])
-                        else:
-                            st.write("**结果数据**:", result['data'])
-                    
-                    if 'message' in result:
-                        st.write("**执行详情**:", result['message'])
-                        
-                else:
-                    st.error(f"❌ 步骤{step_id}执行失败: {result.get('message', '未知错误')}")
-                    execution_log.append(f"❌ 步骤{step_id}: {description} - 执行失败: {result.get('message')}")
-                    
-            except Exception as e:
-                error_msg = f"步骤{step_id}执行异常: {str(e)}"
-                st.error(error_msg)
-                execution_log.append(f"💥 {error_msg}")
-                step_results[step_id] = {'status': 'error', 'message': str(e)}
+                if 'message' in result:
+                    st.write("**执行详情**:", result['message'])
+            else:
+                status_placeholder.error(f"❌ 步骤{step_id}执行失败: {result.get('message', '未知错误')}")
+                execution_log.append(f"❌ 步骤{step_id}: {description} - 执行失败: {result.get('message')}")
+    
+    # 依赖已满足的步骤并行执行，失败的步骤使依赖它的步骤被跳过；结果按串行顺序返回
+    step_results = PlanScheduler(sorted_steps, run_step, DEFAULT_MAX_PARALLEL_STEPS, on_status).run()
     
     # 生成最终分析报告
     generate_final_analysis_report(plan_content, step_results, execution_log, original_question)
     
-    # 清除分析计划状态
-    st.session_state.analysis_plan = None
-    st.session_state.analysis_question = None
+    # 全部步骤成功后清除分析计划状态；否则保留计划，再次执行时已完成的步骤从检查点复用
+    if len(step_results) == len(sorted_steps) and all(result.get('status') == 'success' for result in step_results.values()):
+        st.session_state.analysis_plan = None
+        st.session_state.analysis_question = None
+    else:
+        st.info("部分步骤未成功完成，分析计划已保留。再次发送执行指令将复用已完成步骤的结果，只重新计算失败及受其影响的步骤；也可以补充说明修改计划。")
     
     # 添加执行日志到消息历史
     log_summary = "\n".join(execution_log)
     final_message = f"[分析执行完成] {original_question}\n\n执行日志:\n{log_summary}"
     st.session_state.messages.append({"role": "assistant", "content": final_message})
 
-def execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_client, db_config, check_dangerous_sql):
-    """执行SQL查询步骤"""
-    query_requirements = step.get('query_requirements', {})
-    
-    # 根据查询需求构建prompt
-    sql_prompt = f"""根据以下查询需求生成SQL语句：
-
-表: {', '.join(query_requirements.get('tables', []))}
-时间范围: {query_requirements.get('time_range', '不限')}
-筛选条件: {', '.join(query_requirements.get('filters', []))}
-需要的指标: {', '.join(query_requirements.get('metrics', []))}
-分组维度: {', '.join(query_requirements.get('grouping', []))}
-
-请只返回可执行的SQL语句，不要包含任何解释说明。"""
-    
+def execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_client, db_config, check_dangerous_sql, ui=st, sql=None):
+    """执行SQL查询步骤；ui为显示目标（并行执行时为DeferredUI）；sql为批量生成的SQL，为空时单独生成"""
     try:
-        # 生成SQL
-        with st.spinner("生成SQL查询..."):
-            sql = llm_client.generate_sql(sql_prompt)
-            sql = clean_sql_response(sql) if sql else None
+        if not sql:
+            # 批量生成未覆盖该步骤时，根据查询需求单独生成（提示中包含与需求相关的schema）
+            schema_info, table_descriptions = get_saved_schema(config_manager, database_type)
+            with ui.spinner("生成SQL查询..."):
+                sql, _ = generate_sql_from_schema(step_requirements_text(step), schema_info, table_descriptions, llm_client)
         
         if not sql:
             return {'status': 'error', 'message': '无法生成SQL查询'}
         
-        st.code(sql, language='sql')
+        ui.code(sql, language='sql')
         
         # 检测危险SQL操作
         if check_dangerous_sql:
@@ -196,27 +245,26 @@ def execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_
                 return {'status': 'error', 'message': f'检测到危险操作: {dangerous_keyword}'}
         
         # 执行查询
-        with st.spinner("执行SQL查询..."):
+        with ui.spinner("执行SQL查询..."):
             query_result = mcp_client.call_mcp_server_with_config(
                 database_type,
                 "execute_query", 
                 db_config,
-                {"sql": sql, "database": db_config.get("database")}
+                {"sql": sql, "database": db_config.get("database"), "priority": "analysis", "result_format": "columnar"}
             )
         
         if "error" in query_result:
             return {'status': 'error', 'message': f'查询失败: {query_result["error"]}'}
         
         if "result" in query_result and "data" in query_result["result"]:
-            columns = query_result["result"]["data"].get("columns", [])
-            rows = query_result["result"]["data"].get("rows", [])
+            # 分析步骤按列接收结果并保留列类型，便于后续计算
+            df = result_to_dataframe(query_result["result"]["data"])
             
-            if rows:
-                df = pd.DataFrame(rows, columns=columns)
+            if not df.empty:
                 return {
                     'status': 'success',
                     'data': df,
-                    'message': f'查询成功，获得{len(rows)}行数据',
+                    'message': f'查询成功，获得{len(df)}行数据',
                     'sql': sql
                 }
             else:
@@ -232,7 +280,7 @@ def execute_sql_query_step(step, database_type, config_manager, llm_client, mcp_
     except Exception as e:
         return {'status': 'error', 'message': f'SQL执行异常: {str(e)}'}
 
-def execute_external_data_step(step, mcp_client):
+def execute_external_data_step(step, mcp_client, ui=st):
     """执行外部数据获取步骤"""
     data_requirements = step.get('data_requirements', {})
     
@@ -249,8 +297,8 @@ def execute_external_data_step(step, mcp_client):
         search_query += f" {geographic_scope}"
     
     try:
-        with st.spinner(f"获取外部数据: {search_query}..."):
-            st.write(f"🔍 搜索关键词: {search_query}")
+        with ui.spinner(f"获取外部数据: {search_query}..."):
+            ui.write(f"🔍 搜索关键词: {search_query}")
             
             # 模拟外部数据获取（实际项目中可以集成真实的数据源）
             # 由于playwright需要异步环境且较复杂，这里先使用模拟数据
@@ -318,7 +366,37 @@ def execute_external_data_step(step, mcp_client):
     except Exception as e:
         return {'status': 'error', 'message': f'外部数据获取异常: {str(e)}'}
 
-def execute_llm_analysis_step(step, step_results, llm_client, original_question):
+def execute_compute_step(step, step_results, ui=st):
+    """执行本地计算步骤：对前序步骤的DataFrame调用统计分析原语，不调用LLM"""
+    compute_requirements = step.get('compute_requirements', {})
+    operation = compute_requirements.get('operation', '')
+    
+    # 输入为compute_requirements中指定的步骤，多个输入按行合并
+    frames = []
+    for input_step in compute_inputs(step):
+        result = step_results.get(input_step)
+        if result is None:
+            # 计划中的步骤编号可能是字符串
+            result = next((value for key, value in step_results.items() if str(key) == str(input_step)), None)
+        if result and isinstance(result.get('data'), pd.DataFrame):
+            frames.append(result['data'])
+    if not frames:
+        return {'status': 'error', 'message': f'计算步骤缺少输入数据（输入步骤: {compute_inputs(step)}）'}
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    
+    started = time.time()
+    computed = run_primitive(operation, df, compute_requirements.get('params', {}))
+    if "error" in computed:
+        return {'status': 'error', 'message': computed['error']}
+    ui.caption(f"⚡ 本地计算 {operation} 完成，耗时 {(time.time() - started) * 1000:.0f} 毫秒")
+    return {
+        'status': 'success',
+        'data': computed['data'],
+        'message': computed['summary'],
+        'compute_operation': operation
+    }
+
+def execute_llm_analysis_step(step, step_results, llm_client, original_question, ui=st):
     """执行LLM分析步骤"""
     analysis_requirements = step.get('analysis_requirements', {})
     
@@ -337,6 +415,9 @@ def execute_llm_analysis_step(step, step_results, llm_client, original_question)
                 collected_data[f"步骤{step_id}"] = result
                 break
     
+    # 每个步骤的数据概要都限制在token预算内，提示长度不随数据量增长
+    token_budget = llm_client.config.get("analysis", {}).get("profile_token_budget", DEFAULT_PROFILE_TOKEN_BUDGET)
+    
     try:
         # 构建分析prompt
         analysis_prompt = f"""请对以下数据进行{method}分析，回答原始问题：{original_question}
@@ -351,14 +432,12 @@ def execute_llm_analysis_step(step, step_results, llm_client, original_question)
         for data_source, result in collected_data.items():
             analysis_prompt += f"\n{data_source}数据:\n"
             if result.get('status') == 'success':
-                if isinstance(result.get('data'), pd.DataFrame):
-                    # DataFrame转换为文本描述
-                    df = result['data']
-                    analysis_prompt += f"数据概况: {len(df)}行 x {len(df.columns)}列\n"
-                    analysis_prompt += f"列名: {', '.join(df.columns)}\n"
-                    analysis_prompt += f"数据样例:\n{df.head(3).to_string()}\n"
-                elif result.get('data'):
-                    analysis_prompt += f"数据内容: {str(result['data'])[:500]}...\n"
+                if result.get('compute_operation'):
+                    # 本地计算结果已是汇总数据，先给出结论
+                    analysis_prompt += f"计算结论({result['compute_operation']}): {result.get('message', '')}\n"
+                if isinstance(result.get('data'), pd.DataFrame) or result.get('data'):
+                    # 逐列统计、分组汇总和时间序列概要（数据较小时为完整数据）
+                    analysis_prompt += f"{profile_result_data(result['data'], token_budget)}\n"
                 else:
                     analysis_prompt += "数据为空\n"
             else:
@@ -374,7 +453,7 @@ def execute_llm_analysis_step(step, step_results, llm_client, original_question)
 
 请确保分析结果具体、准确、有价值。"""
         
-        with st.spinner("进行AI数据分析..."):
+        with ui.spinner("进行AI数据分析..."):
             analysis_result = llm_client.generate_sql(analysis_prompt)
         
         if analysis_result:
@@ -497,6 +576,27 @@ with st.sidebar:
     st.subheader(t('security_settings'))
     check_dangerous_sql = st.checkbox(t('avoid_dangerous_code'), value=True)
     
+    # 推测生成SQL的效果统计（进程级）
+    if effective_intent_mode(llm_config) == "speculative":
+        stats = speculation_stats()
+        if stats["started"]:
+            wasted = stats["wasted_prompt_tokens"] + stats["wasted_output_tokens"]
+            st.caption(f"🔮 推测生成SQL: 采用{stats['used']}次，取消{stats['cancelled']}次，丢弃{stats['discarded']}次，"
+                       f"浪费{wasted:,} tokens（输入{stats['wasted_prompt_tokens']:,}，输出{stats['wasted_output_tokens']:,}"
+                       f"{'，部分为估算' if stats['estimated'] else ''}），节省约{stats['saved_seconds']:.1f}秒")
+    
+    # LLM输入token中命中提示缓存的比例（进程级，来自API响应的usage）
+    usage = llm_usage_stats()
+    if usage["prompt_tokens"]:
+        st.caption(f"🧊 提示缓存: {usage['requests']}次请求，输入{usage['prompt_tokens']:,} tokens，"
+                   f"命中缓存{usage['cached_tokens']:,} tokens（{usage['cached_tokens'] / usage['prompt_tokens'] * 100:.0f}%）")
+    
+    # 问题 -> SQL语义缓存的命中情况（进程级）
+    sql_cache = get_sql_cache(llm_config)
+    if sql_cache and (sql_cache.stats["exact_hits"] or sql_cache.stats["similar_hits"]):
+        st.caption(f"💾 SQL语义缓存: 精确命中{sql_cache.stats['exact_hits']}次，近似命中{sql_cache.stats['similar_hits']}次，"
+                   f"未命中{sql_cache.stats['misses']}次，失效{sql_cache.stats['invalidated']}次")
+    
     # 初始化LLM客户端
     llm_client = LLMClient(llm_config)
 
@@ -512,128 +612,74 @@ for message in st.session_state.messages:
                 # 确保数据类型兼容性
                 df = message["data"]
                 if isinstance(df, pd.DataFrame):
-                    # 转换所有列为字符串以避免类型冲突
-                    df_display = df.astype(str)
-                    st.dataframe(df_display)
+                    display_dataframe(st, df)
                 else:
                     st.dataframe(df)
             except Exception as e:
                 st.error(f"数据显示错误: {str(e)}")
                 st.write(message["data"])
 
-# 获取保存的表结构信息
+# 获取保存的表结构信息（预先渲染并缓存，schema_config.json修改后自动重新加载）
 def get_saved_schema(config_manager, database_type):
-    schema_config = config_manager.load_schema_config().get(database_type, {})
-    return schema_config.get("tables", {}), schema_config.get("descriptions", {})
-
-# 构建包含schema的prompt
-def build_schema_prompt(question, schema_info, table_descriptions):
-    prompt = f"""### 数据库查询
-
-用户问题: {question}
+    schema_block = load_schema_block(config_manager, database_type)
+    return schema_block.tables, schema_block.descriptions
 
-### 数据库Schema:
-"""
-    
-    for table, table_info in schema_info.items():
-        table_desc = table_descriptions.get(table, "")
-        prompt += f"\n\n表: {table}"
-        if table_desc:
-            prompt += f" - {table_desc}"
-        prompt += "\n"
-        
-        # 处理不同的schema格式
-        columns = None
-        if isinstance(table_info, dict):
-            columns = table_info.get("columns", [])
-        elif isinstance(table_info, list):
-            columns = table_info
-            
-        if columns:
-            prompt += "| 列名 | 类型 | 描述 |\n"
-            prompt += "| --- | --- | --- |\n"
-            for col in columns:
-                if isinstance(col, dict):
-                    name = col.get("name", "")
-                    col_type = col.get("type", "")
-                    comment = col.get("comment", "")
-                    prompt += f"| {name} | {col_type} | {comment} |\n"
-                else:
-                    # 如果col不是字典，直接添加
-                    prompt += f"| {col} | - | - |\n"
-        else:
-            prompt += "表结构信息未配置\n"
-    
-    prompt += "\n\n请根据用户问题和数据库schema生成SQL查询。\n\n重要要求：\n- 只返回可执行的SQL语句\n- 不要包含任何解释说明\n- 不要添加注释或描述\n- 直接返回SQL代码"
-    
-    return prompt
-
-# 使用LLM进行意图识别
+# 使用LLM进行意图识别（本地分类器置信度不足时）
 def identify_intent_with_llm(question, llm_client):
-    intent_prompt = f"""请分析以下用户问题的意图，只返回下列之一：
-- query: 数据查询和基础分析，可通过SQL查询直接获得结果
-- analysis: 深度分析，需要多步骤思考、原因分析或业务洞察
-- reject: 涉及数据库增删改操作
-
-分类标准：
-- query: 数据检索、排序、统计计算、趋势展示、对比查询等，重点是获取和展示数据
-- analysis: 原因分析、深度洞察、复杂推理、需要业务建议等，重点是解释和分析
-- reject: INSERT/UPDATE/DELETE/DROP/CREATE/ALTER等修改操作
-
-参考示例：
-
-Query类型（数据查询和基础分析）：
-- "哪些产品是畅销品？" → query
-- "显示所有用户信息" → query  
-- "查询产品销量排名前10名" → query
-- "列出2024年的所有订单" → query
-- "按销售额对产品进行排序" → query
-- "分析销售趋势" → query
-- "过去6个月销售趋势如何？" → query
-- "分析产品销售的季节性趋势" → query
-- "对比不同地区的销售表现" → query
-- "比较2023年和2024年的销售数据" → query
-- "统计月度增长率" → query
-- "哪个季节销售最好？" → query
-- "销量前10的产品" → query
-- "计算各产品的投资回报率" → query
-
-Analysis类型（深度分析和洞察）：
-- "为什么Q4销售下滑？" → analysis
-- "客户流失的主要原因是什么？" → analysis
-- "分析库存积压的根本原因" → analysis
-- "深入分析用户行为变化趋势" → analysis
-- "深度对比分析各产品线的盈利能力" → analysis
-- "计算客户生命周期价值" → analysis
-- "表现最差的销售员及改进建议" → analysis
-- "哪些产品畅销？分析其成功因素" → analysis
-- "统计销售数据并给出优化建议" → analysis
-- "对比各地区销售，找出差异原因" → analysis
-
-Reject类型（危险操作）：
-- "删除所有用户数据" → reject
-- "更新产品价格" → reject
-- "插入新的订单记录" → reject
-
-用户问题: {question}
-
-意图:"""
+    # 本地分类器置信度足够时直接返回，省去一次LLM往返
+    intent, confidence = classify_intent(question)
+    if confidence >= confidence_threshold(llm_client.config):
+        return intent
     
     try:
-        response = llm_client.generate_sql(intent_prompt)
+        system_prompt, intent_prompt = build_intent_messages(question)
+        response = llm_client.generate_sql(intent_prompt, system_prompt=system_prompt)
         if response:
-            response_lower = response.lower().strip()
-            if "reject" in response_lower:
-                return "reject"
-            elif "analysis" in response_lower:
-                return "analysis"
-            else:
-                return "query"
+            return parse_intent_response(response)
     except:
         pass
     
     return "query"  # 默认返回查询
 
+# 查找语义缓存中当前数据库上相同或相近问题的SQL；本地分类器确信不是查询意图时不使用缓存
+def lookup_question_cache(question, database_type, db_config, schema_info, table_descriptions, llm_client):
+    intent, confidence = classify_intent(question)
+    if intent != "query" and confidence >= confidence_threshold(llm_client.config):
+        return None
+    return lookup_cached_sql(question, database_type, db_config, schema_info, table_descriptions, llm_client.config)
+
+# 识别意图，合并或推测模式下同时生成SQL：返回 (意图, SQL, 提示)，未同时生成SQL时后两项为None
+def identify_intent_and_sql(question, schema_info, table_descriptions, llm_client):
+    intent, confidence = classify_intent(question)
+    if confidence >= confidence_threshold(llm_client.config):
+        return intent, None, None
+    
+    mode = effective_intent_mode(llm_client.config)
+    if mode == "combined":
+        system_prompt, question_prompt = build_combined_messages(question, schema_info, table_descriptions, llm_client.config)
+        combined_prompt = f"{system_prompt}\n\n{question_prompt}"
+        try:
+            combined = parse_combined_response(llm_client.generate_sql(question_prompt, system_prompt=system_prompt))
+        except Exception as e:
+            print(f"意图与SQL合并生成失败: {str(e)}")
+            combined = None
+        if combined:
+            sql = clean_sql_response(combined["sql"]) if combined["sql"] else None
+            return combined["intent"], sql, combined_prompt
+    elif mode == "speculative":
+        # 意图识别的同时推测生成SQL，意图不是query时取消或丢弃
+        speculation = start_speculative_sql(
+            lambda: generate_sql_from_schema(question, schema_info, table_descriptions, llm_client), llm_client
+        )
+        started = time.perf_counter()
+        intent = identify_intent_with_llm(question, llm_client)
+        speculative = finish_speculative_sql(speculation, intent, time.perf_counter() - started)
+        if speculative:
+            return intent, speculative[0], speculative[1]
+        return intent, None, None
+    
+    return identify_intent_with_llm(question, llm_client), None, None
+
 # 生成分析思路
 # 格式化JSON计划的显示内容 - 专为Streamlit优化
 def format_json_plan_streamlit(plan_content):
@@ -685,6 +731,7 @@ def format_json_plan_markdown(plan_content):
             type_info = {
                 'sql_query': {'emoji': '🗄️', 'label': '数据查询'},
                 'external_data': {'emoji': '🌐', 'label': '外部数据'},
+                'compute': {'emoji': '🧮', 'label': '本地计算'},
                 'llm_analysis': {'emoji': '🧠', 'label': '数据分析'}
             }
             
@@ -726,6 +773,17 @@ def format_json_plan_markdown(plan_content):
                 if 'format_preference' in req:
                     display_lines.append(f"- 📋 **格式要求**: {req['format_preference']}")
                     
+            elif step_type == 'compute' and 'compute_requirements' in step:
+                req = step['compute_requirements']
+                display_lines.append("**计算需求**:")
+                if 'operation' in req:
+                    display_lines.append(f"- 🧮 **计算操作**: `{req['operation']}`")
+                if 'input_step' in req:
+                    display_lines.append(f"- 📥 **输入步骤**: {req['input_step']}")
+                if req.get('params'):
+                    params_display = ', '.join(f"{name}={value}" for name, value in req['params'].items())
+                    display_lines.append(f"- ⚙️ **参数**: {params_display}")
+                    
             elif step_type == 'llm_analysis' and 'analysis_requirements' in step:
                 req = step['analysis_requirements']
                 display_lines.append("**分析需求**:")
@@ -775,7 +833,7 @@ def format_json_plan_display(plan_content):
     return format_json_plan_markdown(plan_content)
 
 def generate_analysis_plan(question, schema_info, table_descriptions, llm_client):
-    plan_prompt = f"""请将以下复杂分析问题拆分为逻辑清晰的分析步骤，并以JSON格式输出。每个步骤应该描述需要完成的任务，而不需要提供具体的实现细节。步骤类型包括：
+    plan_prompt = """请将以下复杂分析问题拆分为逻辑清晰的分析步骤，并以JSON格式输出。每个步骤应该描述需要完成的任务，而不需要提供具体的实现细节。步骤类型包括：
 
 1. **数据查询步骤** (sql_query)
    - 描述需要从数据库获取什么数据
@@ -787,40 +845,23 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
    - 明确数据获取目标和预期内容
    - 不需要提供具体URL或技术细节，执行时会确定具体方案
 
-3. **数据分析步骤** (llm_analysis)
-   - 基于前面步骤获取的数据进行逻辑推理和分析
+3. **本地计算步骤** (compute)
+   - 对前面某个数据查询步骤的结果做机械的统计计算，在本地执行，不需要AI
+   - 增长率、同比/环比、贡献度、趋势、季节性、异常值等计算都应使用该类型，而不是交给数据分析步骤
+   - 可用的计算操作(operation)：
+""" + describe_primitives() + """
+   - 列名参数填写对应的指标或维度名称即可，执行时会自动匹配结果列
+
+4. **数据分析步骤** (llm_analysis)
+   - 基于前面步骤获取的数据和计算结果进行逻辑推理和分析
+   - 只负责原因解释、业务洞察和结论总结，数值计算放在本地计算步骤中
    - 明确分析方法、关注重点和输出要求
    - 定义如何整合多源数据得出结论
 
-用户问题: {question}
-
 可用数据库表结构:
 """
     
-    for table, table_info in schema_info.items():
-        table_desc = table_descriptions.get(table, "")
-        plan_prompt += f"\n表: {table}"
-        if table_desc:
-            plan_prompt += f" - {table_desc}"
-        plan_prompt += "\n"
-        
-        # 处理不同的schema格式
-        columns = None
-        if isinstance(table_info, dict):
-            columns = table_info.get("columns", [])
-        elif isinstance(table_info, list):
-            columns = table_info
-            
-        if columns:
-            for col in columns:
-                if isinstance(col, dict):
-                    name = col.get("name", "")
-                    col_type = col.get("type", "")
-                    comment = col.get("comment", "")
-                    plan_prompt += f"  - {name} ({col_type}): {comment}\n"
-                else:
-                    # 如果col不是字典，直接添加
-                    plan_prompt += f"  - {col}\n"
+    plan_prompt += format_schema_outline(schema_info, table_descriptions)
     
     plan_prompt += """
 
@@ -860,6 +901,18 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
     },
     {
       "step_id": 3,
+      "step_type": "compute",
+      "description": "需要在本地完成的统计计算描述",
+      "compute_requirements": {
+        "operation": "计算操作名称 (mom/yoy/top_n_contribution等)",
+        "input_step": 1,
+        "params": {"value_column": "指标名称", "date_column": "日期维度名称"}
+      },
+      "target_data": "预期的计算结果",
+      "dependencies": [1]
+    },
+    {
+      "step_id": 4,
       "step_type": "llm_analysis",
       "description": "分析任务描述",
       "analysis_requirements": {
@@ -870,7 +923,7 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
         "insights_target": ["期望发现的洞察类型"]
       },
       "output_format": "分析结果的输出格式",
-      "dependencies": [1, 2]
+      "dependencies": [1, 2, 3]
     }
   ],
   "expected_output": "最终分析报告的结构和内容要求"
@@ -941,17 +994,29 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
     },
     {
       "step_id": 5,
+      "step_type": "compute",
+      "description": "计算整体市场销售额的月度环比，作为雨衣销量变化的对比基准",
+      "compute_requirements": {
+        "operation": "mom",
+        "input_step": 4,
+        "params": {"value_column": "总销售额", "date_column": "月份"}
+      },
+      "target_data": "整体市场4月到5月的销售额环比",
+      "dependencies": [4]
+    },
+    {
+      "step_id": 6,
       "step_type": "llm_analysis",
       "description": "综合分析雨衣销量月度差异的根本原因",
       "analysis_requirements": {
         "method": "多因素关联分析和因果推理",
-        "input_data": ["4月雨衣销量", "5月雨衣销量", "天气数据", "市场基准"],
+        "input_data": ["4月雨衣销量", "5月雨衣销量", "天气数据", "市场基准", "市场环比"],
         "focus_areas": ["天气因素影响", "季节性消费规律", "产品策略效果", "市场竞争态势"],
         "comparison_basis": "同期整体市场表现和历史趋势",
         "insights_target": ["主要驱动因素", "改进机会", "预测指标"]
       },
       "output_format": "包含原因分析、数据证据、业务建议的结构化报告",
-      "dependencies": [1, 2, 3, 4]
+      "dependencies": [1, 2, 3, 4, 5]
     }
   ],
   "expected_output": "包含销量差异的量化分析、主要影响因素识别、天气关联性分析、以及针对性的业务优化建议"
@@ -970,8 +1035,8 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
 }"""
     
     try:
-        # 发送请求给LLM
-        response = llm_client.generate_sql(plan_prompt)
+        # 发送请求给LLM：说明、schema和示例作为稳定前缀，用户问题放在最后
+        response = llm_client.generate_sql(f"用户问题: {question}", system_prompt=plan_prompt)
         
         # 尝试解析JSON格式的回复
         try:
@@ -1035,6 +1100,10 @@ def generate_analysis_plan(question, schema_info, table_descriptions, llm_client
 
 # 使用LLM检测是否为执行意图
 def is_execute_intent_with_llm(question, llm_client):
+    intent, confidence = classify_execute_intent(question)
+    if confidence >= confidence_threshold(llm_client.config):
+        return intent == "execute"
+    
     execute_prompt = f"""请分析以下用户输入是否表示要执行当前的分析计划：
 
 用户输入: {question}
@@ -1067,6 +1136,42 @@ def check_dangerous_sql_operations(sql):
             return True, keyword
     return False, None
 
+# 流式执行查询
+def stream_query_result(mcp_client, database_type, db_config, sql, placeholder, refresh_interval=0.3):
+    """流式执行查询，行数据到达后即在placeholder中渲染；返回与execute_query相同结构的结果"""
+    columns, column_types, rows, result = [], None, [], None
+    last_render = 0.0
+    for frame in mcp_client.stream_mcp_server_with_config(
+        database_type,
+        "execute_query",
+        db_config,
+        {"sql": sql, "database": db_config.get("database"), "priority": "query"}
+    ):
+        if "error" in frame:
+            return {"error": frame["error"]}
+        kind = frame.get("stream")
+        if kind == "header":
+            columns = frame.get("columns", [])
+            column_types = frame.get("column_types")
+        elif kind == "rows":
+            rows.extend(frame.get("rows", []))
+            # 限制刷新频率，避免大量小块导致页面反复重绘
+            if time.time() - last_render >= refresh_interval:
+                placeholder.dataframe(pd.DataFrame(rows, columns=columns).astype(str))
+                last_render = time.time()
+        elif kind == "trailer":
+            result = frame.get("result", {})
+    
+    if result is None:
+        return {"error": "查询结果不完整"}
+    if "error" in result:
+        return {"error": result["error"]}
+    result = dict(result)
+    result["data"] = dict(result.get("data", {}), columns=columns, rows=rows)
+    if column_types is not None:
+        result["data"].setdefault("column_types", column_types)
+    return {"result": result}
+
 # SQL生成函数
 def generate_sql(question, database_type, config_manager, llm_client=None, use_llm=False):
     """使用LLM生成SQL查询"""
@@ -1076,16 +1181,24 @@ def generate_sql(question, database_type, config_manager, llm_client=None, use_l
     if not schema_info:
         return None, ""
     
-    # 构建包含schema的prompt
-    schema_prompt = build_schema_prompt(question, schema_info, table_descriptions)
+    # 只有启用LLM且有LLM客户端时才生成SQL
+    if use_llm and llm_client:
+        return generate_sql_from_schema(question, schema_info, table_descriptions, llm_client)
+    
+    return None, "\n\n".join(build_schema_messages(question, schema_info, table_descriptions, llm_client.config if llm_client else None))
+
+def generate_sql_from_schema(question, schema_info, table_descriptions, llm_client):
+    """根据已加载的schema调用LLM生成SQL，返回(SQL, 包含schema的prompt)；不涉及界面，可在后台线程中调用"""
+    # 构建包含schema的prompt：说明和schema作为稳定前缀，用户问题在后
+    system_prompt, question_prompt = build_schema_messages(question, schema_info, table_descriptions, llm_client.config if llm_client else None)
+    schema_prompt = f"{system_prompt}\n\n{question_prompt}"
     
     sql = None
     
-    # 只有启用LLM且有LLM客户端时才生成SQL
-    if use_llm and llm_client:
+    if llm_client:
         try:
             # 调用LLM API生成SQL
-            llm_response = llm_client.generate_sql(schema_prompt)
+            llm_response = llm_client.generate_sql(question_prompt, system_prompt=system_prompt)
             if llm_response:
                 # 从响应中提取SQL
                 sql_match = re.search(r'```sql\s*([\s\S]*?)\s*```', llm_response)
@@ -1109,9 +1222,6 @@ def generate_sql(question, database_type, config_manager, llm_client=None, use_l
     
     # 返回生成的SQL和包含schema的prompt
     return sql, schema_prompt
-    
-    # 返回生成的SQL和包含schema的prompt
-    return sql, schema_prompt
 
 # 检查是否有测试问题输入
 test_question = get_test_question_input()
@@ -1146,6 +1256,10 @@ if prompt:
                     st.markdown(response)
                     st.session_state.messages.append({"role": "assistant", "content": response})
                 else:
+                    # 合并模式下意图识别时一并生成的SQL；语义缓存命中的记录
+                    combined_sql, combined_prompt = None, None
+                    cached = None
+                    
                     # 检查是否在分析计划阶段
                     if st.session_state.analysis_plan:
                         # 在分析计划阶段，检测是否为执行意图
@@ -1154,9 +1268,15 @@ if prompt:
                         else:
                             intent = "analysis_modify"
                     else:
-                        # 正常意图识别
+                        # 相同或相近的问题曾成功查询过时直接使用缓存的SQL，不调用LLM
                         if use_llm and llm_client:
-                            intent = identify_intent_with_llm(prompt, llm_client)
+                            cached = lookup_question_cache(prompt, database_type, db_config, schema_info, table_descriptions, llm_client)
+                        
+                        # 正常意图识别
+                        if cached:
+                            intent = "query"
+                        elif use_llm and llm_client:
+                            intent, combined_sql, combined_prompt = identify_intent_and_sql(prompt, schema_info, table_descriptions, llm_client)
                         else:
                             intent = "query"
                     
@@ -1195,6 +1315,9 @@ if prompt:
                         if use_llm and llm_client:
                             # 更新分析计划
                             plan_result = generate_analysis_plan(f"{st.session_state.analysis_question}\n\n用户补充: {prompt}", schema_info, table_descriptions, llm_client)
+                            # 保留已生成的SQL，修改后未变化的步骤执行时直接复用
+                            if isinstance(plan_result, dict) and isinstance(st.session_state.analysis_plan, dict):
+                                plan_result['generated_sql'] = st.session_state.analysis_plan.get('generated_sql', {})
                             st.session_state.analysis_plan = plan_result
                             
                             # 根据返回格式处理显示
@@ -1297,8 +1420,13 @@ if prompt:
                             st.markdown(response)
                             st.session_state.messages.append({"role": "assistant", "content": response})
                     else:
-                        # 生成SQL查询
-                        sql, schema_prompt = generate_sql(prompt, database_type, config_manager, llm_client, use_llm)
+                        # 生成SQL查询（语义缓存命中或合并模式下已随意图识别一起生成时不再调用LLM）
+                        if cached:
+                            sql, schema_prompt = cached["sql"], f"SQL来自语义缓存，未调用LLM（匹配的问题: {cached['question']}）"
+                        elif combined_sql:
+                            sql, schema_prompt = combined_sql, combined_prompt
+                        else:
+                            sql, schema_prompt = generate_sql(prompt, database_type, config_manager, llm_client, use_llm)
                         
                         if sql:
                             # 检测危险SQL操作
@@ -1317,7 +1445,9 @@ if prompt:
                             response_parts.append(f"数据库: {database_type}")
                             
                             # 根据设置显示LLM信息
-                            if use_llm:
+                            if cached:
+                                response_parts.append(f"SQL来源: 语义缓存（相似度{cached['similarity'] * 100:.0f}%，匹配的问题: {cached['question']}）")
+                            elif use_llm:
                                 if provider == "openai":
                                     response_parts.append(f"LLM: OpenAI - {llm_config.get('openai', {}).get('model', 'gpt-4')}")
                                 elif provider == "azure_openai":
@@ -1345,33 +1475,40 @@ if prompt:
                                 with st.expander("📋 数据库Schema提示", expanded=False):
                                     st.markdown(f"```\n{schema_prompt}\n```")
                             
-                            # 执行查询
+                            # 执行查询（流式返回，先到的行先显示）
+                            result_placeholder = st.empty()
                             with st.spinner("执行查询中..."):
-                                query_result = mcp_client.call_mcp_server_with_config(
-                                    database_type,
-                                    "execute_query",
-                                    db_config,
-                                    {"sql": sql, "database": db_config.get("database")}
-                                )
+                                query_result = stream_query_result(mcp_client, database_type, db_config, sql, result_placeholder)
                                 
                                 if "error" in query_result:
                                     st.error(f"查询失败: {query_result['error']}")
                                     st.session_state.messages.append({"role": "assistant", "content": response + "\n\n查询失败: " + query_result['error']})
+                                    # 缓存的SQL已无法执行，删除该记录
+                                    if cached:
+                                        invalidate_cached_sql(cached["question"], database_type, db_config, llm_client.config)
                                 elif "result" in query_result and "data" in query_result["result"]:
+                                    if cached:
+                                        st.caption(f"💾 SQL来自语义缓存（相似度{cached['similarity'] * 100:.0f}%），未调用LLM")
+                                    elif use_llm and llm_client:
+                                        # 成功执行的SQL保存到语义缓存，记录引用表的定义指纹，表修改后自动失效
+                                        store_cached_sql(prompt, database_type, db_config, sql, schema_info, table_descriptions, llm_client.config)
                                     # 将查询结果转换为DataFrame
                                     columns = query_result["result"]["data"].get("columns", [])
                                     rows = query_result["result"]["data"].get("rows", [])
                                     
                                     if rows:
                                         try:
-                                            df = pd.DataFrame(rows, columns=columns)
-                                            # 转换所有列为字符串以避免类型冲突
-                                            df_display = df.astype(str)
-                                            st.dataframe(df_display)
+                                            # 按列类型转换（数值、日期、NULL保持原样，低基数字符串列转为category）
+                                            df = result_to_dataframe(query_result["result"]["data"])
+                                            display_dataframe(result_placeholder, df)
+                                            if query_result["result"]["data"].get("cache_hit"):
+                                                st.caption(f"⚡ 命中查询缓存（{query_result['result']['data'].get('age', 0)}秒前的结果）")
+                                            if query_result["result"]["data"].get("queue_wait_time"):
+                                                st.caption(f"⏳ 等待Athena并发名额 {query_result['result']['data']['queue_wait_time']:.1f}秒")
                                             st.session_state.messages.append({
                                                 "role": "assistant", 
                                                 "content": response,
-                                                "data": df_display
+                                                "data": df
                                             })
                                         except Exception as e:
                                             st.error(f"数据显示错误: {str(e)}")
@@ -204,6 +204,11 @@ with col2:
         if timeout_config:
             new_config["timeout"] = timeout_config
         
+        # 保留页面上未提供编辑的配置项（分析步骤的数据概要token预算、本地意图分类阈值、schema裁剪、SQL语义缓存等）
+        for key in ("analysis", "intent", "schema_index", "sql_cache"):
+            if llm_config.get(key):
+                new_config[key] = llm_config[key]
+        
         if provider == "openai":
             new_config["openai"] = {
                 "api_key": api_key,
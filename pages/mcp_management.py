@@ -1,7 +1,9 @@
 import streamlit as st
+import pandas as pd
 from utils.config_manager import ConfigManager
 from utils.i18n import t
 from utils.mcp_client import MCPClient
+from utils.mcp_worker_pool import get_all_pool_status
 
 st.set_page_config(page_title="MCP Management", page_icon="🔧")
 st.title(t('mcp_tool_management'))
@@ -148,4 +150,17 @@ else:
                     st.success(f"{name} {t('deleted')}")
                     st.rerun()
             
-            st.divider()
\ No newline at end of file
+            st.divider()
+
+# 常驻进程池状态
+st.subheader("常驻进程池")
+pool_status = get_all_pool_status()
+if not pool_status:
+    st.info("当前没有运行中的常驻进程，首次调用MCP服务器时会自动启动")
+else:
+    for server_name, status in pool_status.items():
+        stats = status.get("stats", {})
+        st.write(f"**{server_name}** - 空闲 {status['idle']} / 忙碌 {status['busy']} (上限 {status['size']}) | 在途请求 {status.get('in_flight', 0)}")
+        st.caption(f"请求数: {stats.get('requests', 0)} | 启动: {stats.get('spawned', 0)} | 回收: {stats.get('recycled', 0)} | 崩溃: {stats.get('crashed', 0)}")
+        if status.get("workers"):
+            st.dataframe(pd.DataFrame(status["workers"]), width='stretch')
@@ -82,6 +82,10 @@ with col1:
                         st.caption(f"注释: {table_info['comment']}")
                     if table_info.get('estimated_rows'):
                         st.caption(f"预估行数: {table_info['estimated_rows']:,}")
+                    if table_info.get('format'):
+                        st.caption(f"存储格式: {table_info['format']}")
+                    if table_info.get('partition_keys'):
+                        st.caption(f"分区键: {', '.join(table_info['partition_keys'])}")
         else:
             # 如果是字符串列表，直接使用
             selected_table = st.selectbox(t('select_table'), st.session_state.tables)
@@ -164,6 +168,8 @@ with col2:
                     else:  # athena
                         st.text(f"类型: {field.get('type', '')}")
                         st.text(f"注释: {field.get('comment', '')}")
+                        if field.get('partition_key'):
+                            st.text("分区键: 是")
                     
                     # 自定义描述
                     new_desc = st.text_input(
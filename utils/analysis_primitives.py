@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+本地统计分析原语
+增长率、同比/环比、Top N贡献度、趋势斜率、季节性和异常值检测等机械计算，
+在进程内对前序步骤的DataFrame做向量化计算（毫秒级），不需要把数据发送给LLM。
+分析计划中的compute步骤通过operation名称调用，列名允许模糊指定：
+计划生成时还不知道SQL结果的确切列名，找不到时按列类型自动选择。
+"""
+
+import inspect
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+COMPUTE_STEP_TYPE = "compute"
+
+# 结果较大时只保留前若干行，避免后续步骤和界面处理过多数据
+MAX_RESULT_ROWS = 1000
+
+_DATE_NAME_HINTS = ("date", "time", "day", "month", "year", "period", "日期", "时间", "月", "年", "周")
+
+def _is_numeric(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _is_datetime(series: pd.Series) -> bool:
+    return pd.api.types.is_datetime64_any_dtype(series)
+
+def _is_year(series: pd.Series) -> bool:
+    values = series.dropna()
+    return pd.api.types.is_integer_dtype(series) and not values.empty and values.between(1900, 2100).all()
+
+def _match_column(df: pd.DataFrame, name: Optional[str]) -> Optional[str]:
+    """按名称匹配列：完全一致、忽略大小写、互相包含"""
+    if not name:
+        return None
+    name = str(name).strip()
+    if name in df.columns:
+        return name
+    lowered = {str(column).lower(): column for column in df.columns}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    for column in df.columns:
+        if name.lower() in str(column).lower() or str(column).lower() in name.lower():
+            return column
+    return None
+
+def resolve_column(df: pd.DataFrame, name: Optional[str] = None, kind: str = "any",
+                   exclude: Tuple[str, ...] = ()) -> Optional[str]:
+    """解析列名；名称无法匹配时按类型选择：numeric为数值列，datetime为日期列，category为文本列"""
+    column = _match_column(df, name)
+    if column is not None:
+        return column
+    candidates = [column for column in df.columns if column not in exclude]
+    if kind == "numeric":
+        numeric = [column for column in candidates if _is_numeric(df[column]) and not _is_year(df[column])]
+        # 多个数值列时优先最后一列（查询结果中指标通常排在维度之后）
+        return numeric[-1] if numeric else None
+    if kind == "datetime":
+        for column in candidates:
+            if _is_datetime(df[column]):
+                return column
+        for column in candidates:
+            if any(hint in str(column).lower() for hint in _DATE_NAME_HINTS):
+                return column
+        return None
+    if kind == "category":
+        for column in candidates:
+            if not _is_numeric(df[column]) and not _is_datetime(df[column]):
+                return column
+        return None
+    return None
+
+def _require(df: pd.DataFrame, name: Optional[str], kind: str, label: str, exclude: Tuple[str, ...] = ()) -> str:
+    column = resolve_column(df, name, kind, exclude)
+    if column is None:
+        raise ValueError(f"找不到{label}列{f'（{name}）' if name else ''}，可用列: {list(df.columns)}")
+    return column
+
+def _as_datetime(series: pd.Series) -> pd.Series:
+    if _is_datetime(series):
+        return series
+    if _is_year(series):
+        return pd.to_datetime(series.astype("Int64").astype(str), format="%Y", errors="coerce")
+    return pd.to_datetime(series, errors="coerce")
+
+def _pct(value) -> str:
+    return "无" if value is None or pd.isna(value) else f"{value * 100:.1f}%"
+
+def growth_rate(df: pd.DataFrame, value_column: str = None, order_column: str = None,
+                group_column: str = None, periods: int = 1) -> Tuple[pd.DataFrame, str]:
+    """按顺序计算相邻记录的增长率（可按分组分别计算）"""
+    value = _require(df, value_column, "numeric", "数值")
+    order = resolve_column(df, order_column, "datetime", exclude=(value,))
+    group = _match_column(df, group_column)
+    result = df.sort_values([c for c in (group, order) if c]) if (order or group) else df.copy()
+    values = pd.to_numeric(result[value], errors="coerce").astype("float64")
+    if group:
+        result["growth_rate"] = values.groupby(result[group], observed=True).pct_change(periods, fill_method=None)
+    else:
+        result["growth_rate"] = values.pct_change(periods, fill_method=None)
+
+    first, last = values.iloc[0] if len(values) else None, values.iloc[-1] if len(values) else None
+    overall = (last - first) / abs(first) if first not in (None, 0) and pd.notna(first) and pd.notna(last) else None
+    summary = f"{value}从首条记录到末条记录的整体增长率: {_pct(overall)}，平均逐期增长率: {_pct(result['growth_rate'].mean())}"
+    return result, summary
+
+def period_change(df: pd.DataFrame, value_column: str = None, date_column: str = None,
+                  lag: str = "mom", freq: str = None) -> Tuple[pd.DataFrame, str]:
+    """按周期汇总后计算环比（mom，与上一期比较）或同比（yoy，与上年同期比较）"""
+    value = _require(df, value_column, "numeric", "数值")
+    date = _require(df, date_column, "datetime", "日期", exclude=(value,))
+    dates = _as_datetime(df[date])
+    if dates.isna().all():
+        raise ValueError(f"列{date}无法解析为日期")
+    yearly = _is_year(df[date])
+    freq = freq or ("Y" if yearly else "M")
+    periods = dates.dt.to_period(freq)
+    totals = pd.to_numeric(df[value], errors="coerce").groupby(periods).sum(min_count=1)
+    # 补齐缺失的周期，保证按位置偏移就是按时间偏移
+    full = totals.reindex(pd.period_range(totals.index.min(), totals.index.max(), freq=freq))
+    if lag == "yoy":
+        steps = {"M": 12, "Q": 4, "W": 52, "D": 365}.get(freq.upper()[0], 1)
+        column = "yoy"
+    else:
+        steps = 1
+        column = "mom"
+    change = full.pct_change(steps, fill_method=None)
+    result = pd.DataFrame({"period": full.index.astype(str), value: full.values,
+                           f"previous_{value}": full.shift(steps).values, column: change.values})
+    result = result[result[value].notna()].reset_index(drop=True)
+
+    latest = result.iloc[-1] if not result.empty else None
+    label = "同比" if lag == "yoy" else "环比"
+    summary = (f"共{len(result)}个周期，最近一期({latest['period']}){label}: {_pct(latest[column])}"
+               if latest is not None else "没有可计算的周期")
+    return result, summary
+
+def top_n_contribution(df: pd.DataFrame, value_column: str = None, group_column: str = None,
+                       n: int = 10) -> Tuple[pd.DataFrame, str]:
+    """按分组汇总，计算前N名的占比和累计占比，其余合并为“其他”"""
+    value = _require(df, value_column, "numeric", "数值")
+    group = _require(df, group_column, "category", "分组", exclude=(value,))
+    n = int(n)
+    totals = pd.to_numeric(df[value], errors="coerce").groupby(df[group], observed=True).sum().sort_values(ascending=False)
+    grand_total = totals.sum()
+    top = totals.head(n)
+    result = pd.DataFrame({group: top.index.astype(str), value: top.values})
+    if len(totals) > n:
+        result.loc[len(result)] = ["其他", totals.iloc[n:].sum()]
+    result["share"] = result[value] / grand_total if grand_total else np.nan
+    result["cumulative_share"] = result["share"].cumsum()
+    result["rank"] = np.arange(1, len(result) + 1)
+
+    top_share = top.sum() / grand_total if grand_total else None
+    summary = f"{group}共{len(totals)}项，前{min(n, len(totals))}项贡献{value}的{_pct(top_share)}"
+    if len(top):
+        summary += f"，第一名{top.index[0]}占{_pct(top.iloc[0] / grand_total if grand_total else None)}"
+    return result, summary
+
+def trend_slope(df: pd.DataFrame, value_column: str = None, order_column: str = None,
+                group_column: str = None) -> Tuple[pd.DataFrame, str]:
+    """最小二乘线性趋势：每期平均变化量(slope)、相对均值的变化率和拟合优度r2；x为排序后的期数"""
+    value = _require(df, value_column, "numeric", "数值")
+    order = resolve_column(df, order_column, "datetime", exclude=(value,))
+    group = _match_column(df, group_column)
+    data = df.sort_values([c for c in (group, order) if c]) if (order or group) else df
+    keys = data[group] if group else pd.Series(0, index=data.index)
+    y = pd.to_numeric(data[value], errors="coerce").astype("float64")
+    frame = pd.DataFrame({"key": keys.values, "y": y.values}).dropna(subset=["y"])
+    frame["x"] = frame.groupby("key", observed=True).cumcount().astype("float64")
+    frame["xy"] = frame["x"] * frame["y"]
+    frame["xx"] = frame["x"] * frame["x"]
+    frame["yy"] = frame["y"] * frame["y"]
+    sums = frame.groupby("key", observed=True).agg(n=("y", "size"), x=("x", "sum"), y=("y", "sum"),
+                                                    xy=("xy", "sum"), xx=("xx", "sum"), yy=("yy", "sum"))
+    sxx = sums["xx"] - sums["x"] ** 2 / sums["n"]
+    sxy = sums["xy"] - sums["x"] * sums["y"] / sums["n"]
+    syy = sums["yy"] - sums["y"] ** 2 / sums["n"]
+    slope = (sxy / sxx).where(sxx > 0)
+    mean = sums["y"] / sums["n"]
+    result = pd.DataFrame({
+        "points": sums["n"].values,
+        "slope": slope.values,
+        "relative_slope": (slope / mean.abs()).where(mean != 0).values,
+        "r2": ((sxy ** 2) / (sxx * syy)).where((sxx > 0) & (syy > 0)).values
+    })
+    if group:
+        result.insert(0, group, sums.index)
+    result["direction"] = np.select([result["slope"] > 0, result["slope"] < 0], ["上升", "下降"], default="持平")
+
+    if group:
+        summary = f"{len(result)}个{group}中上升{int((result['slope'] > 0).sum())}个、下降{int((result['slope'] < 0).sum())}个"
+    elif not result.empty:
+        row = result.iloc[0]
+        summary = (f"{value}呈{row['direction']}趋势，每期平均变化{row['slope']:.4g}"
+                   f"（相对均值{_pct(row['relative_slope'])}），r2={row['r2']:.2f}" if pd.notna(row['slope'])
+                   else f"{value}数据点不足，无法计算趋势")
+    else:
+        summary = "没有可计算趋势的数据"
+    return result, summary
+
+def seasonality(df: pd.DataFrame, value_column: str = None, date_column: str = None,
+                period: str = "month") -> Tuple[pd.DataFrame, str]:
+    """季节性指数：各季节（月份/季度/星期）的平均值除以总体平均值，大于1表示旺季"""
+    value = _require(df, value_column, "numeric", "数值")
+    date = _require(df, date_column, "datetime", "日期", exclude=(value,))
+    dates = _as_datetime(df[date])
+    if dates.isna().all():
+        raise ValueError(f"列{date}无法解析为日期")
+    seasons = {"month": dates.dt.month, "quarter": dates.dt.quarter, "weekday": dates.dt.dayofweek}
+    season = seasons.get(period, seasons["month"]).rename(period)
+    values = pd.to_numeric(df[value], errors="coerce")
+    means = values.groupby(season).mean()
+    overall = values.mean()
+    result = pd.DataFrame({period: means.index.astype(int), f"avg_{value}": means.values,
+                           "observations": values.groupby(season).count().values})
+    result["seasonal_index"] = result[f"avg_{value}"] / overall if overall else np.nan
+
+    if result.empty:
+        return result, "没有可计算季节性的数据"
+    peak = result.loc[result["seasonal_index"].idxmax()]
+    trough = result.loc[result["seasonal_index"].idxmin()]
+    summary = (f"按{period}统计，最高为{int(peak[period])}（指数{peak['seasonal_index']:.2f}），"
+               f"最低为{int(trough[period])}（指数{trough['seasonal_index']:.2f}）")
+    return result, summary
+
+def outliers(df: pd.DataFrame, value_column: str = None, method: str = "iqr",
+             threshold: float = None) -> Tuple[pd.DataFrame, str]:
+    """异常值检测：iqr为超出四分位距threshold倍（默认1.5），zscore为标准分绝对值超过threshold（默认3）。返回异常记录"""
+    value = _require(df, value_column, "numeric", "数值")
+    values = pd.to_numeric(df[value], errors="coerce").astype("float64")
+    std = values.std()
+    zscore = (values - values.mean()) / std if std else pd.Series(0.0, index=values.index)
+    if method == "zscore":
+        threshold = 3.0 if threshold is None else float(threshold)
+        flags = zscore.abs() > threshold
+    else:
+        threshold = 1.5 if threshold is None else float(threshold)
+        q1, q3 = values.quantile(0.25), values.quantile(0.75)
+        spread = q3 - q1
+        flags = (values < q1 - threshold * spread) | (values > q3 + threshold * spread)
+    result = df.loc[flags].copy()
+    result["zscore"] = zscore[flags]
+    result = result.reindex(result["zscore"].abs().sort_values(ascending=False).index)
+
+    summary = f"{value}共{int(values.notna().sum())}个值，按{method}检测到{len(result)}个异常值"
+    if len(result):
+        summary += f"，偏离最大的值为{result[value].iloc[0]}（标准分{result['zscore'].iloc[0]:.2f}）"
+    return result, summary
+
+# operation名称 -> (函数, 固定参数, 说明)；说明用于分析计划生成提示
+PRIMITIVES = {
+    "growth": (growth_rate, {}, "逐期增长率，参数: value_column, order_column, group_column"),
+    "mom": (period_change, {"lag": "mom"}, "按月汇总后的环比，参数: value_column, date_column"),
+    "yoy": (period_change, {"lag": "yoy"}, "按月汇总后的同比（年份数据按年），参数: value_column, date_column"),
+    "top_n_contribution": (top_n_contribution, {}, "前N名贡献度和累计占比，参数: value_column, group_column, n"),
+    "trend_slope": (trend_slope, {}, "线性趋势斜率和拟合优度，参数: value_column, order_column, group_column"),
+    "seasonality": (seasonality, {}, "季节性指数，参数: value_column, date_column, period(month/quarter/weekday)"),
+    "outliers": (outliers, {}, "异常值检测，参数: value_column, method(iqr/zscore), threshold")
+}
+
+def describe_primitives() -> str:
+    return "\n".join(f"   - {name}: {description}" for name, (_, _, description) in PRIMITIVES.items())
+
+def compute_inputs(step: Dict[str, Any]) -> List[Any]:
+    """compute步骤读取的上游步骤编号"""
+    inputs = step.get('compute_requirements', {}).get('input_step')
+    if inputs is None:
+        return []
+    return list(inputs) if isinstance(inputs, (list, tuple)) else [inputs]
+
+def run_primitive(operation: str, df: pd.DataFrame, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """执行一个分析原语，返回 {"success", "data", "summary"} 或 {"error"}"""
+    if operation not in PRIMITIVES:
+        return {"error": f"不支持的计算操作: {operation}，可用操作: {list(PRIMITIVES)}"}
+    if df is None or df.empty:
+        return {"error": "输入数据为空"}
+    function, fixed, _ = PRIMITIVES[operation]
+    accepted = inspect.signature(function).parameters
+    kwargs = {name: value for name, value in (params or {}).items() if name in accepted and value not in (None, "")}
+    kwargs.update(fixed)
+    try:
+        result, summary = function(df, **kwargs)
+    except (ValueError, TypeError, KeyError) as e:
+        return {"error": f"{operation}计算失败: {str(e)}"}
+    truncated = len(result) > MAX_RESULT_ROWS
+    return {
+        "success": True,
+        "data": result.head(MAX_RESULT_ROWS).reset_index(drop=True) if truncated else result.reset_index(drop=True),
+        "summary": summary + (f"（结果共{len(result)}行，仅保留前{MAX_RESULT_ROWS}行）" if truncated else "")
+    }
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+步骤数据的统计概要
+为llm_analysis提示生成每个步骤数据的紧凑描述：逐列的类型、空值率、分位数、高频取值，
+按维度分组的汇总以及按时间重采样的序列点。概要按token预算逐级降低细节，
+提示长度只取决于预算而不随数据量增长；数据本身足够小时直接给出完整表格。
+"""
+
+import json
+import re
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+DEFAULT_PROFILE_TOKEN_BUDGET = 800
+
+# 细节级别从高到低：高频取值数、分组数、时间序列点数、样例行数
+DETAIL_LEVELS = [
+    {"top_k": 5, "groups": 10, "points": 24, "samples": 3},
+    {"top_k": 3, "groups": 6, "points": 12, "samples": 2},
+    {"top_k": 2, "groups": 3, "points": 6, "samples": 0},
+    {"top_k": 1, "groups": 0, "points": 0, "samples": 0}
+]
+MAX_GROUP_CARDINALITY = 50
+MAX_AGGREGATED_COLUMNS = 3
+_RESAMPLE_FREQS = (("D", "日"), ("W", "周"), ("M", "月"), ("Q", "季度"), ("Y", "年"))
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中日韩字符每字约1个token，其余字符约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def truncate_to_budget(text: str, token_budget: int) -> str:
+    """把文本截断到token预算内"""
+    if estimate_tokens(text) <= token_budget:
+        return text
+    suffix = "...(已按token预算截断)"
+    budget = max(0, token_budget - estimate_tokens(suffix))
+    used = 0.0
+    for index, char in enumerate(text):
+        used += 1 if _CJK_PATTERN.match(char) else 0.25
+        if used > budget:
+            return text[:index] + suffix
+    return text
+
+def _fmt(value) -> str:
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return "空"
+    if isinstance(value, float):
+        return f"{value:,.0f}" if abs(value) >= 1e4 else f"{value:.4g}"
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S").replace(" 00:00:00", "")
+    text = str(value)
+    return text if len(text) <= 30 else text[:30] + "…"
+
+def _is_numeric(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+class _ColumnStats:
+    """逐列统计只计算一次，各细节级别共用"""
+
+    def __init__(self, series: pd.Series, max_top_k: int):
+        self.name = series.name
+        self.dtype = str(series.dtype)
+        self.null_rate = float(series.isna().mean()) if len(series) else 0.0
+        self.kind = "text"
+        self.stats: Dict[str, Any] = {}
+        self.top: List[tuple] = []
+        non_null = series.dropna()
+        self.distinct = int(non_null.nunique()) if not non_null.empty else 0
+        if non_null.empty:
+            self.kind = "empty"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            self.kind = "datetime"
+            self.stats = {"min": non_null.min(), "max": non_null.max()}
+        elif _is_numeric(series):
+            self.kind = "numeric"
+            values = non_null.astype("float64")
+            quantiles = values.quantile([0.25, 0.5, 0.75])
+            self.stats = {"min": values.min(), "p25": quantiles[0.25], "p50": quantiles[0.5],
+                          "p75": quantiles[0.75], "max": values.max(), "mean": values.mean(), "sum": values.sum()}
+        # 文本列和取值很少的数值列（编码、等级等）给出高频取值
+        if self.kind == "text" or (self.kind == "numeric" and self.distinct <= max_top_k * 2):
+            counts = non_null.value_counts().head(max_top_k)
+            self.top = list(zip(counts.index, counts.values))
+
+    def render(self, top_k: int) -> str:
+        line = f"- {self.name} [{self.dtype}] 空值{self.null_rate * 100:.0f}%"
+        if self.kind == "empty":
+            return line + " 全部为空"
+        if self.kind == "datetime":
+            return line + f" 范围 {_fmt(self.stats['min'])} ~ {_fmt(self.stats['max'])}，{self.distinct}个不同值"
+        if self.kind == "numeric":
+            stats = self.stats
+            line += (f" 最小{_fmt(stats['min'])} P25 {_fmt(stats['p25'])} 中位{_fmt(stats['p50'])}"
+                     f" P75 {_fmt(stats['p75'])} 最大{_fmt(stats['max'])} 均值{_fmt(stats['mean'])} 合计{_fmt(stats['sum'])}")
+        else:
+            line += f" {self.distinct}个不同值"
+        if self.top and top_k and (self.kind == "text" or self.distinct <= top_k * 2):
+            line += " 高频: " + ", ".join(f"{_fmt(value)}({count})" for value, count in self.top[:top_k])
+        return line
+
+def _group_column(df: pd.DataFrame) -> Optional[str]:
+    """选择用于分组汇总的维度列：取值数在2到MAX_GROUP_CARDINALITY之间的首个非数值列"""
+    for column in df.columns:
+        series = df[column]
+        if _is_numeric(series) or pd.api.types.is_datetime64_any_dtype(series):
+            continue
+        if 2 <= series.nunique(dropna=True) <= MAX_GROUP_CARDINALITY:
+            return column
+    return None
+
+def _measure_columns(df: pd.DataFrame) -> List[str]:
+    return [column for column in df.columns if _is_numeric(df[column])][:MAX_AGGREGATED_COLUMNS]
+
+def _group_table(df: pd.DataFrame, group: str, measures: List[str]) -> Optional[pd.DataFrame]:
+    if not measures:
+        return None
+    grouped = df.groupby(group, observed=True)[measures].sum(min_count=1)
+    grouped.insert(0, "记录数", df.groupby(group, observed=True).size())
+    return grouped.sort_values(measures[0], ascending=False)
+
+def _time_series(df: pd.DataFrame, measures: List[str], max_points: int):
+    """按时间列重采样，选择使点数不超过max_points的最细粒度；返回(粒度名称, 序列表)"""
+    dates = [column for column in df.columns if pd.api.types.is_datetime64_any_dtype(df[column])]
+    if not dates or not measures or max_points <= 0:
+        return None
+    indexed = df.dropna(subset=[dates[0]]).set_index(dates[0])[measures]
+    if indexed.empty:
+        return None
+    for freq, label in _RESAMPLE_FREQS:
+        periods = indexed.index.to_period(freq)
+        series = indexed.groupby(periods).sum(min_count=1)
+        if len(series) <= max_points:
+            return f"{dates[0]}按{label}", series
+    return f"{dates[0]}按年", series.tail(max_points)
+
+def _table_text(table: pd.DataFrame) -> str:
+    return table.to_string(float_format=lambda value: _fmt(float(value)))
+
+def profile_dataframe(df: pd.DataFrame, token_budget: int = DEFAULT_PROFILE_TOKEN_BUDGET) -> str:
+    """生成不超过token预算的DataFrame概要；数据足够小时直接给出完整表格"""
+    header = f"数据概况: {len(df)}行 x {len(df.columns)}列"
+    if df.empty:
+        return header
+    if len(df) <= 50:
+        full = f"{header}\n完整数据:\n{_table_text(df)}"
+        if estimate_tokens(full) <= token_budget:
+            return full
+
+    max_level = DETAIL_LEVELS[0]
+    columns = [_ColumnStats(df[column], max_level["top_k"]) for column in df.columns]
+    measures = _measure_columns(df)
+    group = _group_column(df)
+    group_table = _group_table(df, group, measures) if group else None
+    series_cache = {}
+
+    text = header
+    for level in DETAIL_LEVELS:
+        parts = [header, "列统计:"] + [column.render(level["top_k"]) for column in columns]
+        if group_table is not None and level["groups"]:
+            shown = group_table.head(level["groups"])
+            more = f"（共{len(group_table)}组，显示前{len(shown)}组）" if len(group_table) > len(shown) else ""
+            parts.append(f"按{group}分组汇总{more}:\n{_table_text(shown)}")
+        if level["points"]:
+            if level["points"] not in series_cache:
+                series_cache[level["points"]] = _time_series(df, measures, level["points"])
+            resampled = series_cache[level["points"]]
+            if resampled is not None:
+                label, series = resampled
+                parts.append(f"时间序列（{label}汇总）:\n{_table_text(series.set_axis(series.index.astype(str)))}")
+        if level["samples"]:
+            parts.append(f"样例行:\n{_table_text(df.head(level['samples']))}")
+        text = "\n".join(parts)
+        if estimate_tokens(text) <= token_budget:
+            return text
+    return truncate_to_budget(text, token_budget)
+
+def profile_value(data: Any, token_budget: int = DEFAULT_PROFILE_TOKEN_BUDGET) -> str:
+    """非DataFrame数据（外部数据、文本）按紧凑JSON或原文截断到token预算内"""
+    if isinstance(data, str):
+        text = data
+    else:
+        try:
+            text = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+        except (TypeError, ValueError):
+            text = str(data)
+    return truncate_to_budget(text, token_budget)
+
+def profile_result_data(data: Any, token_budget: int = DEFAULT_PROFILE_TOKEN_BUDGET) -> str:
+    if isinstance(data, pd.DataFrame):
+        return profile_dataframe(data, token_budget)
+    return profile_value(data, token_budget)
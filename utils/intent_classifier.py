@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+本地意图分类
+字符n-gram朴素贝叶斯模型，在意图识别提示中的示例和测试问题集上训练，单次分类耗时远低于1毫秒；
+明确的增删改SQL语句由规则直接判定为reject；中文"删除""新增""修改"等关键词也常出现在只读统计问题中
+（如"新增用户数按月统计"），关键词命中时只给出低于阈值的置信度，交给LLM判断。
+分析计划阶段的回复中含否定或取消（"不执行""先别""取消"）或转折、修改用语（"不过""去掉""but"）时直接判定为修改计划。
+调用方只在本地置信度低于阈值时才请求LLM，多数问题可以省掉一次LLM往返。
+"""
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+# 意图识别提示中的参考示例，同时作为本地模型的训练数据
+INTENT_EXAMPLES: List[Tuple[str, str]] = [
+    ("哪些产品是畅销品？", "query"),
+    ("显示所有用户信息", "query"),
+    ("查询产品销量排名前10名", "query"),
+    ("列出2024年的所有订单", "query"),
+    ("按销售额对产品进行排序", "query"),
+    ("分析销售趋势", "query"),
+    ("过去6个月销售趋势如何？", "query"),
+    ("分析产品销售的季节性趋势", "query"),
+    ("对比不同地区的销售表现", "query"),
+    ("比较2023年和2024年的销售数据", "query"),
+    ("统计月度增长率", "query"),
+    ("哪个季节销售最好？", "query"),
+    ("销量前10的产品", "query"),
+    ("计算各产品的投资回报率", "query"),
+    ("为什么Q4销售下滑？", "analysis"),
+    ("客户流失的主要原因是什么？", "analysis"),
+    ("分析库存积压的根本原因", "analysis"),
+    ("深入分析用户行为变化趋势", "analysis"),
+    ("深度对比分析各产品线的盈利能力", "analysis"),
+    ("计算客户生命周期价值", "analysis"),
+    ("表现最差的销售员及改进建议", "analysis"),
+    ("哪些产品畅销？分析其成功因素", "analysis"),
+    ("统计销售数据并给出优化建议", "analysis"),
+    ("对比各地区销售，找出差异原因", "analysis"),
+    ("删除所有用户数据", "reject"),
+    ("更新产品价格", "reject"),
+    ("插入新的订单记录", "reject"),
+]
+
+# 分析计划阶段：执行计划还是修改计划
+EXECUTE_EXAMPLES: List[Tuple[str, str]] = [
+    ("执行", "execute"),
+    ("开始执行", "execute"),
+    ("确认执行", "execute"),
+    ("执行计划", "execute"),
+    ("按计划执行", "execute"),
+    ("开始分析", "execute"),
+    ("好的，开始吧", "execute"),
+    ("可以，执行吧", "execute"),
+    ("没问题，开始执行", "execute"),
+    ("就按这个计划执行", "execute"),
+    ("确认，运行", "execute"),
+    ("运行分析计划", "execute"),
+    ("run", "execute"),
+    ("execute", "execute"),
+    ("go", "execute"),
+    ("再加上天气数据", "modify"),
+    ("增加一个步骤分析地区差异", "modify"),
+    ("去掉第二步", "modify"),
+    ("把时间范围改成2023年", "modify"),
+    ("还要考虑节假日的影响", "modify"),
+    ("不需要外部数据", "modify"),
+    ("补充分析客户年龄分布", "modify"),
+    ("换成按周统计", "modify"),
+    ("第三步改为对比去年同期", "modify"),
+    ("也看一下退货率", "modify"),
+    ("计划里加上竞品价格", "modify"),
+    ("只分析华东地区", "modify"),
+    ("不执行", "modify"),
+    ("暂不执行", "modify"),
+    ("先别执行，再改一下", "modify"),
+    ("不要执行", "modify"),
+    ("别执行了", "modify"),
+    ("取消", "modify"),
+    ("算了，先不运行", "modify"),
+    ("don't run it yet", "modify"),
+]
+
+# 明确的增删改/DDL语句，直接拒绝
+_REJECT_STATEMENT = re.compile(
+    r'^\s*(insert\s+(into\s+)?[\w.`"]+|update\s+[\w.`"]+\s+set|delete\s+from|drop\s+(table|database|schema|view|index)|'
+    r'alter\s+table|truncate(\s+table)?\s+[\w.`"]+|create\s+(table|database|schema|view|index)|replace\s+into|merge\s+into)\b',
+    re.IGNORECASE)
+# 增删改关键词：删除类在任何位置、更新插入类在句首或"改为xx"形式出现时疑似修改操作，
+# 但也可能是只读问题（"统计已删除的订单数量""创建时间最近的10个用户"），只作为低置信度的reject
+REJECT_KEYWORD_CONFIDENCE = 0.5
+_REJECT_ANYWHERE = re.compile(r'删除|删掉|清空|清除数据|\b(delete\s+from|drop\s+(table|database|view)|truncate\s+table|alter\s+table|grant|revoke)\b', re.IGNORECASE)
+_REJECT_LEADING = re.compile(r'^(请|帮我|麻烦)?(更新|修改|插入|新增|添加|录入|写入|改成|改为|创建|建立|新建)|^\s*(insert|update|create|replace|merge)\b', re.IGNORECASE)
+_REJECT_SET = re.compile(r'(修改|更新|改).{0,20}(为|成)\s*[\d\'"“]')
+
+# 分类标准中属于分析意图的提示词（原因、建议、深度洞察）；只用于提高模型判为analysis时的置信度
+_ANALYSIS_CUES = re.compile(r'为什么|原因|建议|策略|因素|洞察|深入|深度|根本|(如何|怎么|怎样)(提升|提高|改进|改善|优化)|优化方案|\bwhy\b', re.IGNORECASE)
+ANALYSIS_CUE_CONFIDENCE = 0.9
+
+# 明确的确认执行回复
+_EXECUTE_EXACT = {"执行", "开始执行", "确认执行", "确认", "开始", "好的", "好", "可以", "ok", "yes", "run", "go", "execute"}
+
+def reject_rule(question: str) -> bool:
+    """是否为明确的增删改/DDL语句"""
+    return bool(_REJECT_STATEMENT.search(question))
+
+def reject_keywords(question: str) -> bool:
+    """是否含疑似增删改的关键词"""
+    text = question.strip()
+    return bool(_REJECT_ANYWHERE.search(text) or _REJECT_LEADING.search(text) or _REJECT_SET.search(text))
+
+# 分析计划阶段回复中的否定或取消：执行类动词前的否定词，以及单独的取消用语
+_EXECUTE_NEGATION = re.compile(r'(不|别|暂不|暂时不|不要|先别|先不|不用|无需)(要)?(再)?(执行|运行|开始|跑)|^(先别|取消|算了)|取消执行|'
+                               r'\b(cancel|abort|stop|wait|not\s+yet|don\'?t|do\s+not)\b', re.IGNORECASE)
+# 回复中的转折或修改用语（"开始吧，不过去掉第三步""ok but add weather data first"）：同意执行的同时要求修改计划
+_PLAN_EDIT = re.compile(r'不过|但是|但|可是|只是|去掉|删掉|删除|加上|加入|增加|添加|补充|改|换成|替换|调整|'
+                        r'\b(but|however|except|add|remove|drop|change|replace|instead|without)\b', re.IGNORECASE)
+# "不用改""无需调整"等表示不修改，不算修改用语
+_NO_EDIT = re.compile(r'(不用|不需要|不必|无需|没有|没)(再)?(修改|改动|改|调整|补充)')
+
+def _normalize(text: str) -> str:
+    text = text.lower().strip()
+    # 数字统一替换，年份、TopN中的具体数值不影响意图
+    text = re.sub(r'\d+', '0', text)
+    return re.sub(r'[\s，。！？、,.!?；;：:“”"\'（）()]+', ' ', text).strip()
+
+def _ngrams(text: str, ngram_range: Tuple[int, int]) -> List[str]:
+    padded = f"^{_normalize(text)}$"
+    low, high = ngram_range
+    return [padded[i:i + n] for n in range(low, high + 1) for i in range(len(padded) - n + 1)]
+
+class NgramIntentClassifier:
+    """字符n-gram多项式朴素贝叶斯。
+    置信度为按n-gram数归一化后的对数似然经softmax得到的概率，避免长句时后验概率过于极端。
+    训练中未出现的n-gram对所有意图使用同一个分值：按各意图自身的平滑计算时，训练数据最少的意图（reject）
+    未见n-gram的分值最高，措辞陌生的问题会被判为该意图"""
+
+    def __init__(self, examples: List[Tuple[str, str]], ngram_range: Tuple[int, int] = (1, 3),
+                 alpha: float = 0.5, sharpness: float = 6.0):
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        self.sharpness = sharpness
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        documents = Counter()
+        for text, label in examples:
+            counts[label].update(_ngrams(text, ngram_range))
+            documents[label] += 1
+        self.labels = sorted(counts)
+        vocabulary = set()
+        for counter in counts.values():
+            vocabulary.update(counter)
+        self.vocabulary_size = len(vocabulary)
+        total_documents = sum(documents.values())
+        self.log_prior = {label: math.log(documents[label] / total_documents) for label in self.labels}
+        totals = {label: sum(counts[label].values()) + self.alpha * (self.vocabulary_size + 1) for label in self.labels}
+        self.log_likelihood: Dict[str, Dict[str, float]] = {
+            label: {gram: math.log((count + self.alpha) / totals[label]) for gram, count in counts[label].items()}
+            for label in self.labels
+        }
+        self.log_unseen = math.log(self.alpha / max(totals.values()))
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """各意图的概率"""
+        grams = _ngrams(text, self.ngram_range)
+        if not grams:
+            return {label: 1.0 / len(self.labels) for label in self.labels}
+        raw = {}
+        for label in self.labels:
+            likelihood = self.log_likelihood[label]
+            total = sum(likelihood.get(gram, self.log_unseen) for gram in grams)
+            raw[label] = self.sharpness * (total / len(grams)) + self.log_prior[label]
+        peak = max(raw.values())
+        exp = {label: math.exp(value - peak) for label, value in raw.items()}
+        norm = sum(exp.values())
+        return {label: value / norm for label, value in exp.items()}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        scores = self.scores(text)
+        label = max(scores, key=scores.get)
+        return label, scores[label]
+
+def _test_question_examples() -> List[Tuple[str, str]]:
+    """测试问题集中带明确意图标注的问题（边界案例不参与训练）"""
+    try:
+        from utils.test_question_helper import TestQuestionHelper
+    except ImportError:
+        return []
+    prefixes = {"Query意图": "query", "Analysis意图": "analysis", "Reject意图": "reject"}
+    examples = []
+    for category, questions in TestQuestionHelper().questions.items():
+        label = next((value for prefix, value in prefixes.items() if category.startswith(prefix)), None)
+        if label:
+            examples.extend((question, label) for _, question in questions)
+    return examples
+
+# 进程级模型，首次使用时训练
+_classifiers: Dict[str, NgramIntentClassifier] = {}
+_classifiers_lock = threading.Lock()
+
+def _get_classifier(name: str) -> NgramIntentClassifier:
+    with _classifiers_lock:
+        if name not in _classifiers:
+            if name == "intent":
+                _classifiers[name] = NgramIntentClassifier(INTENT_EXAMPLES + _test_question_examples())
+            else:
+                _classifiers[name] = NgramIntentClassifier(EXECUTE_EXAMPLES)
+        return _classifiers[name]
+
+def classify_intent(question: str, classifier: Optional[NgramIntentClassifier] = None) -> Tuple[str, float]:
+    """本地判断 query/analysis/reject，返回(意图, 置信度)；明确的增删改语句置信度为1，
+    只命中增删改关键词时为低于阈值的reject，由LLM确认。classifier默认使用进程级模型"""
+    if reject_rule(question):
+        return "reject", 1.0
+    if reject_keywords(question):
+        return "reject", REJECT_KEYWORD_CONFIDENCE
+    label, confidence = (classifier or _get_classifier("intent")).predict(question)
+    if label == "analysis" and _ANALYSIS_CUES.search(question):
+        confidence = max(confidence, ANALYSIS_CUE_CONFIDENCE)
+    elif label == "reject":
+        # 模型认为像增删改但规则未命中，交给LLM确认
+        confidence = min(confidence, 0.5)
+    return label, confidence
+
+def classify_execute_intent(text: str) -> Tuple[str, float]:
+    """本地判断分析计划阶段的回复是 execute 还是 modify，返回(意图, 置信度)；
+    含否定、取消或转折、修改用语时为modify"""
+    if _EXECUTE_NEGATION.search(text) or _PLAN_EDIT.search(_NO_EDIT.sub(" ", text)):
+        return "modify", 1.0
+    if _normalize(text) in _EXECUTE_EXACT:
+        return "execute", 1.0
+    return _get_classifier("execute").predict(text)
+
+def confidence_threshold(llm_config: Optional[Dict] = None) -> float:
+    """从LLM配置的intent.confidence_threshold读取阈值"""
+    return float(((llm_config or {}).get("intent") or {}).get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+意图识别与SQL生成提示
+- 意图识别提示：只返回 query/analysis/reject
+- 合并模式：一次结构化请求同时返回 {intent, sql, confidence}，意图为query时直接使用其中的SQL，
+  普通查询从两次串行的LLM往返减少为一次
+- 推测模式：意图识别请求进行的同时在后台线程推测生成SQL，意图为query时直接使用，
+  否则取消或丢弃；丢弃的推测按估算的token数计入统计，用于权衡延迟与成本
+"""
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional, Tuple
+
+from utils.data_profiler import estimate_tokens
+from utils.intent_classifier import INTENT_EXAMPLES
+from utils.schema_index import prune_schema
+from utils.schema_prompt import format_schema_tables
+
+INTENTS = ("query", "analysis", "reject")
+
+# 意图与SQL的生成方式：combined为一次请求同时返回意图和SQL，speculative为意图识别与SQL生成并发，
+# separate为先识别意图再生成SQL。combined不可用的接口自动改用speculative
+INTENT_MODES = ("combined", "speculative", "separate")
+DEFAULT_INTENT_MODE = "combined"
+SPECULATION_WORKERS = 4
+
+_INTENT_CRITERIA = """- query: 数据查询和基础分析，可通过SQL查询直接获得结果
+- analysis: 深度分析，需要多步骤思考、原因分析或业务洞察
+- reject: 涉及数据库增删改操作
+
+分类标准：
+- query: 数据检索、排序、统计计算、趋势展示、对比查询等，重点是获取和展示数据
+- analysis: 原因分析、深度洞察、复杂推理、需要业务建议等，重点是解释和分析
+- reject: INSERT/UPDATE/DELETE/DROP/CREATE/ALTER等修改操作"""
+
+def intent_examples_text() -> str:
+    """意图识别提示中的参考示例（与本地分类器的训练示例相同）"""
+    groups = [
+        ("query", "Query类型（数据查询和基础分析）"),
+        ("analysis", "Analysis类型（深度分析和洞察）"),
+        ("reject", "Reject类型（危险操作）")
+    ]
+    text = ""
+    for label, title in groups:
+        text += f"\n{title}：\n"
+        text += "".join(f'- "{example}" → {label}\n' for example, example_label in INTENT_EXAMPLES if example_label == label)
+    return text
+
+def build_intent_messages(question: str) -> Tuple[str, str]:
+    """意图识别提示，返回(system提示, 用户问题)；说明和示例不随问题变化，放在前面"""
+    system_prompt = f"""请分析以下用户问题的意图，只返回下列之一：
+{_INTENT_CRITERIA}
+
+参考示例：
+{intent_examples_text()}"""
+    return system_prompt, f"用户问题: {question}\n\n意图:"
+
+def build_intent_prompt(question: str) -> str:
+    return "\n".join(build_intent_messages(question))
+
+def parse_intent_response(response: Optional[str]) -> str:
+    """从意图识别的回复中提取意图，无法识别时按查询处理"""
+    response_lower = (response or "").lower().strip()
+    if "reject" in response_lower:
+        return "reject"
+    elif "analysis" in response_lower:
+        return "analysis"
+    return "query"
+
+def build_combined_messages(question: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str],
+                            llm_config: Optional[Dict] = None) -> Tuple[str, str]:
+    """意图识别和SQL生成合并为一次请求的提示，返回(system提示, 用户问题)；表较多时只包含与问题相关的表"""
+    schema_info, table_descriptions = prune_schema(question, schema_info, table_descriptions, llm_config)
+    system_prompt = f"""### 意图识别与数据库查询
+
+请判断用户问题的意图（query/analysis/reject之一）：
+{_INTENT_CRITERIA}
+
+参考示例：
+{intent_examples_text()}
+请只返回一个JSON对象，不要包含任何解释说明或markdown代码块：
+{{"intent": "query", "sql": "可执行的SQL语句", "confidence": 0.9}}
+
+要求：
+- intent为query时，sql为回答该问题的可执行SQL语句（只能使用SELECT查询）
+- intent为analysis或reject时，sql为空字符串
+- confidence为0到1之间的数字，表示对意图判断的把握
+
+### 数据库Schema:
+{format_schema_tables(schema_info, table_descriptions)}"""
+    return system_prompt, f"用户问题: {question}"
+
+def build_combined_prompt(question: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str],
+                          llm_config: Optional[Dict] = None) -> str:
+    return "\n\n".join(build_combined_messages(question, schema_info, table_descriptions, llm_config))
+
+def parse_combined_response(response: Optional[str]) -> Optional[Dict[str, Any]]:
+    """解析合并请求的回复，返回 {"intent", "sql", "confidence"}；格式不正确时返回None"""
+    if not response:
+        return None
+    text = response.strip()
+    code_block = re.search(r'```(?:json)?\s*(\{.*\})\s*```', text, re.DOTALL)
+    if code_block:
+        text = code_block.group(1)
+    else:
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        text = text[start:end + 1]
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, dict):
+        return None
+
+    intent = str(parsed.get("intent", "")).lower().strip()
+    if intent not in INTENTS:
+        return None
+    sql = parsed.get("sql") or ""
+    sql = re.sub(r'^```(?:sql)?\s*|\s*```$', '', str(sql).strip()).strip() if intent == "query" else ""
+    try:
+        confidence = float(parsed.get("confidence", 1.0))
+    except (TypeError, ValueError):
+        confidence = 1.0
+    return {"intent": intent, "sql": sql, "confidence": confidence}
+
+def intent_mode(llm_config: Optional[Dict] = None) -> str:
+    """从LLM配置的intent.mode读取意图与SQL的生成方式"""
+    mode = ((llm_config or {}).get("intent") or {}).get("mode", DEFAULT_INTENT_MODE)
+    return mode if mode in INTENT_MODES else DEFAULT_INTENT_MODE
+
+def supports_combined(llm_config: Optional[Dict] = None) -> bool:
+    """使用固定request_template的自定义接口无法保证返回JSON，不使用合并模式"""
+    llm_config = llm_config or {}
+    if llm_config.get("provider", "openai") != "custom":
+        return True
+    return llm_config.get("custom", {}).get("request_format", "openai") == "openai"
+
+def effective_intent_mode(llm_config: Optional[Dict] = None) -> str:
+    """实际使用的生成方式：配置为combined但接口不支持时改为speculative"""
+    mode = intent_mode(llm_config)
+    if mode == "combined" and not supports_combined(llm_config):
+        return "speculative"
+    return mode
+
+# 进程级推测执行线程池和统计；LLM请求无法中途取消，已开始的推测只能等其完成后丢弃
+_speculation_executor: Optional[ThreadPoolExecutor] = None
+_speculation_lock = threading.Lock()
+_speculation_stats = {
+    "started": 0,             # 发起的推测次数
+    "used": 0,                # 意图为query、推测结果被采用的次数
+    "cancelled": 0,           # 尚未开始即被取消的次数（不产生token消耗）
+    "discarded": 0,           # 已发出请求、结果被丢弃的次数
+    "wasted_prompt_tokens": 0,   # 丢弃的请求的输入token数（来自API响应的usage，接口未返回时按提示文本估算）
+    "wasted_output_tokens": 0,   # 丢弃的请求的输出token数
+    "estimated": 0,              # 接口未返回usage、按文本估算token数的丢弃次数
+    "saved_seconds": 0.0      # 与串行执行相比节省的等待时间
+}
+
+def _get_speculation_executor() -> ThreadPoolExecutor:
+    global _speculation_executor
+    with _speculation_lock:
+        if _speculation_executor is None:
+            _speculation_executor = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="speculative-sql")
+        return _speculation_executor
+
+def _timed(generate: Callable[[], Tuple[Optional[str], str]], llm_client=None):
+    """在推测线程中执行generate，返回(SQL, 提示, 耗时, 该请求的usage)"""
+    started = time.perf_counter()
+    sql, prompt = generate()
+    usage = getattr(llm_client, "last_usage", None)
+    return sql, prompt, time.perf_counter() - started, usage
+
+def start_speculative_sql(generate: Callable[[], Tuple[Optional[str], str]], llm_client=None) -> Future:
+    """在后台线程执行generate（返回(SQL, 提示)），与意图识别并发；
+    llm_client为generate使用的客户端，用于读取该请求实际的token用量"""
+    with _speculation_lock:
+        _speculation_stats["started"] += 1
+    return _get_speculation_executor().submit(_timed, generate, llm_client)
+
+def _record_wasted(future: Future) -> None:
+    try:
+        sql, prompt, _, usage = future.result()
+    except Exception:
+        sql, prompt, usage = None, "", None
+    with _speculation_lock:
+        _speculation_stats["discarded"] += 1
+        if usage:
+            _speculation_stats["wasted_prompt_tokens"] += usage["prompt_tokens"]
+            _speculation_stats["wasted_output_tokens"] += usage["completion_tokens"]
+        else:
+            _speculation_stats["estimated"] += 1
+            _speculation_stats["wasted_prompt_tokens"] += estimate_tokens(prompt)
+            _speculation_stats["wasted_output_tokens"] += estimate_tokens(sql or "")
+        stats = dict(_speculation_stats)
+    print(f"丢弃推测生成的SQL，累计浪费约 {stats['wasted_prompt_tokens'] + stats['wasted_output_tokens']} tokens"
+          f"（采用{stats['used']}次，丢弃{stats['discarded']}次，取消{stats['cancelled']}次）")
+
+def finish_speculative_sql(future: Future, intent: str, intent_seconds: float) -> Optional[Tuple[Optional[str], str]]:
+    """意图为query时等待并返回推测的(SQL, 提示)；否则取消或丢弃推测，返回None"""
+    if intent != "query":
+        if future.cancel():
+            with _speculation_lock:
+                _speculation_stats["cancelled"] += 1
+        else:
+            # 请求已发出，完成后再统计浪费的token，不阻塞当前流程
+            future.add_done_callback(_record_wasted)
+        return None
+
+    try:
+        sql, prompt, sql_seconds, _ = future.result()
+    except Exception as e:
+        print(f"推测生成SQL失败: {str(e)}")
+        return None
+    with _speculation_lock:
+        _speculation_stats["used"] += 1
+        # 串行执行需要等待两次请求之和，并发只需等待较长的一次
+        _speculation_stats["saved_seconds"] += min(intent_seconds, sql_seconds)
+    return sql, prompt
+
+def speculation_stats() -> Dict[str, Any]:
+    with _speculation_lock:
+        return dict(_speculation_stats)
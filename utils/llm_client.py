@@ -1,6 +1,7 @@
 import requests
 import json
 import openai
+import threading
 import time
 from typing import Dict, Any, Optional, List, Union
 
@@ -28,6 +29,20 @@ def nested_get(dic: Dict, keys: str) -> Any:
             return None
     return dic
 
+# 进程级LLM用量统计（按API响应中的usage累计），用于核对提示前缀缓存的命中情况
+_usage_lock = threading.Lock()
+_usage_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+def _usage_field(usage: Any, name: str) -> Any:
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+def llm_usage_stats() -> Dict[str, int]:
+    """累计的请求数、输入token数、其中命中提示缓存的token数和输出token数"""
+    with _usage_lock:
+        return dict(_usage_stats)
+
 class LLMClient:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
@@ -37,6 +52,42 @@ class LLMClient:
             self.config = self.config["llm_config"]
             
         self.provider = self.config.get("provider", "openai")
+        # 按线程记录最近一次请求的用量：推测生成SQL与意图识别在不同线程中共用同一个客户端
+        self._local = threading.local()
+    
+    @property
+    def last_usage(self) -> Optional[Dict[str, int]]:
+        """当前线程最近一次generate_sql的token用量；响应中没有usage时为None"""
+        return getattr(self._local, "usage", None)
+    
+    @staticmethod
+    def _joined_prompt(prompt: str, system_prompt: Optional[str] = None) -> str:
+        """不支持system消息的接口把system提示放在前面，保持稳定前缀在前"""
+        return f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+    
+    @staticmethod
+    def _messages(prompt: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def _record_usage(self, usage: Any) -> None:
+        """记录响应中的token用量；cached_tokens为OpenAI/Azure提示缓存命中的输入token数"""
+        if not usage:
+            return
+        details = _usage_field(usage, "prompt_tokens_details") or {}
+        cached = _usage_field(details, "cached_tokens") or _usage_field(usage, "prompt_cache_hit_tokens") or 0
+        last_usage = self._local.usage = {
+            "prompt_tokens": int(_usage_field(usage, "prompt_tokens") or 0),
+            "cached_tokens": int(cached),
+            "completion_tokens": int(_usage_field(usage, "completion_tokens") or 0)
+        }
+        with _usage_lock:
+            _usage_stats["requests"] += 1
+            for key, value in last_usage.items():
+                _usage_stats[key] += value
+        print(f"LLM用量: 输入{last_usage['prompt_tokens']} tokens（提示缓存命中{last_usage['cached_tokens']}），"
+              f"输出{last_usage['completion_tokens']} tokens")
     
     def _get_timeout_by_request_type(self, prompt: str) -> int:
         """根据意图分类确定超时时间"""
@@ -85,16 +136,18 @@ class LLMClient:
         # 默认为查询意图
         return "query"
     
-    def generate_sql(self, prompt: str, request_type: Optional[str] = None, tools: List[Dict] = None) -> Optional[str]:
-        """根据提示生成SQL查询"""
+    def generate_sql(self, prompt: str, request_type: Optional[str] = None, tools: List[Dict] = None,
+                     system_prompt: Optional[str] = None) -> Optional[str]:
+        """根据提示生成SQL查询；system_prompt为各请求共用的稳定前缀（说明和schema），便于命中提示缓存"""
+        self._local.usage = None
         if self.provider == "openai":
-            return self._call_openai(prompt, request_type)
+            return self._call_openai(prompt, request_type, system_prompt)
         elif self.provider == "azure_openai":
-            return self._call_azure_openai(prompt, request_type)
+            return self._call_azure_openai(prompt, request_type, system_prompt)
         elif self.provider == "custom":
-            return self._call_custom(prompt, request_type)
+            return self._call_custom(prompt, request_type, system_prompt)
         elif self.provider == "openai_sdk":
-            return self._call_openai_sdk(prompt, request_type, tools)
+            return self._call_openai_sdk(prompt, request_type, system_prompt)
         return None
     
     def generate_response(self, prompt: str, request_type: Optional[str] = None, tools: List[Dict] = None) -> Optional[str]:
@@ -114,7 +167,7 @@ class LLMClient:
                 "tool_calls": None
             }
         
-    def _call_openai_sdk(self, prompt: str, request_type: Optional[str] = None) -> Optional[str]:
+    def _call_openai_sdk(self, prompt: str, request_type: Optional[str] = None, system_prompt: Optional[str] = None) -> Optional[str]:
         """使用OpenAI SDK调用API"""
         try:
             openai_config = self.config.get("openai", {})
@@ -123,10 +176,10 @@ class LLMClient:
             # 获取动态超时时间
             if request_type:
                 # 临时设置意图类型用于超时计算
-                temp_prompt = f"[INTENT_TYPE:{request_type}] {prompt}"
+                temp_prompt = f"[INTENT_TYPE:{request_type}] {self._joined_prompt(prompt, system_prompt)}"
                 timeout_seconds = self._get_timeout_by_request_type(temp_prompt)
             else:
-                timeout_seconds = self._get_timeout_by_request_type(prompt)
+                timeout_seconds = self._get_timeout_by_request_type(self._joined_prompt(prompt, system_prompt))
             
             # 设置OpenAI SDK的配置
             openai.api_key = openai_config.get("api_key")
@@ -138,7 +191,7 @@ class LLMClient:
             # 调用API
             api_params = {
                 "model": openai_config.get("model", "gpt-3.5-turbo"),
-                "messages": [{"role": "user", "content": prompt}]
+                "messages": self._messages(prompt, system_prompt)
             }
             
             # 处理模型参数兼容性
@@ -172,13 +225,14 @@ class LLMClient:
                 api_params["top_p"] = params.get("top_p", 0.9)
             
             response = openai.chat.completions.create(**api_params)
+            self._record_usage(getattr(response, "usage", None))
             
             return response.choices[0].message.content.strip()
         except Exception as e:
             print(f"使用OpenAI SDK调用API时出错: {str(e)}")
             return None
     
-    def _call_openai(self, prompt: str, request_type: Optional[str] = None) -> Optional[str]:
+    def _call_openai(self, prompt: str, request_type: Optional[str] = None, system_prompt: Optional[str] = None) -> Optional[str]:
         """调用OpenAI API"""
         try:
             openai_config = self.config.get("openai", {})
@@ -187,10 +241,10 @@ class LLMClient:
             # 获取动态超时时间
             if request_type:
                 # 临时设置意图类型用于超时计算
-                temp_prompt = f"[INTENT_TYPE:{request_type}] {prompt}"
+                temp_prompt = f"[INTENT_TYPE:{request_type}] {self._joined_prompt(prompt, system_prompt)}"
                 timeout_seconds = self._get_timeout_by_request_type(temp_prompt)
             else:
-                timeout_seconds = self._get_timeout_by_request_type(prompt)
+                timeout_seconds = self._get_timeout_by_request_type(self._joined_prompt(prompt, system_prompt))
             
             headers = {
                 "Content-Type": "application/json",
@@ -202,7 +256,7 @@ class LLMClient:
             
             data = {
                 "model": openai_config.get("model", "gpt-3.5-turbo"),
-                "messages": [{"role": "user", "content": prompt}]
+                "messages": self._messages(prompt, system_prompt)
             }
             
             # 处理模型参数兼容性
@@ -250,6 +304,7 @@ class LLMClient:
                 
                 try:
                     result = response.json()
+                    self._record_usage(result.get("usage"))
                     if "choices" in result and len(result["choices"]) > 0:
                         content = result["choices"][0]["message"]["content"]
                         return content.strip() if content else None
@@ -278,7 +333,7 @@ class LLMClient:
             print(f"调用OpenAI API时出错: {str(e)}")
             return None
     
-    def _call_azure_openai(self, prompt: str, request_type: Optional[str] = None) -> Optional[str]:
+    def _call_azure_openai(self, prompt: str, request_type: Optional[str] = None, system_prompt: Optional[str] = None) -> Optional[str]:
         """调用Azure OpenAI API"""
         try:
             azure_config = self.config.get("azure_openai", {})
@@ -287,10 +342,10 @@ class LLMClient:
             # 获取动态超时时间
             if request_type:
                 # 临时设置意图类型用于超时计算
-                temp_prompt = f"[INTENT_TYPE:{request_type}] {prompt}"
+                temp_prompt = f"[INTENT_TYPE:{request_type}] {self._joined_prompt(prompt, system_prompt)}"
                 timeout_seconds = self._get_timeout_by_request_type(temp_prompt)
             else:
-                timeout_seconds = self._get_timeout_by_request_type(prompt)
+                timeout_seconds = self._get_timeout_by_request_type(self._joined_prompt(prompt, system_prompt))
             
             headers = {
                 "Content-Type": "application/json",
@@ -298,7 +353,7 @@ class LLMClient:
             }
             
             data = {
-                "messages": [{"role": "user", "content": prompt}]
+                "messages": self._messages(prompt, system_prompt)
             }
             
             # 处理模型参数兼容性
@@ -356,6 +411,7 @@ class LLMClient:
                 
                 try:
                     result = response.json()
+                    self._record_usage(result.get("usage"))
                     if "choices" in result and len(result["choices"]) > 0:
                         content = result["choices"][0]["message"]["content"]
                         return content.strip() if content else None
@@ -384,7 +440,7 @@ class LLMClient:
             print(f"调用Azure OpenAI API时出错: {str(e)}")
             return None
     
-    def _call_custom(self, prompt: str, request_type: Optional[str] = None) -> Optional[str]:
+    def _call_custom(self, prompt: str, request_type: Optional[str] = None, system_prompt: Optional[str] = None) -> Optional[str]:
         """调用自定义LLM API"""
         try:
             custom_config = self.config.get("custom", {})
@@ -393,10 +449,10 @@ class LLMClient:
             # 获取动态超时时间
             if request_type:
                 # 临时设置意图类型用于超时计算
-                temp_prompt = f"[INTENT_TYPE:{request_type}] {prompt}"
+                temp_prompt = f"[INTENT_TYPE:{request_type}] {self._joined_prompt(prompt, system_prompt)}"
                 timeout_seconds = self._get_timeout_by_request_type(temp_prompt)
             else:
-                timeout_seconds = self._get_timeout_by_request_type(prompt)
+                timeout_seconds = self._get_timeout_by_request_type(self._joined_prompt(prompt, system_prompt))
             
             # 获取API密钥和基础URL
             api_key = custom_config.get("api_key")
@@ -420,7 +476,7 @@ class LLMClient:
             if request_format == "openai":
                 data = {
                     "model": model,
-                    "messages": [{"role": "user", "content": prompt}]
+                    "messages": self._messages(prompt, system_prompt)
                 }
                 
                 # 添加可选参数
@@ -435,10 +491,10 @@ class LLMClient:
                 data = custom_config.get("request_template", {})
                 # 将提示插入到模板中
                 if "prompt_field" in custom_config:
-                    nested_set(data, custom_config.get("prompt_field"), prompt)
+                    nested_set(data, custom_config.get("prompt_field"), self._joined_prompt(prompt, system_prompt))
                 else:
                     # 默认将提示放在根级别的"prompt"字段
-                    data["prompt"] = prompt
+                    data["prompt"] = self._joined_prompt(prompt, system_prompt)
                 
                 # 添加参数
                 for param_name, param_path in custom_config.get("param_mapping", {}).items():
@@ -499,6 +555,8 @@ class LLMClient:
                 if response.status_code == 200:
                     try:
                         result = response.json()
+                        if isinstance(result, dict):
+                            self._record_usage(result.get("usage"))
                         # 根据响应格式提取结果
                         response_format = custom_config.get("response_format", "openai")
                         
@@ -516,10 +574,19 @@ class LLMClient:
                         return f"连接测试成功，但响应格式不正确: {result}"
                     except json.JSONDecodeError:
                         return f"连接测试成功，但响应不是有效的JSON: {response.text}"
+                    except Exception as e:
+                        print(f"解析响应时出错: {str(e)}")
+                        return f"连接测试成功，但解析响应时出错: {str(e)}"
                 else:
-                    return f"自定义API错误: {response.status_code} - {response.text}"
-            except Exception as e:
-                return f"自定义API调用异常: {str(e)}"
+                    error_msg = f"自定义API错误: {response.status_code} - {response.text}"
+                    print(error_msg)
+                    return error_msg
+            
+            # 如果没有响应对象，返回错误信息
+            return "连接测试失败，请检查配置和日志"
+        except Exception as e:
+            print(f"调用自定义API时出错: {str(e)}")
+            return None
     
     def _call_openai_sdk_with_tools(self, messages: List[Dict], tools: List[Dict] = None) -> Dict[str, Any]:
         """使用OpenAI SDK调用API，支持工具调用"""
@@ -587,16 +654,3 @@ class LLMClient:
                 "content": f"API调用失败: {str(e)}",
                 "tool_calls": None
             }
-                    except Exception as e:
-                        print(f"解析响应时出错: {str(e)}")
-                        return f"连接测试成功，但解析响应时出错: {str(e)}"
-                else:
-                    error_msg = f"自定义API错误: {response.status_code} - {response.text}"
-                    print(error_msg)
-                    return error_msg
-            
-            # 如果没有响应对象，返回错误信息
-            return "连接测试失败，请检查配置和日志"
-        except Exception as e:
-            print(f"调用自定义API时出错: {str(e)}")
-            return None
\ No newline at end of file
@@ -1,13 +1,96 @@
+import asyncio
 import json
 import subprocess
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterator, AsyncIterator
+
+from utils.mcp_worker_pool import get_worker_pool, DEFAULT_POOL_CONFIG, WorkerError
+from mcp_servers.stdio_protocol import result_frames
+
+def _resolve_python_path() -> str:
+    """获取启动MCP服务器使用的Python解释器 - 优先使用虚拟环境中的Python"""
+    python_path = "/home/azureuser/Playground/GenBI-Demo/.venv/bin/python"
+    if not os.path.exists(python_path):
+        python_path = "python"  # 回退到系统Python
+    return python_path
 
 class MCPClient:
     def __init__(self):
         self.processes = {}
         self.server_instances = {}
         self._server_info_cache = {}  # 缓存服务器信息
+        self._pool_settings = None
+    
+    def _get_server_path(self, server_type: str, use_optimized: bool = False) -> str:
+        """获取服务器路径 - 优先使用标准版本（已优化）"""
+        if use_optimized and os.path.exists(os.path.join("mcp_servers", f"{server_type}_server_optimized.py")):
+            return os.path.join("mcp_servers", f"{server_type}_server_optimized.py")
+        return os.path.join("mcp_servers", f"{server_type}_server.py")
+    
+    def _get_pool_config(self, server_type: str) -> Dict[str, Any]:
+        """读取mcp_config.json中该服务器的进程池配置"""
+        if self._pool_settings is None:
+            try:
+                from utils.config_manager import ConfigManager
+                self._pool_settings = ConfigManager().load_mcp_config()
+            except Exception:
+                self._pool_settings = {}
+        server_config = self._pool_settings.get(server_type, {})
+        pool_config = dict(DEFAULT_POOL_CONFIG)
+        pool_config.update(server_config.get("pool", {}) if isinstance(server_config, dict) else {})
+        return pool_config
+    
+    def _send_request(self, server_type: str, request: Dict[str, Any], use_optimized: bool = False) -> Dict[str, Any]:
+        """发送请求：默认使用常驻进程池，未启用时回退到单次子进程模式"""
+        server_path = self._get_server_path(server_type, use_optimized)
+        command = [_resolve_python_path(), server_path]
+        pool_config = self._get_pool_config(server_type)
+        
+        if not pool_config.get("enabled", True):
+            return self._call_subprocess_once(command, request)
+        
+        try:
+            pool = get_worker_pool(server_type, command, pool_config)
+            return pool.call(request)
+        except WorkerError as e:
+            return {"error": f"MCP服务器错误: {str(e)}"}
+    
+    async def _asend_request(self, server_type: str, request: Dict[str, Any], use_optimized: bool = False) -> Dict[str, Any]:
+        """_send_request的asyncio版本：同一常驻进程上可同时有多个在途请求，按请求id匹配响应"""
+        server_path = self._get_server_path(server_type, use_optimized)
+        command = [_resolve_python_path(), server_path]
+        pool_config = self._get_pool_config(server_type)
+        
+        if not pool_config.get("enabled", True):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._call_subprocess_once, command, request)
+        
+        try:
+            pool = get_worker_pool(server_type, command, pool_config)
+            return await pool.acall(request)
+        except WorkerError as e:
+            return {"error": f"MCP服务器错误: {str(e)}"}
+    
+    def _call_subprocess_once(self, command: List[str], request: Dict[str, Any]) -> Dict[str, Any]:
+        """单次模式：每个请求启动一个子进程"""
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        
+        # 发送请求
+        stdout, stderr = process.communicate(json.dumps(request) + "\n")
+        
+        if process.returncode == 0:
+            try:
+                return json.loads(stdout.strip())
+            except json.JSONDecodeError as e:
+                return {"error": f"无法解析MCP服务器响应: {stdout}"}
+        else:
+            return {"error": f"MCP服务器错误: {stderr}"}
     
     def call_mcp_server(self, server_type: str, method: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
         """调用MCP服务器"""
@@ -18,36 +101,8 @@ class MCPClient:
                 "params": params or {}
             }
             
-            # 获取服务器路径 - 优先使用标准版本（已优化）
             use_optimized = params.get("use_optimized", False) if params else False
-            if use_optimized and os.path.exists(os.path.join("mcp_servers", f"{server_type}_server_optimized.py")):
-                server_path = os.path.join("mcp_servers", f"{server_type}_server_optimized.py")
-            else:
-                server_path = os.path.join("mcp_servers", f"{server_type}_server.py")
-            
-            # 启动进程 - 使用虚拟环境中的Python
-            python_path = "/home/azureuser/Playground/GenBI-Demo/.venv/bin/python"
-            if not os.path.exists(python_path):
-                python_path = "python"  # 回退到系统Python
-                
-            process = subprocess.Popen(
-                [python_path, server_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # 发送请求
-            stdout, stderr = process.communicate(json.dumps(request) + "\n")
-            
-            if process.returncode == 0:
-                try:
-                    return json.loads(stdout.strip())
-                except json.JSONDecodeError as e:
-                    return {"error": f"无法解析MCP服务器响应: {stdout}"}
-            else:
-                return {"error": f"MCP服务器错误: {stderr}"}
+            return self._send_request(server_type, request, use_optimized)
                 
         except Exception as e:
             return {"error": f"调用MCP服务器失败: {str(e)}"}
@@ -64,37 +119,114 @@ class MCPClient:
             "params": full_params
         }
         
-        # 获取服务器路径 - 优先使用标准版本（已优化）
-        use_optimized = config.get("use_optimized", False)
-        if use_optimized and os.path.exists(os.path.join("mcp_servers", f"{server_type}_server_optimized.py")):
-            server_path = os.path.join("mcp_servers", f"{server_type}_server_optimized.py")
-        else:
-            server_path = os.path.join("mcp_servers", f"{server_type}_server.py")
-        
         try:
-            # 启动进程
-            process = subprocess.Popen(
-                ["python", server_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # 发送请求
-            stdout, stderr = process.communicate(json.dumps(request) + "\n")
+            return self._send_request(server_type, request, config.get("use_optimized", False))
+        except Exception as e:
+            return {"error": f"调用MCP服务器失败: {str(e)}"}
+    
+    async def acall_mcp_server(self, server_type: str, method: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """异步调用MCP服务器，可用asyncio.gather并发发出多个请求"""
+        try:
+            request = {
+                "method": method,
+                "params": params or {}
+            }
             
-            if process.returncode == 0:
-                try:
-                    return json.loads(stdout.strip())
-                except json.JSONDecodeError as e:
-                    return {"error": f"无法解析MCP服务器响应: {stdout}"}
-            else:
-                return {"error": f"MCP服务器错误: {stderr}"}
+            use_optimized = params.get("use_optimized", False) if params else False
+            return await self._asend_request(server_type, request, use_optimized)
                 
         except Exception as e:
             return {"error": f"调用MCP服务器失败: {str(e)}"}
     
+    async def acall_mcp_server_with_config(self, server_type: str, method: str, config: Dict[str, Any], params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """异步调用MCP服务器，并在同一请求中包含配置信息"""
+        full_params = dict(params or {})
+        full_params["config"] = config
+        
+        request = {
+            "method": method,
+            "params": full_params
+        }
+        
+        try:
+            return await self._asend_request(server_type, request, config.get("use_optimized", False))
+        except Exception as e:
+            return {"error": f"调用MCP服务器失败: {str(e)}"}
+    
+    def _stream_request(self, server_type: str, method: str, config: Dict[str, Any], params: Dict[str, Any] = None):
+        """构建流式请求，返回 (请求, 启动命令, 进程池配置)"""
+        full_params = dict(params or {})
+        full_params["config"] = config
+        full_params["stream"] = True
+        request = {
+            "method": method,
+            "params": full_params
+        }
+        command = [_resolve_python_path(), self._get_server_path(server_type, config.get("use_optimized", False))]
+        return request, command, self._get_pool_config(server_type)
+    
+    @staticmethod
+    def _response_frames(response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """把一次性响应转换为流式帧（单次子进程模式下使用）"""
+        if "result" in response:
+            return result_frames(response["result"])
+        return iter([{"error": response.get("error", "未知错误")}])
+    
+    def stream_mcp_server_with_config(self, server_type: str, method: str, config: Dict[str, Any], params: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """流式调用MCP服务器：依次产出header、rows（多帧）、trailer帧，出错时产出error帧后结束。
+        调用方可以在查询完成前处理已到达的行，内存占用只与块大小相关"""
+        request, command, pool_config = self._stream_request(server_type, method, config, params)
+        
+        if not pool_config.get("enabled", True):
+            request["params"].pop("stream")
+            yield from self._response_frames(self._call_subprocess_once(command, request))
+            return
+        
+        try:
+            pool = get_worker_pool(server_type, command, pool_config)
+            yield from pool.stream(request)
+        except WorkerError as e:
+            yield {"error": f"MCP服务器错误: {str(e)}"}
+        except Exception as e:
+            yield {"error": f"调用MCP服务器失败: {str(e)}"}
+    
+    async def astream_mcp_server_with_config(self, server_type: str, method: str, config: Dict[str, Any], params: Dict[str, Any] = None) -> AsyncIterator[Dict[str, Any]]:
+        """stream_mcp_server_with_config的asyncio版本"""
+        request, command, pool_config = self._stream_request(server_type, method, config, params)
+        
+        if not pool_config.get("enabled", True):
+            request["params"].pop("stream")
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self._call_subprocess_once, command, request)
+            for frame in self._response_frames(response):
+                yield frame
+            return
+        
+        try:
+            pool = get_worker_pool(server_type, command, pool_config)
+            async for frame in pool.astream(request):
+                yield frame
+        except WorkerError as e:
+            yield {"error": f"MCP服务器错误: {str(e)}"}
+        except Exception as e:
+            yield {"error": f"调用MCP服务器失败: {str(e)}"}
+    
+    def invalidate_cache(self, database_type: str, tables: List[str] = None) -> Dict[str, Any]:
+        """失效常驻进程中的查询结果缓存（按表名，不传时清空），需通知池中的每个进程"""
+        command = [_resolve_python_path(), self._get_server_path(database_type)]
+        pool_config = self._get_pool_config(database_type)
+        if not pool_config.get("enabled", True):
+            # 单次模式下没有跨请求的缓存
+            return {"result": {"success": True, "invalidated": 0}}
+        
+        pool = get_worker_pool(database_type, command, pool_config)
+        responses = pool.broadcast({"method": "invalidate_cache", "params": {"tables": tables or []}})
+        errors = [r["error"] for r in responses if "error" in r]
+        if errors:
+            return {"error": f"部分进程缓存失效失败: {'; '.join(errors)}"}
+        invalidated = sum(r.get("result", {}).get("invalidated", 0) for r in responses)
+        return {"result": {"success": True, "invalidated": invalidated}}
+    
     def get_tables(self, database_type: str, config: Dict[str, Any]) -> List[str]:
         """获取数据库表列表"""
         # 在同一请求中初始化并获取表
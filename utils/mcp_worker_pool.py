@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+MCP服务器常驻工作进程池
+为每种服务器类型维护N个长驻子进程并跨调用复用，避免每次工具调用都重新启动解释器、
+导入pymysql/boto3/pandas并重新建立数据库连接。
+每个请求携带递增id，同一进程上可同时有多个在途请求，响应按id匹配（允许乱序返回）。
+流式请求的多帧响应（header/rows/trailer）放入各请求自己的缓冲队列逐帧交给调用方，
+某个调用方消费慢不会阻塞同一进程上其他请求的响应分发。
+支持空闲健康检查、按请求数/内存(RSS)排空回收以及崩溃自动重启。
+"""
+
+import asyncio
+import atexit
+import itertools
+import json
+import queue
+import subprocess
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional, Iterator, AsyncIterator, Union
+
+# 默认进程池配置，可在mcp_config.json中按服务器通过"pool"字段覆盖
+DEFAULT_POOL_CONFIG = {
+    "enabled": True,
+    "size": 2,                      # 每种服务器的常驻进程数
+    "max_inflight": 8,              # 单个进程同时处理的请求数上限
+    "max_requests": 500,            # 单个进程处理多少请求后回收
+    "max_rss_mb": 512,              # 单个进程内存(RSS)超过该值后回收
+    "request_timeout": 300,         # 单次请求超时(秒)
+    "acquire_timeout": 60,          # 等待可用进程的超时(秒)
+    "health_check_interval": 60,    # 进程空闲超过该时间(秒)后，复用前先做健康检查
+    "health_check_timeout": 5       # 健康检查超时(秒)
+}
+
+class WorkerError(Exception):
+    """工作进程错误"""
+    pass
+
+class WorkerCrashed(WorkerError):
+    """工作进程意外退出"""
+    pass
+
+# 流式响应中的非结束帧类型
+STREAM_PARTIAL_FRAMES = ("header", "rows")
+
+def is_final_frame(frame: Dict[str, Any]) -> bool:
+    """判断是否为某个请求的最后一帧（普通响应、trailer帧或错误帧）"""
+    return frame.get("stream") not in STREAM_PARTIAL_FRAMES
+
+class MCPStream:
+    """流式请求的帧通道：读取线程按序放入帧，调用方按序取出"""
+
+    def __init__(self):
+        self.mcp_worker = None
+        self.mcp_request_id = None
+        self.cancelled = False
+        self.finished = False
+        # 不限长度：读取线程由同一进程上的所有请求共用，不能因某个调用方消费慢而等待；
+        # 服务器端流式结果受max_rows限制，缓冲的帧数有上限
+        self._frames = queue.Queue()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def put(self, frame: Union[Dict[str, Any], Exception]):
+        """放入一帧（不阻塞），请求被放弃后直接丢弃"""
+        if not self.cancelled:
+            self._frames.put_nowait(frame)
+
+    def get(self, timeout: float) -> Dict[str, Any]:
+        try:
+            frame = self._frames.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError(f"MCP服务器响应超时({timeout}秒)")
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def add_done_callback(self, callback):
+        """请求结束时调用callback；已经结束时立即调用（与concurrent.futures.Future一致）"""
+        with self._lock:
+            if not self.finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        """请求结束（收到最后一帧、进程退出或被放弃）时调用一次"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def cancel(self):
+        self.cancelled = True
+        self.finish()
+
+class MCPWorker:
+    """单个常驻MCP服务器进程，按行收发JSON请求，按id把响应分发给对应的Future"""
+
+    def __init__(self, server_type: str, command: List[str]):
+        self.server_type = server_type
+        self.command = command
+        self.process = None
+        self.request_count = 0
+        self.started_at = 0.0
+        self.last_used = 0.0
+        self.draining = False       # 排空中：不再接收新请求，在途请求完成后回收
+        self.reserved = 0           # 已分配给调用方但尚未写入的请求数，由进程池在锁内维护
+        self._pending = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._stderr_tail = deque(maxlen=50)
+        self.start()
+
+    def start(self):
+        """启动子进程以及stdout/stderr读取线程"""
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        self.request_count = 0
+        self.started_at = time.time()
+        self.last_used = self.started_at
+
+        # stdout由读取线程按id分发；stderr必须持续读取，否则管道写满后子进程会阻塞
+        threading.Thread(target=self._read_stdout, args=(self.process,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True).start()
+
+    def _read_stdout(self, process):
+        try:
+            for line in process.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    response = json.loads(line)
+                except json.JSONDecodeError:
+                    # 第三方库打印到stdout的非协议输出，忽略
+                    continue
+                if isinstance(response, dict):
+                    self._dispatch(response)
+        except Exception:
+            pass
+
+        # 进程退出：所有在途请求以崩溃结束
+        with self._pending_lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        error = WorkerCrashed(f"MCP服务器进程意外退出: {self.stderr_tail()}")
+        for target in pending:
+            if isinstance(target, MCPStream):
+                target.put(error)
+                target.finish()
+            elif not target.done():
+                target.set_exception(error)
+
+    def _dispatch(self, response: Dict[str, Any]):
+        request_id = response.pop("id", None)
+        final = is_final_frame(response)
+        with self._pending_lock:
+            if request_id is not None:
+                target = self._pending.get(request_id)
+                if target is not None and final:
+                    del self._pending[request_id]
+            elif self._pending:
+                # 不带id的响应（旧版服务器）按先进先出匹配最早的在途请求
+                _, target = self._pending.popitem(last=False)
+            else:
+                target = None
+            if target is not None and final:
+                self.request_count += 1
+                self.last_used = time.time()
+        # target为None说明请求已超时或被取消，迟到的响应直接丢弃
+        if target is None:
+            return
+        if isinstance(target, MCPStream):
+            # 在锁外放入帧；放入不阻塞，其他请求的响应不受本调用方消费速度影响
+            target.put(response)
+            if final:
+                target.finish()
+        elif not target.done():
+            target.set_result(response)
+
+    def _read_stderr(self, process):
+        try:
+            for line in process.stderr:
+                self._stderr_tail.append(line.rstrip())
+        except Exception:
+            pass
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stderr_tail(self, lines: int = 10) -> str:
+        return "\n".join(list(self._stderr_tail)[-lines:])
+
+    def submit(self, request: Dict[str, Any], stream: bool = False) -> Union[Future, MCPStream]:
+        """发送请求，返回在收到对应id的响应时完成的Future；stream为True时返回逐帧读取的MCPStream"""
+        request_id = next(self._ids)
+        future = MCPStream() if stream else Future()
+        future.mcp_worker = self
+        future.mcp_request_id = request_id
+
+        with self._pending_lock:
+            if self._closed or not self.is_alive():
+                raise WorkerCrashed(f"MCP服务器进程已退出: {self.stderr_tail()}")
+            self._pending[request_id] = future
+
+        frame = dict(request)
+        frame["id"] = request_id
+        try:
+            with self._write_lock:
+                self.process.stdin.write(json.dumps(frame) + "\n")
+                self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            self.cancel(request_id)
+            raise WorkerCrashed(f"写入MCP服务器失败: {str(e)}")
+        return future
+
+    def cancel(self, request_id: int):
+        """放弃等待某个请求（超时后调用）；服务器稍后返回的响应会被丢弃"""
+        with self._pending_lock:
+            target = self._pending.pop(request_id, None)
+        if target is not None:
+            target.cancel()
+
+    def request(self, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """发送一个请求并同步等待响应"""
+        future = self.submit(request)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.cancel(future.mcp_request_id)
+            raise WorkerError(f"MCP服务器响应超时({timeout}秒)")
+
+    def rss_mb(self) -> Optional[float]:
+        """读取进程常驻内存(MB)，无法获取时返回None"""
+        if not self.is_alive():
+            return None
+        try:
+            with open(f"/proc/{self.process.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            import psutil
+            return psutil.Process(self.process.pid).memory_info().rss / 1024 / 1024
+        except Exception:
+            return None
+
+    def stop(self):
+        """关闭stdin让服务器处理完在途请求后自然退出，超时则强制结束"""
+        if not self.process:
+            return
+        try:
+            with self._write_lock:
+                self.process.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.process.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            try:
+                self.process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                pass
+
+class MCPWorkerPool:
+    """某一种MCP服务器的常驻进程池，请求分配给在途请求最少的进程"""
+
+    def __init__(self, server_type: str, command: List[str], config: Dict[str, Any] = None):
+        self.server_type = server_type
+        self.command = command
+        self.config = dict(DEFAULT_POOL_CONFIG)
+        self.config.update(config or {})
+        self.size = max(1, int(self.config["size"]))
+        self.max_inflight = max(1, int(self.config["max_inflight"]))
+
+        self._workers = []
+        self._starting = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {"requests": 0, "spawned": 0, "recycled": 0, "crashed": 0}
+
+    def _spawn(self) -> MCPWorker:
+        worker = MCPWorker(self.server_type, self.command)
+        with self._cond:
+            self.stats["spawned"] += 1
+        return worker
+
+    def _select_worker(self) -> MCPWorker:
+        """选择在途请求最少的进程并为调用方预留一个名额；都有负载且未达进程数上限时新建，全部满载时等待"""
+        deadline = time.time() + self.config["acquire_timeout"]
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise WorkerError(f"{self.server_type} 进程池已关闭")
+
+                # 移除已退出的进程（其在途请求已由读取线程以崩溃结束）
+                for dead in [w for w in self._workers if not w.is_alive()]:
+                    self._workers.remove(dead)
+                    self.stats["crashed"] += 1
+
+                available = [w for w in self._workers if not w.draining and self._load(w) < self.max_inflight]
+                idle = [w for w in available if self._load(w) == 0]
+                if idle:
+                    worker = idle[0]
+                    worker.reserved += 1
+                    break
+
+                if len(self._workers) + self._starting < self.size:
+                    worker = None
+                    # 先占位，启动进程放在锁外
+                    self._starting += 1
+                    break
+
+                if available:
+                    worker = min(available, key=self._load)
+                    worker.reserved += 1
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise WorkerError(f"等待 {self.server_type} 可用进程超时")
+                self._cond.wait(remaining)
+
+        if worker is None:
+            try:
+                worker = self._spawn()
+            finally:
+                with self._cond:
+                    self._starting -= 1
+                    if worker is not None:
+                        worker.reserved += 1
+                        self._workers.append(worker)
+                    self._cond.notify_all()
+            return worker
+
+        # 空闲较久的进程在复用前做一次健康检查
+        if worker.in_flight == 0 and time.time() - worker.last_used > self.config["health_check_interval"]:
+            if not self._health_check(worker):
+                self._retire(worker, crashed=True)
+                return self._select_worker()
+        return worker
+
+    @staticmethod
+    def _load(worker: MCPWorker) -> int:
+        return worker.in_flight + worker.reserved
+
+    def _health_check(self, worker: MCPWorker) -> bool:
+        try:
+            response = worker.request({"method": "get_server_info", "params": {}}, self.config["health_check_timeout"])
+            return "result" in response
+        except WorkerError:
+            return False
+
+    def _should_recycle(self, worker: MCPWorker) -> bool:
+        if worker.request_count >= self.config["max_requests"]:
+            return True
+        max_rss = self.config.get("max_rss_mb")
+        if max_rss:
+            rss = worker.rss_mb()
+            if rss is not None and rss > max_rss:
+                return True
+        return False
+
+    def _retire(self, worker: MCPWorker, crashed: bool = False):
+        """从池中移除进程并在后台停止"""
+        with self._cond:
+            if worker in self._workers:
+                self._workers.remove(worker)
+                self.stats["crashed" if crashed else "recycled"] += 1
+            self._cond.notify_all()
+        # 可能在该进程的读取线程中被调用，停止操作放到独立线程避免阻塞分发
+        threading.Thread(target=worker.stop, daemon=True).start()
+
+    def _on_done(self, worker: MCPWorker):
+        """请求完成回调：唤醒等待者，并对达到上限的进程排空回收"""
+        retire = False
+        with self._cond:
+            if not worker.draining and (self._closed or self._should_recycle(worker)):
+                worker.draining = True
+            retire = worker.draining and self._load(worker) == 0
+            self._cond.notify_all()
+        if retire:
+            self._retire(worker)
+
+    def submit(self, request: Dict[str, Any], stream: bool = False) -> Union[Future, MCPStream]:
+        """把请求发送到池中某个进程，返回Future（或MCPStream）；写入时进程已退出则换一个进程"""
+        last_error = None
+        for attempt in range(2):
+            worker = self._select_worker()
+            try:
+                future = worker.submit(request, stream)
+            except WorkerCrashed as e:
+                with self._cond:
+                    worker.reserved -= 1
+                self._retire(worker, crashed=True)
+                last_error = e
+                continue
+            with self._cond:
+                worker.reserved -= 1
+                self.stats["requests"] += 1
+            future.add_done_callback(lambda f, w=worker: self._on_done(w))
+            return future
+        raise last_error
+
+    def _abandon(self, future: Union[Future, MCPStream]):
+        worker = getattr(future, "mcp_worker", None)
+        if worker is not None:
+            worker.cancel(future.mcp_request_id)
+
+    def call(self, request: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        """在池中的进程上执行请求并等待结果；进程崩溃时重试一次"""
+        timeout = timeout or self.config["request_timeout"]
+        last_error = None
+        for attempt in range(2):
+            future = self.submit(request)
+            try:
+                return future.result(timeout)
+            except WorkerCrashed as e:
+                last_error = e
+            except FutureTimeoutError:
+                # 只放弃本请求，迟到的响应按id丢弃，进程可继续服务其他请求
+                self._abandon(future)
+                raise WorkerError(f"MCP服务器响应超时({timeout}秒)")
+        raise last_error
+
+    async def acall(self, request: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        """call的asyncio版本：多个协程可并发地在少量常驻进程上执行请求"""
+        timeout = timeout or self.config["request_timeout"]
+        loop = asyncio.get_running_loop()
+        last_error = None
+        for attempt in range(2):
+            # 选择/启动进程可能阻塞，放到线程池中执行
+            future = await loop.run_in_executor(None, self.submit, request)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            except WorkerCrashed as e:
+                last_error = e
+            except asyncio.TimeoutError:
+                self._abandon(future)
+                raise WorkerError(f"MCP服务器响应超时({timeout}秒)")
+        raise last_error
+
+    def stream(self, request: Dict[str, Any], timeout: float = None) -> Iterator[Dict[str, Any]]:
+        """流式执行请求，逐帧产出直到最后一帧；timeout为相邻两帧之间的最长等待时间。
+        尚未收到任何帧时进程崩溃会重试一次；调用方提前停止迭代时放弃剩余帧"""
+        timeout = timeout or self.config["request_timeout"]
+        last_error = None
+        for attempt in range(2):
+            channel = self.submit(request, stream=True)
+            received = False
+            try:
+                while True:
+                    frame = channel.get(timeout)
+                    received = True
+                    yield frame
+                    if is_final_frame(frame):
+                        return
+            except WorkerCrashed as e:
+                if received:
+                    raise
+                last_error = e
+            finally:
+                if not channel.finished:
+                    self._abandon(channel)
+        raise last_error
+
+    async def astream(self, request: Dict[str, Any], timeout: float = None) -> AsyncIterator[Dict[str, Any]]:
+        """stream的asyncio版本"""
+        loop = asyncio.get_running_loop()
+        frames = self.stream(request, timeout)
+        try:
+            while True:
+                frame = await loop.run_in_executor(None, next, frames, None)
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            frames.close()
+
+    def broadcast(self, request: Dict[str, Any], timeout: float = None) -> List[Dict[str, Any]]:
+        """向池中所有存活进程发送同一请求（如失效各进程内的缓存），返回各进程的响应"""
+        timeout = timeout or self.config["health_check_timeout"]
+        with self._cond:
+            workers = [w for w in self._workers if w.is_alive()]
+        futures = []
+        for worker in workers:
+            try:
+                futures.append(worker.submit(request))
+            except WorkerCrashed as e:
+                futures.append(e)
+        responses = []
+        for future in futures:
+            if isinstance(future, WorkerError):
+                responses.append({"error": str(future)})
+                continue
+            try:
+                responses.append(future.result(timeout))
+            except FutureTimeoutError:
+                future.mcp_worker.cancel(future.mcp_request_id)
+                responses.append({"error": f"MCP服务器响应超时({timeout}秒)"})
+            except WorkerError as e:
+                responses.append({"error": str(e)})
+        return responses
+
+    def status(self) -> Dict[str, Any]:
+        """返回进程池状态，用于监控展示"""
+        with self._cond:
+            workers = list(self._workers)
+        busy = sum(1 for w in workers if w.in_flight)
+        return {
+            "server_type": self.server_type,
+            "size": self.size,
+            "idle": len(workers) - busy,
+            "busy": busy,
+            "in_flight": sum(w.in_flight for w in workers),
+            "workers": [
+                {
+                    "pid": w.pid,
+                    "alive": w.is_alive(),
+                    "in_flight": w.in_flight,
+                    "draining": w.draining,
+                    "requests": w.request_count,
+                    "uptime": round(time.time() - w.started_at, 1),
+                    "rss_mb": w.rss_mb()
+                }
+                for w in workers
+            ],
+            "stats": dict(self.stats)
+        }
+
+    def shutdown(self):
+        """关闭进程池：空闲进程立即停止，忙碌进程在途请求完成后停止"""
+        with self._cond:
+            self._closed = True
+            idle = [w for w in self._workers if self._load(w) == 0]
+            for worker in self._workers:
+                worker.draining = True
+            for worker in idle:
+                self._workers.remove(worker)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
+
+# 进程级的池注册表：Streamlit每次重跑页面都会新建MCPClient，但模块只导入一次，池可跨请求复用
+_pools: Dict[str, MCPWorkerPool] = {}
+_pools_lock = threading.Lock()
+
+def get_worker_pool(server_type: str, command: List[str], config: Dict[str, Any] = None) -> MCPWorkerPool:
+    """获取（必要时创建）指定服务器的进程池；命令或配置变化时替换旧池"""
+    with _pools_lock:
+        pool = _pools.get(server_type)
+        expected_config = dict(DEFAULT_POOL_CONFIG)
+        expected_config.update(config or {})
+        if pool and (pool.command != command or pool.config != expected_config):
+            pool.shutdown()
+            pool = None
+        if pool is None:
+            pool = MCPWorkerPool(server_type, command, config)
+            _pools[server_type] = pool
+        return pool
+
+def get_all_pool_status() -> Dict[str, Dict[str, Any]]:
+    """获取所有进程池的状态"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.server_type: pool.status() for pool in pools}
+
+def shutdown_all_pools():
+    """关闭所有进程池"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+atexit.register(shutdown_all_pools)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+分析计划步骤结果检查点
+成功步骤的结果保存到本地（DataFrame存为Parquet，其余字段存为JSON），
+按 计划键 + 步骤键 定位：计划键由原始问题和数据库连接决定，修改计划后保持不变；
+步骤键由步骤定义及其上游步骤的键决定，步骤本身或其依赖发生变化时才需要重新计算。
+重新执行或修改后执行计划时，未变化的步骤直接读取检查点。
+依赖可选的pyarrow，未安装时DataFrame结果不保存检查点。
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from utils.plan_scheduler import step_order, step_id_of, step_dependencies, ORDERED_INPUT_STEP_TYPES
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CHECKPOINT_DIR = os.path.join(PROJECT_ROOT, "cache", "plan_checkpoints")
+# 检查点有效期，超过后数据可能已更新，重新计算
+DEFAULT_MAX_AGE_SECONDS = 24 * 3600
+
+# 不参与步骤键计算的字段：编号和依赖由上游键体现，其余只用于展示
+_VOLATILE_STEP_FIELDS = ("step_id", "dependencies", "target_data", "output_format")
+
+def _digest(value: Any) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def plan_key(question: str, database_type: str, db_config: Dict[str, Any]) -> str:
+    """同一问题、同一数据库连接的计划共用一个键（修改计划不改变计划键）"""
+    return _digest({"question": question, "database_type": database_type, "db_config": db_config})[:24]
+
+def _upstream_ids(ids: List[Any], index: int, step: Dict[str, Any]) -> List[Any]:
+    """步骤读取结果的上游步骤：显式依赖和compute输入步骤（编号按字符串形式对应），以及读取全部前序结果的步骤类型的前序步骤"""
+    upstream = [dep for dep in step_dependencies(step, {str(step_id): step_id for step_id in ids}) if dep in ids]
+    if step.get('step_type') in ORDERED_INPUT_STEP_TYPES:
+        upstream.extend(ids[:index])
+    return upstream
+
+def step_keys(steps: List[Dict[str, Any]]) -> Dict[Any, str]:
+    """按串行顺序计算每个步骤的键：步骤定义 + 其读取的上游步骤的键"""
+    ordered = step_order(steps)
+    ids = [step_id_of(step, index) for index, step in enumerate(ordered)]
+    keys: Dict[Any, str] = {}
+    for index, (step_id, step) in enumerate(zip(ids, ordered)):
+        definition = {name: value for name, value in step.items() if name not in _VOLATILE_STEP_FIELDS}
+        # 依赖成环时上游键尚未计算，使用步骤编号代替
+        upstream_keys = sorted({keys.get(dep, f"step:{dep}") for dep in _upstream_ids(ids, index, step)})
+        keys[step_id] = _digest({"step": definition, "upstream": upstream_keys})[:24]
+    return keys
+
+class PlanCheckpointStore:
+    """单个计划键下的检查点目录：<步骤键>.json 保存结果字段，<步骤键>.parquet 保存DataFrame"""
+
+    def __init__(self, key: str, root: str = DEFAULT_CHECKPOINT_DIR, max_age: float = DEFAULT_MAX_AGE_SECONDS):
+        self.directory = os.path.join(root, key)
+        self.max_age = max_age
+
+    def _paths(self, step_key: str):
+        base = os.path.join(self.directory, step_key)
+        return f"{base}.json", f"{base}.parquet"
+
+    def load(self, step_key: str) -> Optional[Dict[str, Any]]:
+        """读取有效期内的检查点结果，不存在或损坏时返回None"""
+        meta_path, data_path = self._paths(step_key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if time.time() - entry.get("saved_at", 0) > self.max_age:
+                return None
+            result = entry["result"]
+            if entry.get("data_format") == "parquet":
+                if pyarrow is None:
+                    return None
+                result['data'] = pd.read_parquet(data_path)
+            return result
+        except Exception:
+            # 文件不存在、损坏或Parquet无法读取
+            return None
+
+    def save(self, step_key: str, result: Dict[str, Any]) -> bool:
+        """保存成功步骤的结果，无法序列化时不保存并返回False"""
+        if result.get('status') != 'success':
+            return False
+        meta_path, data_path = self._paths(step_key)
+        entry = {"saved_at": time.time(), "data_format": "json", "result": dict(result)}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = result.get('data')
+            if isinstance(data, pd.DataFrame):
+                if pyarrow is None:
+                    return False
+                temp_data_path = f"{data_path}.{os.getpid()}.tmp"
+                data.to_parquet(temp_data_path, index=False)
+                os.replace(temp_data_path, data_path)
+                entry["data_format"] = "parquet"
+                entry["result"].pop('data')
+            temp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+            with open(temp_meta_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_meta_path, meta_path)
+            return True
+        except Exception:
+            # 磁盘错误、结果无法序列化、列名重复或列类型无法写入Parquet等
+            return False
+
+def reusable_checkpoints(steps: List[Dict[str, Any]], keys: Dict[Any, str],
+                         store: PlanCheckpointStore) -> Dict[Any, Dict[str, Any]]:
+    """返回可复用检查点的步骤结果 step_id -> 结果。
+    上游步骤需要重新计算时，下游步骤即使有检查点也重新计算，避免基于旧数据的结果"""
+    ordered = step_order(steps)
+    ids = [step_id_of(step, index) for index, step in enumerate(ordered)]
+    reusable: Dict[Any, Dict[str, Any]] = {}
+    for index, (step_id, step) in enumerate(zip(ids, ordered)):
+        if not all(dep in reusable for dep in _upstream_ids(ids, index, step)):
+            continue
+        result = store.load(keys[step_id])
+        if result is not None:
+            reusable[step_id] = result
+    return reusable
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+分析计划DAG调度
+按步骤声明的dependencies构建依赖图，依赖已满足的步骤在有界线程池中并发执行，
+总耗时取决于关键路径而不是步骤数。失败沿依赖边传递（下游步骤标记为跳过）。
+状态回调在调用run()的线程中触发，可直接更新Streamlit界面；步骤函数在工作线程中执行，
+不能直接调用Streamlit，显示内容通过DeferredUI记录后在调用线程回放。
+"""
+
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Callable, Optional
+
+from utils.analysis_primitives import compute_inputs
+
+DEFAULT_MAX_PARALLEL_STEPS = 4
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_SUCCESS = "success"
+STATUS_ERROR = "error"
+STATUS_SKIPPED = "skipped"
+
+# 这些类型的步骤会读取此前所有步骤的结果（按描述模糊匹配输入），需等待串行顺序中排在前面的全部步骤
+ORDERED_INPUT_STEP_TYPES = ("llm_analysis",)
+
+class DeferredUI:
+    """记录工作线程中的显示调用（write、code等），完成后在调用线程中按顺序回放；spinner为空操作"""
+
+    def __init__(self):
+        self.calls = []
+
+    def spinner(self, *args, **kwargs):
+        return contextlib.nullcontext()
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+    def replay(self, target):
+        for name, args, kwargs in self.calls:
+            getattr(target, name)(*args, **kwargs)
+
+def step_id_of(step: Dict[str, Any], index: int):
+    return step.get('step_id', index + 1)
+
+def _order_key(step_id):
+    """LLM生成的计划中步骤编号可能混用字符串和整数，数字形式的编号按数值排序"""
+    try:
+        return (0, float(step_id), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(step_id))
+
+def step_order(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """串行执行时的顺序（按step_id排序）"""
+    return sorted(steps, key=lambda x: _order_key(x.get('step_id', 0)))
+
+def step_dependencies(step: Dict[str, Any], id_map: Dict[str, Any]) -> List[Any]:
+    """步骤依赖的步骤编号：显式dependencies，加上compute步骤读取的输入步骤（compute_requirements.input_step）。
+    id_map为 str(步骤编号) -> 步骤编号，"1"与1对应同一步骤；计划中不存在的编号原样返回"""
+    dependencies = []
+    for dep in list(step.get('dependencies', []) or []) + compute_inputs(step):
+        resolved = id_map.get(str(dep), dep)
+        if resolved not in dependencies:
+            dependencies.append(resolved)
+    return dependencies
+
+class PlanScheduler:
+    """分析计划的依赖图执行器。
+    run_step(step, upstream_results) 在工作线程中执行，upstream_results为按串行顺序排列的已完成上游结果；
+    on_status(step_id, status, detail) 在调用线程中触发，detail为步骤结果或跳过原因"""
+
+    def __init__(self, steps: List[Dict[str, Any]], run_step: Callable[[Dict[str, Any], Dict[Any, Any]], Dict[str, Any]],
+                 max_workers: int = DEFAULT_MAX_PARALLEL_STEPS,
+                 on_status: Optional[Callable[[Any, str, Any], None]] = None):
+        self.steps = step_order(steps)
+        self.run_step = run_step
+        self.max_workers = max(1, max_workers)
+        self.on_status = on_status or (lambda step_id, status, detail: None)
+
+        self.ids = [step_id_of(step, index) for index, step in enumerate(self.steps)]
+        self.position = {step_id: index for index, step_id in enumerate(self.ids)}
+        self.by_id = dict(zip(self.ids, self.steps))
+        self.id_map = {str(step_id): step_id for step_id in self.ids}
+        self.status = {step_id: STATUS_PENDING for step_id in self.ids}
+        self.results: Dict[Any, Dict[str, Any]] = {}
+        self.skipped: Dict[Any, str] = {}
+
+    def _dependencies(self, step_id) -> List[Any]:
+        return step_dependencies(self.by_id[step_id], self.id_map)
+
+    def _waits_for(self, step_id) -> List[Any]:
+        """需要等待完成的步骤：显式依赖和compute输入步骤，以及读取全部前序结果的步骤在串行顺序中的前序步骤"""
+        waits = [dep for dep in self._dependencies(step_id) if dep in self.position]
+        if self.by_id[step_id].get('step_type') in ORDERED_INPUT_STEP_TYPES:
+            waits.extend(self.ids[:self.position[step_id]])
+        return waits
+
+    def _upstream(self, step_id) -> Dict[Any, Dict[str, Any]]:
+        """与串行执行时相同的可见结果：排在前面（或显式依赖）且已完成的步骤，按串行顺序排列"""
+        visible = set(self._dependencies(step_id))
+        upstream = OrderedDict()
+        for other in self.ids:
+            if other in self.results and (self.position[other] < self.position[step_id] or other in visible):
+                upstream[other] = self.results[other]
+        return upstream
+
+    def _skip(self, step_id, reason: str):
+        self.status[step_id] = STATUS_SKIPPED
+        self.skipped[step_id] = reason
+        self.on_status(step_id, STATUS_SKIPPED, reason)
+
+    def _blocked_reason(self, step_id) -> Optional[str]:
+        """显式依赖不存在、失败或被跳过时返回原因"""
+        missing = [dep for dep in self._dependencies(step_id) if dep not in self.position]
+        if missing:
+            return f"步骤{step_id}依赖的步骤{missing}不存在，跳过执行"
+        failed = [dep for dep in self._dependencies(step_id) if self.status[dep] in (STATUS_ERROR, STATUS_SKIPPED)]
+        if failed:
+            return f"步骤{step_id}依赖的步骤{failed}未成功完成，跳过执行"
+        return None
+
+    def _execute(self, step_id, upstream):
+        try:
+            result = self.run_step(self.by_id[step_id], upstream)
+        except Exception as e:
+            result = {'status': 'error', 'message': f"步骤{step_id}执行异常: {str(e)}"}
+        return result if isinstance(result, dict) else {'status': 'error', 'message': '步骤未返回结果'}
+
+    def run(self) -> Dict[Any, Dict[str, Any]]:
+        """执行全部步骤，返回按串行顺序排列的步骤结果（跳过的步骤不在其中，原因见self.skipped）"""
+        finished = (STATUS_SUCCESS, STATUS_ERROR, STATUS_SKIPPED)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="plan-step") as executor:
+            while True:
+                # 反复扫描直到没有新的跳过或提交（跳过一个步骤可能使其他步骤变为可运行或需要跳过）
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for step_id in self.ids:
+                        if self.status[step_id] != STATUS_PENDING:
+                            continue
+                        reason = self._blocked_reason(step_id)
+                        if reason:
+                            self._skip(step_id, reason)
+                            progressed = True
+                        elif len(running) < self.max_workers and all(
+                                self.status[dep] in finished for dep in self._waits_for(step_id)):
+                            self.status[step_id] = STATUS_RUNNING
+                            self.on_status(step_id, STATUS_RUNNING, None)
+                            running[executor.submit(self._execute, step_id, self._upstream(step_id))] = step_id
+                            progressed = True
+
+                if not running:
+                    # 没有可运行的步骤但仍有等待中的步骤：显式依赖成环，跳过环上（及依赖环）的步骤后继续
+                    cyclic = [step_id for step_id in self.ids if self.status[step_id] == STATUS_PENDING
+                              and any(self.status[dep] == STATUS_PENDING for dep in self._dependencies(step_id))]
+                    if not cyclic:
+                        break
+                    for step_id in cyclic:
+                        self._skip(step_id, f"步骤{step_id}的依赖存在循环，跳过执行")
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step_id = running.pop(future)
+                    result = future.result()
+                    self.results[step_id] = result
+                    self.status[step_id] = STATUS_SUCCESS if result.get('status') == 'success' else STATUS_ERROR
+                    self.on_status(step_id, self.status[step_id], result)
+
+        return OrderedDict((step_id, self.results[step_id]) for step_id in self.ids if step_id in self.results)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+分析计划SQL批量生成
+一次结构化的LLM请求为计划中全部sql_query步骤生成SQL，schema在提示中只出现一次。
+生成结果按步骤定义指纹缓存在计划上：重新执行或继续执行时不再调用LLM，
+修改计划后只为定义发生变化的步骤重新生成。
+"""
+
+import hashlib
+import json
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+from utils.schema_index import prune_schema, schema_fingerprint
+from utils.schema_prompt import format_schema_tables
+
+SQL_STEP_TYPE = "sql_query"
+
+# 各数据库的SQL方言说明
+SQL_DIALECTS = {
+    "mysql": "MySQL",
+    "athena": "Amazon Athena（Trino/Presto）"
+}
+
+def step_requirements_text(step: Dict[str, Any]) -> str:
+    """步骤的查询需求描述"""
+    query_requirements = step.get('query_requirements', {})
+    return f"""表: {', '.join(query_requirements.get('tables', []))}
+时间范围: {query_requirements.get('time_range', '不限')}
+筛选条件: {', '.join(query_requirements.get('filters', []))}
+需要的指标: {', '.join(query_requirements.get('metrics', []))}
+分组维度: {', '.join(query_requirements.get('grouping', []))}"""
+
+def sql_step_fingerprint(step: Dict[str, Any], database_type: str, schema_key: str) -> str:
+    """步骤SQL的缓存键：步骤描述和查询需求、数据库类型及schema不变时SQL可复用"""
+    payload = json.dumps({
+        "database_type": database_type,
+        "schema": schema_key,
+        "description": step.get('description', ''),
+        "query_requirements": step.get('query_requirements', {})
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def build_batch_sql_messages(steps: List[Tuple[Any, Dict[str, Any]]], schema_info: Dict[str, Any],
+                             table_descriptions: Dict[str, str], database_type: str) -> Tuple[str, str]:
+    """steps为 (step_id, 步骤) 列表；要求LLM返回以step_id为键的JSON对象。
+    返回(system提示, 步骤提示)：数据库类型和要求在前，其后是schema（裁剪时随步骤变化），随计划变化的步骤在最后"""
+    dialect = SQL_DIALECTS.get(database_type, database_type)
+    system_prompt = f"""### 分析计划SQL生成
+
+数据库类型: {dialect}
+
+请根据数据库schema为每个查询步骤生成一条可执行的{dialect} SQL语句。
+
+重要要求：
+- 只返回一个JSON对象，键为步骤编号（字符串），值为该步骤的SQL语句
+- 每个步骤都必须有对应的SQL
+- 只能使用SELECT查询
+- 不要包含任何解释说明或注释
+
+### 数据库Schema:
+{format_schema_tables(schema_info, table_descriptions)}"""
+
+    steps_prompt = "### 查询步骤:\n"
+    for step_id, step in steps:
+        steps_prompt += f"\n#### 步骤 {step_id}: {step.get('description', '')}\n{step_requirements_text(step)}\n"
+    example = {str(step_id): "SELECT ..." for step_id, _ in steps[:2]}
+    steps_prompt += f"""
+返回格式示例：
+{json.dumps(example, ensure_ascii=False)}"""
+    return system_prompt, steps_prompt
+
+def parse_batch_sql_response(response: Optional[str]) -> Dict[str, str]:
+    """解析批量生成的响应，返回 str(step_id) -> SQL；无法解析时返回空字典"""
+    if not response:
+        return {}
+    text = response.strip()
+    code_block = re.search(r'```(?:json)?\s*(\{.*\})\s*```', text, re.DOTALL)
+    if code_block:
+        text = code_block.group(1)
+    else:
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            return {}
+        text = text[start:end + 1]
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    sql_map = {}
+    for key, value in parsed.items():
+        if not isinstance(value, str) or not value.strip():
+            continue
+        sql = re.sub(r'^```(?:sql)?\s*|\s*```$', '', value.strip()).strip()
+        sql_map[str(key).strip()] = sql
+    return sql_map
+
+def plan_schema(steps: List[Tuple[Any, Dict[str, Any]]], schema_info: Dict[str, Any],
+                table_descriptions: Dict[str, str], llm_config: Optional[Dict] = None):
+    """批量SQL提示使用的schema：按全部步骤的描述和查询需求选出的相关表，加上步骤中明确指定的表"""
+    query_text = "\n".join(f"{step.get('description', '')}\n{step_requirements_text(step)}" for _, step in steps)
+    pruned_info, pruned_descriptions = prune_schema(query_text, schema_info, table_descriptions, llm_config)
+    if pruned_info is schema_info:
+        return schema_info, table_descriptions
+    named = {table for _, step in steps for table in step.get('query_requirements', {}).get('tables', [])}
+    keep = set(pruned_info) | (named & set(schema_info))
+    return ({table: schema_info[table] for table in schema_info if table in keep},
+            {table: table_descriptions[table] for table in table_descriptions if table in keep})
+
+def generate_plan_sql(steps: List[Tuple[Any, Dict[str, Any]]], schema_info: Dict[str, Any],
+                      table_descriptions: Dict[str, str], database_type: str, llm_client,
+                      cache: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """为 (step_id, 步骤) 列表中的sql_query步骤生成SQL。
+    cache为计划上保存的 步骤指纹 -> SQL（会被就地更新），已缓存的步骤不再发送给LLM。
+    返回 {"sql": {step_id: SQL}, "reused": 复用数, "generated": 新生成数, "missing": [未生成的step_id]}"""
+    cache = cache if cache is not None else {}
+    schema_key = schema_fingerprint(schema_info, table_descriptions)
+
+    sql_by_step = {}
+    pending = []
+    fingerprints = {}
+    for step_id, step in steps:
+        if step.get('step_type') != SQL_STEP_TYPE:
+            continue
+        fingerprint = sql_step_fingerprint(step, database_type, schema_key)
+        fingerprints[step_id] = fingerprint
+        if fingerprint in cache:
+            sql_by_step[step_id] = cache[fingerprint]
+        else:
+            pending.append((step_id, step))
+    reused = len(sql_by_step)
+
+    if pending and llm_client:
+        pruned_info, pruned_descriptions = plan_schema(pending, schema_info, table_descriptions, llm_client.config)
+        system_prompt, steps_prompt = build_batch_sql_messages(pending, pruned_info, pruned_descriptions, database_type)
+        generated = parse_batch_sql_response(llm_client.generate_sql(steps_prompt, "analysis", system_prompt=system_prompt))
+        for step_id, _ in pending:
+            sql = generated.get(str(step_id))
+            if sql:
+                sql_by_step[step_id] = sql
+                cache[fingerprints[step_id]] = sql
+
+    return {
+        "sql": sql_by_step,
+        "reused": reused,
+        "generated": len(sql_by_step) - reused,
+        "missing": [step_id for step_id, _ in pending if step_id not in sql_by_step]
+    }
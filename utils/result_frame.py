@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+查询结果转DataFrame
+把execute_query返回的data（按行的rows或按列的columnar）转换为DataFrame，
+并根据column_types设置列类型，避免数值、日期列以字符串形式参与后续分析；
+重复值多的字符串列转为category，减少内存并加快排序和分组。
+"""
+
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+# 同时包含Athena类型名和MySQL服务器返回的FIELD_TYPE名称
+_INTEGER_TYPES = ("tinyint", "smallint", "integer", "int", "bigint", "mediumint", "year",
+                  "tiny", "short", "long", "longlong", "int24")
+_FLOAT_TYPES = ("real", "float", "double", "decimal", "newdecimal")
+_DATETIME_TYPES = ("timestamp", "datetime", "date")
+
+# 字符串列去重后的取值数不超过行数的该比例时转为category（行数太少时不转换）
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MIN_ROWS = 50
+
+def _base_type(column_type: Optional[str]) -> str:
+    """去掉精度等修饰：decimal(10,2) -> decimal，timestamp(3) with time zone -> timestamp"""
+    return (column_type or "").lower().split("(")[0].split(" ")[0]
+
+def _apply_type(series: pd.Series, column_type: Optional[str]) -> pd.Series:
+    base = _base_type(column_type)
+    try:
+        if base in _INTEGER_TYPES:
+            # 可空整数类型，NULL保持为<NA>而不是把整列变成float
+            return pd.to_numeric(series, errors="coerce").astype("Int64")
+        if base in _FLOAT_TYPES:
+            return pd.to_numeric(series, errors="coerce")
+        if base in _DATETIME_TYPES:
+            converted = pd.to_datetime(series, errors="coerce")
+            # 带时区后缀等无法解析的格式保留原字符串，不把有值的单元格变成NaT
+            if converted.isna().sum() > series.isna().sum():
+                return series
+            return converted
+        if base in ("boolean", "bool"):
+            return series.map(lambda value: value if value is None or isinstance(value, bool)
+                              else str(value).lower() in ("true", "1")).astype("boolean")
+    except (TypeError, ValueError):
+        pass
+    return series
+
+def _maybe_categorical(series: pd.Series) -> pd.Series:
+    if len(series) < CATEGORY_MIN_ROWS or not (series.dtype == object or isinstance(series.dtype, pd.StringDtype)):
+        return series
+    non_null = series.dropna()
+    if non_null.empty or not all(isinstance(value, str) for value in non_null.head(100)):
+        return series
+    if non_null.nunique() <= len(series) * CATEGORY_MAX_RATIO:
+        return series.astype("category")
+    return series
+
+def result_to_dataframe(data: Dict[str, Any], categorize: bool = True) -> pd.DataFrame:
+    """把查询结果的data转换为带类型的DataFrame；没有column_types时保持原值。
+    categorize为True时把低基数的字符串列转为category"""
+    columns: List[str] = data.get("columns", [])
+    if "columnar" in data:
+        df = pd.DataFrame({name: data["columnar"].get(name, []) for name in columns}, columns=columns)
+    else:
+        df = pd.DataFrame(data.get("rows", []), columns=columns)
+    column_types = data.get("column_types")
+    if column_types and len(column_types) == len(columns) and len(set(columns)) == len(columns):
+        for name, column_type in zip(columns, column_types):
+            df[name] = _apply_type(df[name], column_type)
+    if categorize and len(set(columns)) == len(columns):
+        for name in columns:
+            df[name] = _maybe_categorical(df[name])
+    return df
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Schema相关性索引
+对schema_config中每张表的表名、列名、列注释和表描述建立BM25倒排索引，
+为每个问题选出最相关的top_k张表，再沿连接键补充被引用的维度表和连接两张已选表的桥接表，
+SQL生成提示中只放入这些表。中文按单字和相邻二字切分，不依赖分词库。
+表数量不超过min_tables或问题与任何表都不匹配时保留完整schema。
+
+裁剪与提示缓存的取舍：裁剪后每个问题的表不同，提示中schema部分无法命中OpenAI/Azure的前缀缓存，
+但输入token少得多；prefer_prompt_cache为true时不裁剪，同一数据库的所有请求共享包含完整schema的前缀，
+适合schema不太大、同一数据库上请求频繁的场景（缓存命中的输入token按折扣计费，首token延迟也更低）。
+"""
+
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+DEFAULT_TOP_K = 6
+DEFAULT_MIN_TABLES = 20
+MAX_EXPANDED_TABLES = 6
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 各字段在表文档中的权重（词频重复次数）
+TABLE_NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 2
+COLUMN_WEIGHT = 1
+
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[a-z0-9]+')
+_CAMEL_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+# 按时间统计的问题：相关度最高的几张表都没有日期列时，补充一张相连的带日期列的表
+_TIME_CUES = re.compile(r'趋势|按(年|季|月|周|日|天)|月度|年度|季度|每月|每年|同比|环比|日期|时间|最近|过去|\b(trend|monthly|yearly|daily|date)\b', re.IGNORECASE)
+_DATE_TYPE = re.compile(r'date|time', re.IGNORECASE)
+TIME_ANCHOR_TABLES = 3
+
+def schema_fingerprint(schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> str:
+    payload = json.dumps([schema_info, table_descriptions], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 2 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    """英文/标识符按单词切分（拆分下划线和驼峰、去复数），中文取单字和相邻二字"""
+    if not text:
+        return []
+    text = str(text)
+    tokens = []
+    for word in _WORD.findall(_CAMEL_BOUNDARY.sub(" ", text).lower()):
+        tokens.append(_singular(word))
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def _table_columns(table_info: Any) -> List[Dict[str, Any]]:
+    """兼容schema中 {"columns": [...]} 和直接为列列表的两种格式"""
+    columns = table_info.get("columns", []) if isinstance(table_info, dict) else table_info
+    return [col if isinstance(col, dict) else {"name": str(col)} for col in (columns or [])]
+
+def _key_name(name: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', str(name).lower())
+
+def _name_key(table: str) -> str:
+    """按表名推断的主键名，如orders -> orderid"""
+    return _key_name(_singular(table.rsplit(".", 1)[-1].lower())) + "id"
+
+def _own_keys(table: str, columns: List[Dict[str, Any]], name_keys: Dict[str, str]) -> set:
+    """表自身的主键名（规范化后）：按表名推断的键，加上以id结尾的首列；
+    首列恰好是另一张表按表名推断的键时（如order_details.order_id）视为外键"""
+    keys = {name_keys[table]}
+    if columns:
+        first = _key_name(columns[0].get("name", ""))
+        if first.endswith("id") and not any(key == first for other, key in name_keys.items() if other != table):
+            keys.add(first)
+    return keys
+
+class SchemaIndex:
+    """单个schema的BM25索引及表间连接关系"""
+
+    def __init__(self, schema_info: Dict[str, Any], table_descriptions: Dict[str, str]):
+        self.tables = list(schema_info.keys())
+        self.positions = {table: position for position, table in enumerate(self.tables)}
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+        self.dated_tables = set()
+        name_keys = {table: _name_key(table) for table in self.tables}
+        own_keys = {}
+        key_columns = {}
+        for doc_id, table in enumerate(self.tables):
+            columns = _table_columns(schema_info[table])
+            terms = tokenize(table) * TABLE_NAME_WEIGHT + tokenize(table_descriptions.get(table, "")) * DESCRIPTION_WEIGHT
+            for col in columns:
+                terms += (tokenize(col.get("name", "")) + tokenize(col.get("comment", ""))) * COLUMN_WEIGHT
+            for term, count in Counter(terms).items():
+                self.postings[term].append((doc_id, count))
+            self.doc_lengths.append(len(terms))
+            own_keys[table] = _own_keys(table, columns, name_keys)
+            if any(_DATE_TYPE.search(str(col.get("type", ""))) for col in columns):
+                self.dated_tables.add(table)
+            key_columns[table] = {_key_name(col.get("name", "")) for col in columns} - {""}
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        # 连接关系：表A的某列等于表B的主键名时，A引用B
+        key_owner: Dict[str, List[str]] = defaultdict(list)
+        for table, keys in own_keys.items():
+            for key in keys:
+                key_owner[key].append(table)
+        self.references: Dict[str, set] = {}
+        for table in self.tables:
+            self.references[table] = {
+                owner for column in key_columns[table] if column.endswith("id") and column not in own_keys[table]
+                for owner in key_owner.get(column, []) if owner != table
+            }
+        self.referenced_by: Dict[str, set] = defaultdict(set)
+        for table, targets in self.references.items():
+            for target in targets:
+                self.referenced_by[target].add(table)
+
+    def scores(self, question: str) -> Dict[str, float]:
+        """各表的BM25得分（只返回得分大于0的表）"""
+        total_docs = len(self.tables)
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(question)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return {self.tables[doc_id]: score for doc_id, score in scores.items() if score > 0}
+
+    def _neighbors(self, table: str) -> set:
+        return self.references.get(table, set()) | self.referenced_by.get(table, set())
+
+    def select_tables(self, question: str, top_k: int = DEFAULT_TOP_K,
+                      max_expanded: int = MAX_EXPANDED_TABLES) -> List[str]:
+        """相关表：BM25前top_k张，加上它们引用的维度表和连接已选表的桥接表；按schema原顺序返回。
+        问题与任何表都不匹配时返回空列表"""
+        scores = self.scores(question)
+        if not scores:
+            return []
+        ranked = sorted(scores, key=lambda table: (-scores[table], self.positions[table]))
+        selected = ranked[:top_k]
+        chosen = set(selected)
+        expanded = []
+
+        # 被已选表引用的维度表（如products -> categories），相关度高的优先
+        candidates = {target for table in selected for target in self.references[table]} - chosen
+        for table in sorted(candidates, key=lambda table: -scores.get(table, 0.0)):
+            if len(expanded) >= max_expanded:
+                break
+            expanded.append(table)
+            chosen.add(table)
+
+        # 时间类问题补充带日期列的相连表（如按类别统计销售趋势时的orders）
+        anchors = ranked[:TIME_ANCHOR_TABLES]
+        if _TIME_CUES.search(question) and not self.dated_tables.intersection(anchors):
+            dated = {neighbor for table in anchors for neighbor in self._neighbors(table)} & self.dated_tables
+            if dated:
+                best = max(dated, key=lambda table: (scores.get(table, 0.0), -self.positions[table]))
+                if best not in chosen:
+                    expanded.append(best)
+                    chosen.add(best)
+
+        # 桥接表：同时与两张以上已选表相连、能把互不相连的已选表连接起来的表（如order_details）
+        while len(expanded) < max_expanded:
+            components = self._components(chosen)
+            if len(set(components.values())) <= 1:
+                break
+            best, best_key = None, None
+            for table in self.tables:
+                if table in chosen:
+                    continue
+                linked = {components[neighbor] for neighbor in self._neighbors(table) if neighbor in components}
+                if len(linked) >= 2:
+                    key = (len(linked), scores.get(table, 0.0))
+                    if best_key is None or key > best_key:
+                        best, best_key = table, key
+            if best is None:
+                break
+            expanded.append(best)
+            chosen.add(best)
+
+        return [table for table in self.tables if table in chosen]
+
+    def _components(self, tables: set) -> Dict[str, int]:
+        """已选表按连接关系划分的连通分量编号"""
+        component: Dict[str, int] = {}
+        for start in sorted(tables, key=self.positions.get):
+            if start in component:
+                continue
+            start_id = component[start] = len(set(component.values()))
+            stack = [start]
+            while stack:
+                current = stack.pop()
+                for neighbor in self._neighbors(current):
+                    if neighbor in tables and neighbor not in component:
+                        component[neighbor] = start_id
+                        stack.append(neighbor)
+        return component
+
+# 进程级索引缓存，按schema指纹复用
+_indexes: Dict[str, SchemaIndex] = {}
+_indexes_lock = threading.Lock()
+MAX_CACHED_INDEXES = 8
+
+def get_schema_index(schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> SchemaIndex:
+    key = schema_fingerprint(schema_info, table_descriptions)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            if len(_indexes) >= MAX_CACHED_INDEXES:
+                _indexes.pop(next(iter(_indexes)))
+            index = _indexes[key] = SchemaIndex(schema_info, table_descriptions)
+        return index
+
+def schema_index_settings(llm_config: Optional[Dict] = None) -> Dict[str, Any]:
+    """从LLM配置的schema_index读取设置"""
+    settings = (llm_config or {}).get("schema_index") or {}
+    return {
+        "enabled": bool(settings.get("enabled", True)),
+        "top_k": int(settings.get("top_k", DEFAULT_TOP_K)),
+        "min_tables": int(settings.get("min_tables", DEFAULT_MIN_TABLES)),
+        "prefer_prompt_cache": bool(settings.get("prefer_prompt_cache", False))
+    }
+
+def prune_schema(question: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str],
+                 llm_config: Optional[Dict] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """只保留与问题相关的表，返回(schema_info, table_descriptions)；不需要裁剪或优先使用提示缓存时原样返回"""
+    settings = schema_index_settings(llm_config)
+    if not settings["enabled"] or settings["prefer_prompt_cache"] or len(schema_info) <= settings["min_tables"]:
+        return schema_info, table_descriptions
+    tables = get_schema_index(schema_info, table_descriptions).select_tables(question, settings["top_k"])
+    if not tables:
+        return schema_info, table_descriptions
+    return ({table: schema_info[table] for table in tables},
+            {table: table_descriptions[table] for table in tables if table in table_descriptions})
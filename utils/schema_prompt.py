@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Schema提示文本
+把保存的表结构（schema_config中的tables和descriptions）渲染为提示中使用的Markdown表格，
+供单条SQL生成、意图与SQL合并生成以及分析计划的批量SQL生成共用。
+
+提示按"稳定前缀 + 可变后缀"组织，可以命中OpenAI/Azure的提示缓存（按前缀匹配）：
+与问题无关的说明、示例和输出要求放在最前面，其后是schema，用户问题放在最后。
+表数量超过schema_index.min_tables时schema按问题裁剪，不同问题的表不同，共享前缀只到说明为止；
+schema_index.prefer_prompt_cache为true时不裁剪，同一数据库的请求共享包含完整schema的前缀
+（每次请求的输入token更多，但命中缓存的部分按折扣计费且首token更快），取舍见schema_index。
+每张表的渲染结果预先生成并在进程内缓存，schema_config.json的修改时间变化时重新生成。
+"""
+
+import os
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from utils.schema_index import prune_schema
+
+SCHEMA_CONFIG_FILE = "schema_config.json"
+
+SQL_INSTRUCTIONS = "请根据用户问题和数据库schema生成SQL查询。\n\n重要要求：\n- 只返回可执行的SQL语句\n- 不要包含任何解释说明\n- 不要添加注释或描述\n- 直接返回SQL代码"
+
+def _table_columns(table_info: Any) -> Optional[List[Any]]:
+    # 处理不同的schema格式
+    if isinstance(table_info, dict):
+        return table_info.get("columns", [])
+    elif isinstance(table_info, list):
+        return table_info
+    return None
+
+def _render_table(table: str, table_info: Any, table_desc: str) -> str:
+    """单张表：以"表: 名称 - 描述"开头，后接列名/类型/描述表格"""
+    text = f"\n\n表: {table}"
+    if table_desc:
+        text += f" - {table_desc}"
+    text += "\n"
+
+    columns = _table_columns(table_info)
+    if columns:
+        text += "| 列名 | 类型 | 描述 |\n"
+        text += "| --- | --- | --- |\n"
+        for col in columns:
+            if isinstance(col, dict):
+                name = col.get("name", "")
+                col_type = col.get("type", "")
+                comment = col.get("comment", "")
+                text += f"| {name} | {col_type} | {comment} |\n"
+            else:
+                # 如果col不是字典，直接添加
+                text += f"| {col} | - | - |\n"
+    else:
+        text += "表结构信息未配置\n"
+    return text
+
+def _render_table_outline(table: str, table_info: Any, table_desc: str) -> str:
+    """单张表的列表形式（分析计划提示使用）"""
+    text = f"\n表: {table}"
+    if table_desc:
+        text += f" - {table_desc}"
+    text += "\n"
+    for col in _table_columns(table_info) or []:
+        if isinstance(col, dict):
+            text += f"  - {col.get('name', '')} ({col.get('type', '')}): {col.get('comment', '')}\n"
+        else:
+            # 如果col不是字典，直接添加
+            text += f"  - {col}\n"
+    return text
+
+class SchemaBlock:
+    """一个数据库的schema及预先渲染好的每张表的提示文本"""
+
+    def __init__(self, schema_info: Dict[str, Any], table_descriptions: Dict[str, str]):
+        self.tables = schema_info
+        self.descriptions = table_descriptions
+        self.table_texts = {table: _render_table(table, info, table_descriptions.get(table, ""))
+                            for table, info in schema_info.items()}
+        self.text = "".join(self.table_texts.values())
+        self._outline: Optional[str] = None
+
+    def covers(self, schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> bool:
+        """schema_info是否为本schema或从中挑出的部分表（表定义为同一对象、描述相同）"""
+        if schema_info is self.tables:
+            return table_descriptions is self.descriptions or table_descriptions == self.descriptions
+        return all(self.tables.get(table) is info and table_descriptions.get(table, "") == self.descriptions.get(table, "")
+                   for table, info in schema_info.items())
+
+    def render(self, tables: Optional[List[str]] = None) -> str:
+        if tables is None:
+            return self.text
+        return "".join(self.table_texts[table] for table in tables)
+
+    def outline(self) -> str:
+        if self._outline is None:
+            self._outline = "".join(_render_table_outline(table, info, self.descriptions.get(table, ""))
+                                    for table, info in self.tables.items())
+        return self._outline
+
+# 进程级缓存：(schema_config.json路径, 数据库类型) -> (文件版本, SchemaBlock)
+_schema_blocks: Dict[Tuple[str, str], Tuple[Any, SchemaBlock]] = {}
+_schema_blocks_lock = threading.Lock()
+
+def load_schema_block(config_manager, database_type: str) -> SchemaBlock:
+    """读取保存的schema并预先渲染；schema_config.json的修改时间和大小不变时直接返回缓存"""
+    path = os.path.abspath(os.path.join(config_manager.config_dir, SCHEMA_CONFIG_FILE))
+    try:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        version = None
+    key = (path, database_type)
+    with _schema_blocks_lock:
+        cached = _schema_blocks.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    schema_config = config_manager.load_schema_config().get(database_type, {})
+    block = SchemaBlock(schema_config.get("tables", {}), schema_config.get("descriptions", {}))
+    with _schema_blocks_lock:
+        _schema_blocks[key] = (version, block)
+    return block
+
+def _cached_block(schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> Optional[SchemaBlock]:
+    with _schema_blocks_lock:
+        blocks = [block for _, block in _schema_blocks.values()]
+    for block in blocks:
+        if block.covers(schema_info, table_descriptions):
+            return block
+    return None
+
+def format_schema_tables(schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> str:
+    """渲染全部表的列信息，每张表以"表: 名称 - 描述"开头，后接列名/类型/描述表格；
+    schema来自load_schema_block时直接使用预先渲染的文本"""
+    block = _cached_block(schema_info, table_descriptions)
+    if block is not None:
+        return block.render(None if schema_info is block.tables else list(schema_info))
+    return "".join(_render_table(table, info, table_descriptions.get(table, "")) for table, info in schema_info.items())
+
+def format_schema_outline(schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> str:
+    """以列表形式渲染全部表（分析计划提示使用）"""
+    block = _cached_block(schema_info, table_descriptions)
+    if block is not None and schema_info is block.tables:
+        return block.outline()
+    return "".join(_render_table_outline(table, info, table_descriptions.get(table, "")) for table, info in schema_info.items())
+
+def build_schema_messages(question: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str],
+                          llm_config: Optional[Dict] = None) -> Tuple[str, str]:
+    """单条查询的SQL生成提示，返回(system提示, 用户问题)；表较多时只包含与问题相关的表（见schema_index）"""
+    schema_info, table_descriptions = prune_schema(question, schema_info, table_descriptions, llm_config)
+    system_prompt = f"""### 数据库查询
+
+{SQL_INSTRUCTIONS}
+
+### 数据库Schema:
+{format_schema_tables(schema_info, table_descriptions)}"""
+    return system_prompt, f"用户问题: {question}"
+
+def build_schema_prompt(question: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str],
+                        llm_config: Optional[Dict] = None) -> str:
+    """单条查询的完整SQL生成提示（system提示在前，用户问题在后）"""
+    return "\n\n".join(build_schema_messages(question, schema_info, table_descriptions, llm_config))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+问题 -> SQL 语义缓存
+生成并成功执行的SQL按 规范化问题 + 数据库类型 + 数据库名 + 连接指纹 保存到本地SQLite，
+同一问题或措辞略有不同的问题直接复用，不再调用LLM；不同主机、区域或数据库上的同名问题互不命中。
+- 精确匹配：规范化（全半角统一、小写，去掉"请查询""有哪些"等提问用语、空白和标点）后的问题文本相同
+- 近似匹配（similarity_threshold小于1时启用）：与缓存问题的差别全部是不影响查询内容的用语
+  （"所有""全部""当前"、语气词、冠词等，可互相替换或增删），即再去掉这些用语后两者相同；
+  "每月"与"每周"、"大于"与"小于"、"前10"与"前5"这类改变含义的差别不会命中。
+  返回的相似度为两者规范化文本的字符1-3-gram余弦相似度，仅用于展示
+- 失效：每条记录保存SQL引用的各张表在schema_config中的定义指纹，命中时任一引用表的定义或描述变化、
+  或表已被删除，该记录即失效并删除；其他表的修改不影响
+不依赖外部向量服务，只使用标准库sqlite3。
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, "cache", "sql_semantic_cache.db")
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+DEFAULT_MAX_ENTRIES = 5000
+NGRAM_RANGE = (1, 3)
+
+_SEPARATORS = re.compile(r'[\s\W_]+', re.UNICODE)
+# 不影响查询内容的礼貌用语和提问方式
+_FILLERS = re.compile(r'请问|请|帮我|帮忙|麻烦|查询一下|查一下|看一下|查询|查看|显示|列出|给出|告诉我|一下|分别|'
+                      r'是哪些|有哪些|是什么|是多少|吗|呢|的|\b(please|show me|show|list|give me|what are|what is|tell me)\b')
+# 近似匹配时额外忽略的用语：不改变查询的范围限定词、语气词和冠词
+_NEAR_MATCH_NOISE = re.compile(r'所有的?|全部的?|目前|当前|现在|吧|啊|呀|\b(all|the|a|an|current|currently)\b')
+# 连接指纹使用的配置项：决定SQL面向哪个实例/目录，不包含密码等凭据
+CONNECTION_FINGERPRINT_KEYS = ("host", "port", "region", "catalog_id", "workgroup")
+# SQL中的字符串常量和注释，提取引用表时先去掉
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_SQL_IDENTIFIER = re.compile(r'[`"\[]?([A-Za-z_][\w$]*)[`"\]]?(?:\s*\.\s*[`"\[]?([A-Za-z_][\w$]*)[`"\]]?)*')
+
+def normalize_question(question: str) -> str:
+    """全角转半角、小写，去掉礼貌用语、空白和标点"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    return _SEPARATORS.sub("", _FILLERS.sub(" ", text))
+
+def _near_match_key(question: str) -> str:
+    """在normalize_question的基础上再去掉_NEAR_MATCH_NOISE中的用语，近似匹配要求两者相同"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    return _SEPARATORS.sub("", _NEAR_MATCH_NOISE.sub(" ", _FILLERS.sub(" ", text)))
+
+def connection_fingerprint(db_config: Optional[Dict[str, Any]]) -> str:
+    """数据库连接指纹（主机、端口、区域等），只保留哈希"""
+    relevant = {key: (db_config or {}).get(key) for key in CONNECTION_FINGERPRINT_KEYS}
+    payload = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _scope(database_type: str, db_config: Optional[Dict[str, Any]]) -> tuple:
+    """缓存记录的作用域：(数据库类型, 数据库名, 连接指纹)"""
+    return database_type, str((db_config or {}).get("database") or ""), connection_fingerprint(db_config)
+
+def _ngrams(text: str) -> Counter:
+    padded = f"^{text}$"
+    low, high = NGRAM_RANGE
+    return Counter(padded[i:i + n] for n in range(low, high + 1) for i in range(len(padded) - n + 1))
+
+def _cosine(left: Counter, right: Counter) -> float:
+    if not left or not right:
+        return 0.0
+    dot = sum(count * right.get(gram, 0) for gram, count in left.items())
+    norm = math.sqrt(sum(c * c for c in left.values())) * math.sqrt(sum(c * c for c in right.values()))
+    return dot / norm if norm else 0.0
+
+def referenced_tables(sql: str, schema_info: Dict[str, Any]) -> List[str]:
+    """SQL中出现的schema表名（忽略大小写，支持 库.表 写法），按schema原顺序返回"""
+    text = _SQL_LITERALS.sub(" ", sql or "")
+    names = set()
+    for match in _SQL_IDENTIFIER.finditer(text):
+        parts = [part.lower() for part in re.findall(r'[A-Za-z_][\w$]*', match.group(0))]
+        names.update(parts)
+        names.add(".".join(parts))
+    return [table for table in schema_info
+            if table.lower() in names or table.rsplit(".", 1)[-1].lower() in names]
+
+def table_fingerprint(table: str, schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> str:
+    payload = json.dumps([schema_info.get(table), table_descriptions.get(table, "")],
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _fingerprints(tables: List[str], schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> Dict[str, str]:
+    return {table: table_fingerprint(table, schema_info, table_descriptions) for table in tables}
+
+_SCOPE_CONDITION = "database_type = ? AND database_name = ? AND connection = ?"
+
+class SqlSemanticCache:
+    """SQLite中的问题 -> SQL缓存，每次操作使用独立连接，可在多个线程中使用"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "invalidated": 0, "stored": 0}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sql_cache)")]
+            if columns and "connection" not in columns:
+                # 旧版本的记录没有数据库名和连接指纹，无法确定所属的数据库，直接丢弃
+                conn.execute("DROP TABLE sql_cache")
+                print("SQL语义缓存格式已更新，清空旧记录")
+            conn.execute("""CREATE TABLE IF NOT EXISTS sql_cache (
+                database_type TEXT NOT NULL,
+                database_name TEXT NOT NULL,
+                connection TEXT NOT NULL,
+                question_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                tables TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (database_type, database_name, connection, question_key))""")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """提交并关闭的连接"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, question: str, database_type: str, db_config: Optional[Dict[str, Any]], schema_info: Dict[str, Any],
+               table_descriptions: Dict[str, str], threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> Optional[Dict[str, Any]]:
+        """返回 {"sql", "question", "similarity", "hits"}；没有可用的缓存时返回None"""
+        key = normalize_question(question)
+        if not key:
+            return None
+        scope = _scope(database_type, db_config)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT question_key, question, sql, tables, hits FROM sql_cache "
+                               f"WHERE {_SCOPE_CONDITION} AND question_key = ?", scope + (key,)).fetchone()
+            candidates = [(1.0, row)] if row else []
+            if not candidates and threshold < 1.0:
+                rows = conn.execute(f"SELECT question_key, question, sql, tables, hits FROM sql_cache WHERE {_SCOPE_CONDITION}",
+                                    scope).fetchall()
+                query_grams = _ngrams(key)
+                near_key = _near_match_key(question)
+                # 差别中含有可能改变查询含义的字词时不使用；措辞最接近的优先
+                candidates = [(_cosine(query_grams, _ngrams(candidate[0])), candidate)
+                              for candidate in rows if _near_match_key(candidate[1]) == near_key]
+                candidates.sort(key=lambda item: -item[0])
+
+            for similarity, (question_key, cached_question, sql, tables, hits) in candidates:
+                stored = json.loads(tables)
+                if stored != _fingerprints(list(stored), schema_info, table_descriptions):
+                    # 引用的表已修改或删除
+                    conn.execute(f"DELETE FROM sql_cache WHERE {_SCOPE_CONDITION} AND question_key = ?",
+                                 scope + (question_key,))
+                    self.stats["invalidated"] += 1
+                    print(f"SQL缓存失效（引用的表已修改）: {cached_question}")
+                    continue
+                conn.execute(f"UPDATE sql_cache SET hits = hits + 1, last_used = ? WHERE {_SCOPE_CONDITION} AND question_key = ?",
+                             (time.time(),) + scope + (question_key,))
+                self.stats["exact_hits" if similarity >= 1.0 else "similar_hits"] += 1
+                return {"sql": sql, "question": cached_question, "similarity": similarity, "hits": hits + 1}
+            self.stats["misses"] += 1
+        return None
+
+    def store(self, question: str, database_type: str, db_config: Optional[Dict[str, Any]], sql: str,
+              schema_info: Dict[str, Any], table_descriptions: Dict[str, str]) -> bool:
+        """保存成功执行的SQL；无法确定引用的表时以全部表的指纹作为版本"""
+        key = normalize_question(question)
+        if not key or not sql:
+            return False
+        tables = referenced_tables(sql, schema_info) or list(schema_info)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sql_cache (database_type, database_name, connection, question_key, question, sql, "
+                         "tables, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                         _scope(database_type, db_config) + (key, question, sql,
+                          json.dumps(_fingerprints(tables, schema_info, table_descriptions), ensure_ascii=False), now, now))
+            # 超出容量时删除最久未使用的记录
+            conn.execute("DELETE FROM sql_cache WHERE rowid IN (SELECT rowid FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                         (self.max_entries,))
+            self.stats["stored"] += 1
+        return True
+
+    def invalidate(self, question: str, database_type: str, db_config: Optional[Dict[str, Any]]) -> None:
+        """删除某个问题的缓存（如缓存的SQL执行失败）"""
+        with self._lock, self._connect() as conn:
+            conn.execute(f"DELETE FROM sql_cache WHERE {_SCOPE_CONDITION} AND question_key = ?",
+                         _scope(database_type, db_config) + (normalize_question(question),))
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+            return dict(self.stats, entries=entries)
+
+# 进程级缓存实例，按数据库文件路径复用
+_caches: Dict[str, SqlSemanticCache] = {}
+_caches_lock = threading.Lock()
+
+def sql_cache_settings(llm_config: Optional[Dict] = None) -> Dict[str, Any]:
+    """从LLM配置的sql_cache读取设置"""
+    settings = (llm_config or {}).get("sql_cache") or {}
+    return {
+        "enabled": bool(settings.get("enabled", True)),
+        "similarity_threshold": float(settings.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)),
+        "max_entries": int(settings.get("max_entries", DEFAULT_MAX_ENTRIES)),
+        "path": settings.get("path") or DEFAULT_CACHE_PATH
+    }
+
+def get_sql_cache(llm_config: Optional[Dict] = None) -> Optional[SqlSemanticCache]:
+    """配置启用时返回缓存实例；数据库文件无法创建时返回None"""
+    settings = sql_cache_settings(llm_config)
+    if not settings["enabled"]:
+        return None
+    with _caches_lock:
+        cache = _caches.get(settings["path"])
+        if cache is None:
+            try:
+                cache = _caches[settings["path"]] = SqlSemanticCache(settings["path"], settings["max_entries"])
+            except (OSError, sqlite3.Error) as e:
+                print(f"SQL语义缓存不可用: {str(e)}")
+                return None
+        cache.max_entries = settings["max_entries"]
+        return cache
+
+def lookup_cached_sql(question: str, database_type: str, db_config: Optional[Dict[str, Any]], schema_info: Dict[str, Any],
+                      table_descriptions: Dict[str, str], llm_config: Optional[Dict] = None) -> Optional[Dict[str, Any]]:
+    cache = get_sql_cache(llm_config)
+    if cache is None:
+        return None
+    try:
+        return cache.lookup(question, database_type, db_config, schema_info, table_descriptions,
+                            sql_cache_settings(llm_config)["similarity_threshold"])
+    except sqlite3.Error as e:
+        print(f"读取SQL语义缓存失败: {str(e)}")
+        return None
+
+def store_cached_sql(question: str, database_type: str, db_config: Optional[Dict[str, Any]], sql: str,
+                     schema_info: Dict[str, Any], table_descriptions: Dict[str, str], llm_config: Optional[Dict] = None) -> bool:
+    cache = get_sql_cache(llm_config)
+    if cache is None:
+        return False
+    try:
+        return cache.store(question, database_type, db_config, sql, schema_info, table_descriptions)
+    except sqlite3.Error as e:
+        print(f"保存SQL语义缓存失败: {str(e)}")
+        return False
+
+def invalidate_cached_sql(question: str, database_type: str, db_config: Optional[Dict[str, Any]],
+                          llm_config: Optional[Dict] = None) -> None:
+    cache = get_sql_cache(llm_config)
+    if cache is None:
+        return
+    try:
+        cache.invalidate(question, database_type, db_config)
+    except sqlite3.Error as e:
+        print(f"删除SQL语义缓存失败: {str(e)}")